@@ -0,0 +1,210 @@
+"""
+Two-level cache of generated RAG answers.
+
+Students ask the same questions again and again. Before a question reaches
+the model:
+
+1. exact: the normalised question (case, spacing, trailing punctuation)
+   with the same retrieval settings returns the stored answer without
+   embedding, retrieval or generation;
+2. semantic: otherwise, once the question is embedded and its context
+   retrieved, a stored question whose embedding has cosine similarity of at
+   least ``semantic_threshold`` returns its answer, provided it names the
+   same identifiers (words with digits: "experiment 3", "ap-1001") and was
+   answered from the same chunks. Near-identical wording about different
+   material ("focal length of lens 1" / "of lens 2") is answered afresh.
+
+Entries are tied to the index ``generation`` (see
+``SegmentedIndex.version``): once documents are added, changed or removed,
+earlier answers are no longer served, and ``invalidate`` deletes them.
+
+Answers live in SQLite, so they survive restarts and are shared by every
+CLI session and server on the index; the embeddings of one (scope,
+generation) are kept in memory as one matrix, so a semantic lookup is a
+single matrix-vector product.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from lazy_imports import lazy_import
+from rag_index import top_k
+
+np = lazy_import("numpy")
+
+ANSWER_CACHE_FILE = "answer_cache.sqlite"
+DEFAULT_SEMANTIC_THRESHOLD = 0.9  # safe that low only because identifiers and context must match too
+SEMANTIC_CANDIDATES = 8  # most similar stored questions checked per lookup
+DEFAULT_MAX_ENTRIES = 5000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key        TEXT PRIMARY KEY,   -- SHA-256 of scope and normalised question
+    scope      TEXT NOT NULL,      -- retrieval and model settings the answer was produced with
+    generation TEXT NOT NULL,      -- index version the answer was produced from
+    query      TEXT NOT NULL,
+    vector     BLOB,               -- float32 question embedding; NULL for sparse-only retrieval
+    sources    TEXT NOT NULL,      -- JSON [[citation, score], ...] of the context chunks
+    answer     TEXT NOT NULL,
+    used       REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_scope ON answers (scope, generation);
+"""
+_SPACE = re.compile(r"\s+")
+_TRAILING = re.compile(r"[\s?!.]+$")
+_IDENTIFIER = re.compile(r"\w*\d\w*")
+
+
+def normalise_query(query: str) -> str:
+    """The form questions are matched on: lower case, single spaces, no trailing ``?``/``!``/``.``."""
+    return _TRAILING.sub("", _SPACE.sub(" ", query.strip().lower()))
+
+
+def query_identifiers(query: str) -> List[str]:
+    """Words of ``query`` containing digits, which a reworded question must keep to share an answer."""
+    return sorted(set(_IDENTIFIER.findall(query.lower())))
+
+
+def answer_scope(**settings: Any) -> str:
+    """Canonical string of the settings an answer depends on (model, mode, k, filters, ...)."""
+    return json.dumps(settings, sort_keys=True, default=str)
+
+
+class AnswerCache:
+    """Persistent answers keyed by question, with a semantic fallback; safe to share between threads."""
+
+    def __init__(self, path: str, semantic_threshold: float = DEFAULT_SEMANTIC_THRESHOLD,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.semantic_threshold = semantic_threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # a lost answer is only asked again
+        self._conn.execute("PRAGMA busy_timeout=5000")  # CLI sessions and a server may share the file
+        self._conn.executescript(_SCHEMA)
+        self._matrices: Dict[Tuple[str, str], Tuple[List[str], "np.ndarray"]] = {}
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "semantic_rejected": 0, "misses": 0}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _key(query: str, scope: str) -> str:
+        return hashlib.sha256(f"{scope}\0{normalise_query(query)}".encode("utf-8")).hexdigest()
+
+    def get(self, query: str, scope: str, generation: str) -> Optional[Dict[str, Any]]:
+        """``{"answer", "sources"}`` stored for this exact (normalised) question, or None."""
+        key = self._key(query, scope)
+        with self._lock:
+            row = self._conn.execute("SELECT answer, sources FROM answers WHERE key = ? AND generation = ?",
+                                     (key, generation)).fetchone()
+            if row is None:
+                return None
+            self._stats["exact_hits"] += 1
+            with self._conn:
+                self._conn.execute("UPDATE answers SET used = ? WHERE key = ?", (time.time(), key))
+        return {"answer": row[0], "sources": json.loads(row[1])}
+
+    def get_similar(self, query: str, query_vector: Sequence[float], scope: str, generation: str,
+                    sources: Sequence[Tuple[str, float]]) -> Optional[Dict[str, Any]]:
+        """The answer to the most similar stored question with the same identifiers as ``query``,
+        answered from the same chunks as ``sources``.
+
+        Counts a miss when there is none, so call it after ``get`` has missed. A hit is
+        stored under ``query`` too, so asking it again is an exact hit.
+        """
+        if self.semantic_threshold <= 0 or query_vector is None:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+        vector = np.asarray(query_vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        wanted = sorted(citation for citation, _ in sources)
+        identifiers = query_identifiers(query)
+        with self._lock:
+            keys, matrix = self._matrix(scope, generation)
+            similarities = matrix @ vector if len(keys) else np.zeros(0, dtype=np.float32)
+            candidates = [i for i in top_k(similarities, SEMANTIC_CANDIDATES)
+                          if similarities[i] >= self.semantic_threshold]
+            for i in candidates:
+                row = self._conn.execute("SELECT answer, sources, query FROM answers WHERE key = ?",
+                                         (keys[i],)).fetchone()
+                if row is None:
+                    continue  # evicted by another process
+                stored = json.loads(row[1])
+                if sorted(citation for citation, _ in stored) != wanted or query_identifiers(row[2]) != identifiers:
+                    continue
+                self._stats["semantic_hits"] += 1
+                with self._conn:
+                    self._conn.execute("UPDATE answers SET used = ? WHERE key = ?", (time.time(), keys[i]))
+                    self._put(query, vector, scope, generation, stored, row[0])
+                return {"answer": row[0], "sources": stored}
+            self._stats["misses"] += 1
+            if candidates:
+                self._stats["semantic_rejected"] += 1  # similar wording, but about something else
+        return None
+
+    def put(self, query: str, query_vector: Optional[Sequence[float]], scope: str, generation: str,
+            sources: Sequence[Tuple[str, float]], answer: str):
+        vector = None
+        if query_vector is not None:
+            vector = np.asarray(query_vector, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._lock, self._conn:
+            self._put(query, vector, scope, generation, sources, answer)
+
+    def _put(self, query: str, vector: Optional["np.ndarray"], scope: str, generation: str,
+             sources: Sequence[Sequence], answer: str):
+        """Store an answer (lock held, inside a transaction); ``vector`` is L2-normalised."""
+        key = self._key(query, scope)
+        blob = None if vector is None else vector.astype(np.float32).tobytes()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO answers (key, scope, generation, query, vector, sources, answer, used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, scope, generation, query, blob, json.dumps([list(s) for s in sources]), answer, time.time()))
+        count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute("DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY used LIMIT ?)",
+                               (count - self.max_entries,))
+            self._matrices.clear()
+        elif blob is not None and (scope, generation) in self._matrices:
+            keys, matrix = self._matrices[(scope, generation)]
+            if key not in keys:
+                row = np.frombuffer(blob, dtype=np.float32)[None]
+                self._matrices[(scope, generation)] = (keys + [key], np.vstack([matrix, row]) if keys else row)
+
+    def invalidate(self, generation: str) -> int:
+        """Delete answers produced from any other index generation; returns how many."""
+        with self._lock, self._conn:
+            deleted = self._conn.execute("DELETE FROM answers WHERE generation != ?", (generation,)).rowcount
+            self._matrices = {k: v for k, v in self._matrices.items() if k[1] == generation}
+        return deleted
+
+    def _matrix(self, scope: str, generation: str) -> Tuple[List[str], "np.ndarray"]:
+        """Keys and stacked embeddings of the stored questions of one scope and generation (lock held)."""
+        if (scope, generation) not in self._matrices:
+            rows = self._conn.execute(
+                "SELECT key, vector FROM answers WHERE scope = ? AND generation = ? AND vector IS NOT NULL",
+                (scope, generation)).fetchall()
+            vectors = [np.frombuffer(blob, dtype=np.float32) for _, blob in rows]
+            matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+            self._matrices[(scope, generation)] = ([key for key, _ in rows], matrix)
+        return self._matrices[(scope, generation)]
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+        stats["exact_hit_rate"] = stats["exact_hits"] / lookups if lookups else 0.0
+        stats["semantic_hit_rate"] = stats["semantic_hits"] / lookups if lookups else 0.0
+        return stats
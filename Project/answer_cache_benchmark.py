@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Measure the answer cache (``answer_cache``) on a stream of repeated questions.
+
+A class asks about the apparatus of the ``context_benchmark`` corpus: a few
+questions are popular (Zipf-distributed), and each ask uses one of several
+wordings, differing in case and punctuation or reworded. Every question
+names its apparatus, and questions about different apparatus differ in one
+word only, so a cache matching on wording alone would answer them wrongly.
+The model is simulated: answers name the apparatus asked about, calls cost
+``--llm-ms`` and query embeddings ``--embed-ms`` (accounted, not slept).
+
+For each semantic threshold it reports exact and semantic hits, model calls,
+wrong answers (an answer about another apparatus) and the mean time per
+question; then it removes one PDF and checks that nothing cached is served.
+The offline hashing embedder scores rewordings lower than a real embedding
+model does, so semantic hit rates here are a lower bound.
+
+Usage:
+    python answer_cache_benchmark.py --asks 2000
+    python answer_cache_benchmark.py --thresholds 0 0.9 0.95 0.98
+"""
+
+import argparse
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+from typing import List
+
+from answer_cache import AnswerCache, normalise_query
+from context_benchmark import synthetic_corpus
+from rag_cli import cached_answer
+from rag_index import SEARCH_MODES
+from rag_segments import SegmentedIndex
+from retrieval_benchmark import hashing_embedder
+
+_WORDINGS = (
+    "What range, calibration standard and storage temperature does apparatus {} need?",
+    "what range, calibration standard and storage temperature does apparatus {} need",
+    "WHAT range, calibration standard and storage temperature does apparatus {} need ?",
+    "What range, calibration standard and storage temperature does apparatus {} require?",
+    "What range, calibration standard and storage temperature does the apparatus {} need?",
+)
+_APPARATUS = re.compile(r"ap-\d+")
+
+
+def question_stream(models: List[str], asks: int, seed: int = 3) -> List[str]:
+    """``asks`` questions: apparatus by Zipf popularity (s = 1), wording uniformly at random."""
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(models))]
+    return [rng.choice(_WORDINGS).format(model) for model in rng.choices(models, weights, k=asks)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exact and semantic answer caching.")
+    parser.add_argument("--apparatus", type=int, default=200, help="Apparatus in the generated corpus")
+    parser.add_argument("--asks", type=int, default=2000, help="Questions asked")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.0, 0.9, 0.95])
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--mode", choices=SEARCH_MODES, default="hybrid")
+    parser.add_argument("--llm-ms", type=float, default=2000.0, help="Simulated time of one answer")
+    parser.add_argument("--embed-ms", type=float, default=150.0, help="Simulated time of one query embedding")
+    parser.add_argument("--hash-dim", type=int, default=256)
+    args = parser.parse_args()
+
+    documents, queries = synthetic_corpus(args.apparatus)
+    models = [_APPARATUS.search(q["query"]).group() for q in queries]
+    random.Random(7).shuffle(models)
+    stream = question_stream(models, args.asks)
+    embed = hashing_embedder(args.hash_dim)
+    calls = {"llm": 0, "embed": 0}
+
+    def count_embed(texts: List[str]):
+        calls["embed"] += 1
+        return embed(texts, "retrieval_query")
+
+    def fake_answer(query: str, context: List[str]) -> str:
+        calls["llm"] += 1
+        return f"Answer about {_APPARATUS.search(query).group()}."
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = SegmentedIndex.open(os.path.join(directory, "index"), {"benchmark": 1})
+        index.update({name: name for name in documents},
+                     lambda names: [chunk for name in names for chunk in documents[name]], embed)
+        print(f"{len(index)} chunks, {args.asks} asks of {len(set(stream))} distinct questions "
+              f"about {len(set(_APPARATUS.findall(' '.join(stream))))} apparatus\n")
+        print(f"Without the cache: {args.asks} LLM calls, {args.llm_ms + args.embed_ms:.0f} ms/ask\n")
+        print(f"{'threshold':>9}{'exact':>8}{'semantic':>10}{'LLM calls':>11}{'wrong':>7}"
+              f"{'rejected':>10}{'ms/ask':>9}{'overhead':>10}")
+        print("-" * 74)
+        for threshold in args.thresholds:
+            cache = AnswerCache(os.path.join(directory, f"answers-{threshold}.sqlite"), threshold)
+            calls.update(llm=0, embed=0)
+            wrong, overhead = 0, []
+            for query in stream:
+                started = time.perf_counter()
+                answer, origin = cached_answer(query, index, cache, k=args.k, mode=args.mode,
+                                               embed=count_embed, answer=fake_answer)
+                overhead.append((time.perf_counter() - started) * 1000)
+                wrong += _APPARATUS.search(answer).group() != _APPARATUS.search(query).group()
+            stats = cache.stats()
+            simulated = (statistics.mean(overhead)
+                         + (calls["llm"] * args.llm_ms + calls["embed"] * args.embed_ms) / len(stream))
+            print(f"{threshold:>9.2f}{stats['exact_hit_rate']:>8.1%}{stats['semantic_hit_rate']:>10.1%}"
+                  f"{calls['llm']:>11}{wrong:>7}{stats['semantic_rejected']:>10}{simulated:>9.0f}"
+                  f"{statistics.mean(overhead):>8.1f}ms")
+
+            # After a PDF is removed, the first ask of each earlier question must not be served from the cache.
+            removed = sorted(documents)[0]
+            index.update({name: name for name in documents if name != removed},
+                         lambda names: [chunk for name in names for chunk in documents[name]], embed)
+            earlier = list({normalise_query(query): query for query in stream}.values())[:50]
+            before = cache.stats()["exact_hits"]
+            for query in earlier:
+                cached_answer(query, index, cache, k=args.k, mode=args.mode, embed=count_embed, answer=fake_answer)
+            print(f"{'':>9}after removing {removed}: {cache.stats()['exact_hits'] - before} of {len(earlier)} "
+                  f"earlier questions served stale, {cache.invalidate(index.version())} stale answers deleted")
+            index.update({name: name for name in documents},
+                         lambda names: [chunk for name in names for chunk in documents[name]], embed)
+            cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Multi-process batch sandbox generation.
+
+Topics are distributed across a pool of worker processes so that CPU-bound
+work (JSON parsing, template rendering, hashing, writing) uses every core.
+All workers share, through a ``multiprocessing.Manager`` broker process:
+
+- a response cache keyed by (model, prompt), so a prompt repeated across
+  topics costs one LLM call (the cache lives only as long as the run), and
+- a token-bucket request budget, so the whole pool respects one provider
+  rate limit instead of each process assuming it has the full quota.
+
+Results are aggregated into a single JSON manifest. Static simulation
+assets are copied into each sandbox; ``--link-assets`` hard-links them
+instead, which saves space but shares them with the template, so only use
+it for output that is never edited in place.
+
+Usage:
+    python batch_generate.py topics.txt --processes 8 --output-dir generated_sandboxes
+    python batch_generate.py topics.txt --model fake --requests-per-minute 0
+    python batch_generate.py topics.txt --resume     # skip topics finished by a previous run
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+from langgraph_experiment_generator import SandboxGenerator, new_sandbox_state
+from providers import CachedContext, Completion, ModelProvider
+from sandbox_writer import check_sandbox_name, is_complete, read_marker
+
+DEFAULT_MODEL = "gemini-2.5-flash-preview-05-20"
+MANIFEST_NAME = "batch_manifest.json"
+
+
+class SharedBudget:
+    """Token bucket shared by all processes through manager proxies."""
+
+    def __init__(self, manager, requests_per_minute: float):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1.0, requests_per_minute / 60.0 * 5)  # allow ~5 seconds of burst
+        self._lock = manager.Lock()
+        self._state = manager.dict(tokens=self.capacity, updated=time.time())
+
+    def acquire(self):
+        """Block until one request may be sent."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.time()
+                tokens = min(self.capacity, self._state["tokens"] + (now - self._state["updated"]) * self.rate)
+                if tokens >= 1.0:
+                    self._state.update(tokens=tokens - 1.0, updated=now)
+                    return
+                self._state.update(tokens=tokens, updated=now)
+                wait = (1.0 - tokens) / self.rate
+            time.sleep(wait)
+
+
+class BrokeredProvider(ModelProvider):
+    """Wraps a provider with the pool-wide response cache and request budget."""
+
+    def __init__(self, inner: ModelProvider, cache, budget: SharedBudget):
+        super().__init__(inner.model_name)
+        self.inner = inner
+        self.cache = cache
+        self.budget = budget
+
+    def _key(self, prompt: str, max_output_tokens: Optional[int], context: Optional[CachedContext]) -> str:
+        prefix_key = context.key if context is not None else ""
+        return hashlib.sha256(
+            f"{self.model_name}\0{max_output_tokens}\0{prefix_key}\0{prompt}".encode("utf-8")
+        ).hexdigest()
+
+    def complete(self, prompt: str, max_output_tokens: Optional[int] = None,
+                 context: Optional[CachedContext] = None) -> Completion:
+        key = self._key(prompt, max_output_tokens, context)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return Completion(*cached)
+        self.budget.acquire()
+        completion = self.inner.complete(prompt, max_output_tokens=max_output_tokens, context=context)
+        self.cache[key] = (completion.text, completion.finish_reason)
+        return completion
+
+    def create_context(self, prefix: str, ttl_seconds: float = 3600.0) -> CachedContext:
+        return self.inner.create_context(prefix, ttl_seconds=ttl_seconds)
+
+    def delete_context(self, context: CachedContext):
+        self.inner.delete_context(context)
+
+    def embed(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        self.budget.acquire()
+        return self.inner.embed(texts, task_type=task_type)
+
+
+# Per-process worker state, set by _init_worker.
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(model_name: str, cache, budget: SharedBudget, output_dir: str,
+                 store_dir: Optional[str], link_assets: bool):
+    # Raise on a failed call, so the topic is recorded as failed (and retried by --resume) rather than saved.
+    generator = SandboxGenerator(model_name, raise_errors=True)
+    generator.provider = BrokeredProvider(generator.provider, cache, budget)
+    store = None
+    if store_dir:
+        from sandbox_store import SandboxStore
+        store = SandboxStore(store_dir)
+    _worker.update(generator=generator, output_dir=output_dir, store=store, link_assets=link_assets)
+
+
+def generate_topic(topic: str) -> Dict[str, Any]:
+    """Run the full workflow for one topic inside a worker process."""
+    started = time.time()
+    entry: Dict[str, Any] = {"topic": topic, "pid": os.getpid()}
+    try:
+        generator: SandboxGenerator = _worker["generator"]
+        state = generator.compiled_graph().invoke(new_sandbox_state(topic))
+        if state.get("current_step") != "complete":
+            raise RuntimeError(f"Workflow stopped at step '{state.get('current_step')}'")
+        try:
+            check_sandbox_name(state.get("sandbox_name", ""))
+        except ValueError as e:
+            raise RuntimeError(f"{e}; topic skipped, nothing written") from None
+        path = generator.save_content(state, link_assets=_worker["link_assets"], output_dir=_worker["output_dir"])
+        entry.update(status="done", sandbox_name=state["sandbox_name"], path=path,
+                     files=read_marker(path) or {})
+        if _worker["store"] is not None:
+            entry["version"] = _worker["store"].commit(
+                state["sandbox_name"], generator.sandbox_files(state),
+                metadata={"sandbox_topic": topic, "model_name": generator.model_name},
+            )
+    except Exception as e:
+        entry.update(status="failed", error=str(e), traceback=traceback.format_exc())
+    entry["seconds"] = round(time.time() - started, 3)
+    return entry
+
+
+def load_topics(path: str) -> List[str]:
+    with open(path) as f:
+        topics = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    # Preserve order but drop duplicates, which would only overwrite each other.
+    return list(dict.fromkeys(topics))
+
+
+def load_previous(manifest_path: str) -> Dict[str, Dict[str, Any]]:
+    """Finished entries of a previous run whose output is still complete on disk."""
+    try:
+        with open(manifest_path) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {
+        entry["topic"]: entry for entry in previous.get("entries", [])
+        if entry.get("status") == "done" and is_complete(entry.get("path", ""))
+    }
+
+
+def run_batch(topics: List[str], model_name: str = DEFAULT_MODEL, processes: Optional[int] = None,
+              output_dir: str = "generated_sandboxes", store_dir: Optional[str] = None,
+              requests_per_minute: float = 60.0, link_assets: bool = False,
+              resume: bool = False) -> Dict[str, Any]:
+    """Generate every topic with a process pool and write the aggregated manifest."""
+    processes = processes or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    previous = load_previous(manifest_path) if resume else {}
+    pending = [topic for topic in topics if topic not in previous]
+
+    started = time.time()
+    entries: List[Dict[str, Any]] = [dict(previous[t], skipped=True) for t in topics if t in previous]
+    with multiprocessing.Manager() as manager:
+        cache = manager.dict()
+        budget = SharedBudget(manager, requests_per_minute)
+        with ProcessPoolExecutor(
+            max_workers=min(processes, max(1, len(pending))),
+            initializer=_init_worker,
+            initargs=(model_name, cache, budget, output_dir, store_dir, link_assets),
+        ) as pool:
+            futures = {pool.submit(generate_topic, topic): topic for topic in pending}
+            for done_count, future in enumerate(as_completed(futures), 1):
+                entry = future.result()
+                entries.append(entry)
+                status = "✓" if entry["status"] == "done" else "✗"
+                print(f"[{done_count}/{len(pending)}] {status} {entry['topic']} ({entry['seconds']:.1f}s)")
+        cache_entries = len(cache)
+
+    order = {topic: i for i, topic in enumerate(topics)}
+    entries.sort(key=lambda e: order.get(e["topic"], len(order)))
+    manifest = {
+        "model_name": model_name,
+        "processes": processes,
+        "started_at": started,
+        "seconds": round(time.time() - started, 3),
+        "cached_responses": cache_entries,
+        "succeeded": sum(1 for e in entries if e["status"] == "done"),
+        "failed": sum(1 for e in entries if e["status"] != "done"),
+        "entries": entries,
+    }
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=4)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate many sandboxes in parallel worker processes.")
+    parser.add_argument("topics_file", help="Text file with one topic per line")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--output-dir", default="generated_sandboxes")
+    parser.add_argument("--store", default=None, help="Also commit each sandbox to this SandboxStore")
+    parser.add_argument("--requests-per-minute", type=float, default=60.0,
+                        help="Pool-wide LLM request budget (0 disables limiting)")
+    parser.add_argument("--link-assets", action="store_true",
+                        help="Hard-link static simulation assets instead of copying them; linked files are "
+                             "shared with the template, so editing one edits it and every other sandbox")
+    parser.add_argument("--resume", action="store_true", help="Skip topics completed by a previous run")
+    args = parser.parse_args()
+
+    topics = load_topics(args.topics_file)
+    print(f"🧪 Generating {len(topics)} sandboxes with {args.processes or os.cpu_count()} processes")
+    manifest = run_batch(
+        topics,
+        model_name=args.model,
+        processes=args.processes,
+        output_dir=args.output_dir,
+        store_dir=args.store,
+        requests_per_minute=args.requests_per_minute,
+        link_assets=args.link_assets,
+        resume=args.resume,
+    )
+    print(f"\n✅ {manifest['succeeded']} succeeded, {manifest['failed']} failed in {manifest['seconds']:.1f}s")
+    print(f"📋 Manifest: {os.path.join(args.output_dir, MANIFEST_NAME)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Bounded chat memory for the Streamlit chat panel.
+
+Two views of one conversation are kept:
+
+- a ring buffer of the most recent messages for display, so long review
+  sessions do not grow the page (or the session) without bound, and
+- a model context made of a rolling summary plus the newest messages,
+  capped at a token budget. When the unsummarised messages exceed the cap,
+  the oldest ones are folded into the summary by a model call.
+
+Token counts are computed once per message, so building the context costs
+the same at message 10 as at message 1000.
+"""
+
+import html
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from prompt_budget import count_tokens
+
+ROLE_LABELS = {"user": "You", "assistant": "AI", "system": "System"}
+
+SUMMARY_PROMPT = """You maintain the memory of a chat between a user and an assistant that helps build an educational sandbox.
+Rewrite the summary below so it also covers the new messages. Keep decisions, requested changes,
+open questions and facts about the sandbox; drop greetings and repetition. Reply with the summary only,
+in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}"""
+
+
+class ChatMemory:
+    """Ring-buffered display history plus a summarised, token-capped model context."""
+
+    def __init__(self, display_limit: int = 200, context_tokens: int = 1500,
+                 recent_tokens: int = 600, summary_words: int = 150, model_name: str = ""):
+        self.display_limit = display_limit
+        self.context_tokens = context_tokens  # summarise once unsummarised messages exceed this
+        self.recent_tokens = recent_tokens    # newest messages kept verbatim after summarising
+        self.summary_words = summary_words
+        self.model_name = model_name
+        self.clear()
+
+    def clear(self):
+        self.messages: Deque[Dict] = deque(maxlen=self.display_limit)
+        self.summary = ""
+        self.total = 0
+        self.epoch = getattr(self, "epoch", 0) + 1  # invalidates summaries computed before a clear
+        self._pending: List[Dict] = []  # messages not yet folded into the summary
+        self._pending_tokens = 0
+
+    def append(self, role: str, content: str):
+        self.total += 1
+        message = {
+            "seq": self.total,
+            "role": role,
+            "content": content,
+            "tokens": count_tokens(f"{role}: {content}", self.model_name),
+        }
+        self.messages.append(message)
+        self._pending.append(message)
+        self._pending_tokens += message["tokens"]
+
+    def __len__(self) -> int:
+        return self.total
+
+    # --- Model context ---
+    def needs_summary(self) -> bool:
+        return self._pending_tokens > self.context_tokens
+
+    def summary_request(self) -> Optional[Tuple[int, int, str]]:
+        """``(epoch, last_seq, prompt)`` for folding the oldest messages into the summary.
+
+        Messages are folded until at most ``recent_tokens`` of the newest
+        remain verbatim. Returns None when nothing needs folding.
+        """
+        if not self.needs_summary():
+            return None
+        kept, fold = 0, len(self._pending)
+        while fold > 0 and kept + self._pending[fold - 1]["tokens"] <= self.recent_tokens:
+            fold -= 1
+            kept += self._pending[fold]["tokens"]
+        fold = max(fold, 1)
+        prompt = SUMMARY_PROMPT.format(
+            max_words=self.summary_words,
+            summary=self.summary or "(empty)",
+            messages=_transcript(self._pending[:fold]),
+        )
+        return self.epoch, self._pending[fold - 1]["seq"], prompt
+
+    def apply_summary(self, epoch: int, last_seq: int, summary: str) -> bool:
+        """Replace the summary and drop the messages it now covers. Stale results are ignored."""
+        if epoch != self.epoch or not self._pending or last_seq < self._pending[0]["seq"]:
+            return False
+        covered = [m for m in self._pending if m["seq"] <= last_seq]
+        self._pending = self._pending[len(covered):]
+        self._pending_tokens -= sum(m["tokens"] for m in covered)
+        self.summary = summary.strip()
+        return True
+
+    def context(self) -> str:
+        """Summary plus the unsummarised messages, newest last."""
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of the earlier conversation:\n{self.summary}")
+        if self._pending:
+            parts.append(_transcript(self._pending))
+        return "\n\n".join(parts)
+
+    # --- Display ---
+    def window(self, count: int) -> List[Dict]:
+        """The newest ``count`` messages still in the display buffer."""
+        if count >= len(self.messages):
+            return list(self.messages)
+        return list(self.messages)[-count:]
+
+    def render_html(self, count: int) -> str:
+        """The newest ``count`` messages as one HTML block, so a rerun emits a single element."""
+        rows = [
+            f'<div class="chat-message {"chat-user" if m["role"] == "user" else "chat-ai"}">'
+            f'<strong>{ROLE_LABELS.get(m["role"], m["role"].title())}:</strong> {html.escape(m["content"])}</div>'
+            for m in self.window(count)
+        ]
+        return f'<div class="chat-container">{"".join(rows)}</div>'
+
+
+def _transcript(messages: List[Dict]) -> str:
+    return "\n".join(f'{ROLE_LABELS.get(m["role"], m["role"])}: {m["content"]}' for m in messages)
@@ -0,0 +1,163 @@
+"""
+Near-duplicate chunk detection with MinHash and locality-sensitive hashing.
+
+Several editions of one textbook, or lecture notes copied from it, produce
+chunks that differ by a few words. Before a batch of chunks is embedded,
+each group of near-duplicates is collapsed into its first chunk, which
+keeps the others' locations in ``references``::
+
+    {"text": "...", "source": "optics-2e.pdf", "page": 12, ...,
+     "references": [{"source": "optics-3e.pdf", "page": 14, "page_end": 14, "heading": "3.1 Lenses", ...}]}
+
+so the passage is embedded, stored and retrieved once but cited everywhere
+it appears. A chunk counts as live while any of its sources is.
+
+Each chunk is reduced to the set of its word 3-grams (hashed with CRC-32)
+and summarised by ``NUM_PERM`` min-hashes, all computed with numpy over
+blocks of chunks. The fraction of equal min-hashes of two chunks estimates
+the Jaccard similarity of their 3-gram sets. Signatures are cut into
+``BANDS`` bands; chunks sharing any band are candidates, and candidates
+whose estimated similarity reaches the threshold are merged (transitively).
+"""
+
+import re
+import zlib
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+
+DEDUP_THRESHOLD = 0.6  # estimated Jaccard similarity of word 3-grams; one word in 20 changed gives ~0.77
+NUM_PERM = 128
+BANDS = 32  # of 4 rows: a pair at 0.6 shares a band with probability 0.99, at 0.3 with 0.23
+SHINGLE_WORDS = 3
+REFERENCE_FIELDS = ("source", "page", "page_end", "heading", "chapter", "doc_type")
+
+_WORD = re.compile(r"\w+")
+_MERSENNE = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_BLOCK_SHINGLES = 1 << 16  # shingles hashed per block, bounding scratch memory to NUM_PERM * this * 8 bytes
+
+
+def _shingles(text: str, vocabulary: Dict[str, int]) -> "np.ndarray":
+    """32-bit hashes of the word 3-grams of ``text`` (the whole text when it is shorter)."""
+    tokens = _WORD.findall(text.lower())
+    vocabulary.update((w, zlib.crc32(w.encode("utf-8"))) for w in set(tokens).difference(vocabulary))
+    words = np.fromiter(map(vocabulary.__getitem__, tokens), dtype=np.uint64, count=len(tokens))
+    if len(words) < SHINGLE_WORDS:
+        return (words * np.uint64(0x9E3779B1)).sum(keepdims=True) & np.uint64(_MAX_HASH) if len(words) else words
+    grams = words[:1 - SHINGLE_WORDS].copy()
+    for offset in range(1, SHINGLE_WORDS):
+        grams = grams * np.uint64(0x01000193) + words[offset:len(words) - SHINGLE_WORDS + 1 + offset]
+    return grams & np.uint64(_MAX_HASH)
+
+
+def minhash_signatures(texts: Sequence[str], num_perm: int = NUM_PERM, seed: int = 1) -> "np.ndarray":
+    """``(len(texts), num_perm)`` uint32 MinHash signatures; an empty text gets all-ones (matches nothing)."""
+    rng = np.random.RandomState(seed)
+    a = rng.randint(0, 1 << 63, size=(num_perm, 1), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.randint(0, 1 << 63, size=(num_perm, 1), dtype=np.uint64) * np.uint64(2)
+    signatures = np.full((len(texts), num_perm), _MAX_HASH, dtype=np.uint32)
+    vocabulary: Dict[str, int] = {}
+    shingles = [_shingles(text, vocabulary) for text in texts]
+    rows = [i for i, s in enumerate(shingles) if len(s)]
+    start = 0
+    while start < len(rows):
+        end, total = start, 0
+        while end < len(rows) and (end == start or total + len(shingles[rows[end]]) <= _BLOCK_SHINGLES):
+            total += len(shingles[rows[end]])
+            end += 1
+        block = rows[start:end]
+        values = np.concatenate([shingles[i] for i in block])
+        offsets = np.cumsum([0] + [len(shingles[i]) for i in block[:-1]])
+        # Multiply-add-shift hashing of the 32-bit shingles: the high half of (a*x + b) mod 2**64, a odd.
+        hashed = (a * values + b) >> np.uint64(32)
+        signatures[block] = np.minimum.reduceat(hashed, offsets, axis=1).T
+        start = end
+    return signatures
+
+
+def duplicate_groups(signatures: "np.ndarray", threshold: float = DEDUP_THRESHOLD, bands: int = BANDS) -> "np.ndarray":
+    """For each row, the first row of its near-duplicate group (itself when it has none)."""
+    n, num_perm = signatures.shape
+    rows_per_band = num_perm // bands
+    weights = np.random.RandomState(0).randint(1, _MERSENNE, size=rows_per_band, dtype=np.uint64)
+    members = np.flatnonzero(~(signatures == _MAX_HASH).all(axis=1))
+    firsts, others = [], []
+    for band in range(bands):
+        keys = (signatures[members, band * rows_per_band:(band + 1) * rows_per_band].astype(np.uint64) * weights).sum(axis=1)
+        order = np.argsort(keys, kind="stable")  # rows stay ascending within a key
+        keys, rows = keys[order], members[order]
+        bucket_start = np.maximum.accumulate(np.where(np.r_[True, keys[1:] != keys[:-1]], np.arange(len(keys)), 0))
+        paired = rows != rows[bucket_start]
+        firsts.append(rows[bucket_start][paired])
+        others.append(rows[paired])
+    if not firsts or not sum(len(f) for f in firsts):
+        return np.arange(n)
+    pairs = np.unique(np.stack([np.concatenate(firsts), np.concatenate(others)], axis=1), axis=0)
+    # Candidates share a band; only those whose estimated similarity reaches the threshold are merged.
+    similar = np.concatenate([(signatures[block[:, 0]] == signatures[block[:, 1]]).mean(axis=1) >= threshold
+                              for block in np.array_split(pairs, max(1, len(pairs) // 4096))])
+    parent = list(range(n))
+
+    def root(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for first, other in pairs[similar].tolist():
+        a, b = root(first), root(other)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+    return np.fromiter((root(i) for i in range(n)), dtype=np.int64, count=n)
+
+
+def chunk_sources(chunk: Dict) -> List[str]:
+    """Every document a chunk appears in: its own source, then its references'."""
+    return [chunk["source"]] + [r["source"] for r in chunk.get("references", ())]
+
+
+def _reference(chunk: Dict) -> Dict:
+    return {field: chunk.get(field) for field in REFERENCE_FIELDS}
+
+
+def collapse(chunks: Sequence[Dict], groups: "np.ndarray") -> Tuple[List[int], List[Dict]]:
+    """Positions of the chunks kept (one per group) and copies of them carrying the group's ``references``."""
+    kept = [i for i in range(len(chunks)) if groups[i] == i]
+    merged: Dict[int, Dict] = {i: chunks[i] for i in kept}
+    for i in range(len(chunks)):
+        g = int(groups[i])
+        if g == i:
+            continue
+        head = merged[g]
+        if head is chunks[g]:
+            head = merged[g] = dict(head, references=list(head.get("references", ())))
+        head["references"].append(_reference(chunks[i]))
+        head["references"].extend(chunks[i].get("references", ()))
+    return kept, [merged[i] for i in kept]
+
+
+def dedup_chunks(chunks: Sequence[Dict], threshold: float = DEDUP_THRESHOLD) -> List[Dict]:
+    """``chunks`` with each group of near-duplicates collapsed into its first chunk; ``threshold`` 0 keeps all."""
+    if threshold <= 0 or len(chunks) < 2:
+        return list(chunks)
+    groups = duplicate_groups(minhash_signatures([c["text"] for c in chunks]), threshold)
+    return collapse(chunks, groups)[1]
+
+
+def live_view(chunk: Dict, deleted: Set[str]) -> Optional[Dict]:
+    """The chunk as seen once the ``deleted`` documents are gone: their references dropped, the first
+    remaining reference promoted when its own source is deleted; None when nothing remains."""
+    if not deleted or not any(source in deleted for source in chunk_sources(chunk)):
+        return chunk
+    places = [r for r in [_reference(chunk)] + list(chunk.get("references", ())) if r["source"] not in deleted]
+    if not places:
+        return None
+    view = dict(chunk, **places[0])
+    if len(places) > 1:
+        view["references"] = places[1:]
+    else:
+        view.pop("references", None)
+    return view
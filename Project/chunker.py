@@ -0,0 +1,201 @@
+"""
+Structure- and token-aware chunking of extracted PDF pages.
+
+Page text is first split into blocks: headings, and paragraphs re-joined
+from their wrapped lines (with hyphenated line breaks repaired). Chunks are
+then packed from whole blocks up to a token target:
+
+- a heading always starts a new chunk and becomes that chunk's ``heading``
+  metadata, so sections are never merged;
+- a page break ends the chunk if it is already at least half full;
+- paragraphs are never split unless one alone exceeds the hard maximum, in
+  which case it is cut at sentence boundaries.
+
+Chunks do not overlap, so each passage is embedded once.
+"""
+
+import re
+import statistics
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from prompt_budget import count_tokens
+
+DEFAULT_TARGET_TOKENS = 350
+DEFAULT_MAX_TOKENS = 512
+CHUNK_FORMAT = 2  # bumped when chunk fields change, so saved indexes are rebuilt
+
+_NUMBERED_HEADING = re.compile(r"^(?:\d+(?:\.\d+)*|[IVXLC]+\.|Chapter\s+\d+|CHAPTER\s+\d+|Section\s+\d+(?:\.\d+)*)\s+\S")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z(\[])")
+_TERMINAL = tuple(".!?:;,")
+_CHAPTER = re.compile(r"^(?:chapter|unit|part)?\s*(\d{1,3})(?:\.\d+)*\b", re.IGNORECASE)
+
+# (source, page number, text), as produced by pdf_ingest.extract_pages.
+Page = Tuple[str, int, str]
+
+
+def _is_heading(line: str, typical_length: float) -> bool:
+    if len(line) > 80 or line.endswith(_TERMINAL):
+        return False
+    if _NUMBERED_HEADING.match(line):
+        return True
+    letters = [c for c in line if c.isalpha()]
+    return len(letters) >= 4 and all(c.isupper() for c in letters) and len(line) < 0.8 * typical_length
+
+
+def split_blocks(text: str) -> List[Tuple[str, str]]:
+    """``("heading" | "paragraph", text)`` blocks of one page, in order."""
+    lines = [line.strip() for line in text.splitlines()]
+    lengths = [len(line) for line in lines if len(line) > 20]
+    typical = statistics.median(lengths) if lengths else 60.0
+
+    blocks: List[Tuple[str, str]] = []
+    current: List[str] = []
+
+    def flush():
+        if current:
+            blocks.append(("paragraph", _join_lines(current)))
+            current.clear()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        if not line or line.isdigit():  # blank line, or a bare page number
+            flush()
+            continue
+        if _is_heading(line, typical):
+            flush()
+            heading = [line]
+            # Headings wrap: absorb short, unpunctuated continuation lines.
+            while (i < len(lines) and lines[i] and lines[i][0].isupper() and len(lines[i]) < 0.8 * typical
+                   and not lines[i].endswith(_TERMINAL) and len(heading) < 3):
+                heading.append(lines[i])
+                i += 1
+            blocks.append(("heading", _join_lines(heading, keep_hyphen=True)))
+            continue
+        current.append(line)
+        # A short line that ends a sentence closes the paragraph.
+        if line.endswith((".", "?", "!", ":")) and len(line) < 0.85 * typical:
+            flush()
+    flush()
+    return blocks
+
+
+def heading_chapter(heading: str) -> Optional[int]:
+    """Chapter number of a numbered heading: 3 for "3.2 Lenses" or "Chapter 3 Optics"."""
+    match = _CHAPTER.match(heading.strip())
+    return int(match.group(1)) if match else None
+
+
+def _join_lines(lines: Sequence[str], keep_hyphen: bool = False) -> str:
+    text = lines[0]
+    for line in lines[1:]:
+        if text.endswith("-") and line[:1].islower():
+            text = text[:-1] + line  # "develop-" + "ment"
+        elif text.endswith("-") and keep_hyphen:
+            text += line  # "Human-" + "Centered"
+        else:
+            text = f"{text} {line}"
+    return text
+
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences of a chunk's text, paragraph by paragraph."""
+    return [s.strip() for paragraph in text.split("\n\n") for s in _SENTENCE_END.split(paragraph) if s.strip()]
+
+
+def _split_sentences(text: str, max_tokens: int, model_name: str) -> List[str]:
+    """Cut an oversized paragraph into pieces of whole sentences (or words, as a last resort)."""
+    pieces, current, current_tokens = [], [], 0
+    for sentence in _SENTENCE_END.split(text):
+        tokens = count_tokens(sentence, model_name)
+        if tokens > max_tokens:
+            words = sentence.split()
+            step = max(1, len(words) * max_tokens // tokens)
+            parts = [" ".join(words[j:j + step]) for j in range(0, len(words), step)]
+        else:
+            parts = [sentence]
+        for part in parts:
+            part_tokens = count_tokens(part, model_name)
+            if current and current_tokens + part_tokens > max_tokens:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(part)
+            current_tokens += part_tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def chunk_pages(pages: Iterable[Page], target_tokens: int = DEFAULT_TARGET_TOKENS,
+                max_tokens: int = DEFAULT_MAX_TOKENS, model_name: str = "") -> List[Dict]:
+    """Chunks with ``text``, ``source``, ``page``, ``page_end``, ``heading``, ``chapter`` and ``tokens``.
+
+    ``chapter`` is the number of the last numbered heading (None before the first).
+    """
+    chunks: List[Dict] = []
+    state = {"source": None, "heading": "", "chapter": None, "parts": [], "tokens": 0, "page": None, "page_end": None}
+
+    def emit():
+        if state["parts"]:
+            chunks.append({
+                "text": "\n\n".join(state["parts"]),
+                "source": state["source"],
+                "page": state["page"],
+                "page_end": state["page_end"],
+                "heading": state["heading"],
+                "chapter": state["chapter"],
+                "tokens": state["tokens"],
+            })
+        state.update(parts=[], tokens=0, page=None, page_end=None)
+
+    for source, page_number, text in pages:
+        if source != state["source"]:
+            emit()
+            state.update(source=source, heading="", chapter=None)
+        elif state["tokens"] >= target_tokens // 2:
+            emit()  # page break: a good place to cut once the chunk has some substance
+        for kind, block in split_blocks(text):
+            if kind == "heading":
+                emit()
+                state["heading"] = block
+                chapter = heading_chapter(block)
+                state["chapter"] = state["chapter"] if chapter is None else chapter
+                continue
+            block_tokens = count_tokens(block, model_name)
+            pieces = [block] if block_tokens <= max_tokens else _split_sentences(block, max_tokens, model_name)
+            for piece in pieces:
+                piece_tokens = block_tokens if len(pieces) == 1 else count_tokens(piece, model_name)
+                if state["parts"] and state["tokens"] + piece_tokens > target_tokens:
+                    emit()
+                state["parts"].append(piece)
+                state["tokens"] += piece_tokens
+                state["page"] = state["page"] or page_number
+                state["page_end"] = page_number
+    emit()
+    return chunks
+
+
+def window_chunks(pages: Iterable[Page], chunk_size: int = 500, overlap: int = 100) -> List[Dict]:
+    """The original scheme, for comparison: a word window over each document's whole text."""
+    by_source: Dict[str, List[str]] = {}
+    for source, _, text in pages:
+        by_source.setdefault(source, []).append(text)
+    chunks = []
+    for source, texts in by_source.items():
+        words = "\n".join(texts).split()
+        for i in range(0, len(words), chunk_size - overlap):
+            chunk = " ".join(words[i:i + chunk_size])
+            if chunk.strip():
+                chunks.append({"text": chunk, "source": source})
+    return chunks
+
+
+def chunk_summary(chunks: Sequence[Dict], model_name: str = "") -> Dict[str, Optional[float]]:
+    tokens = [c.get("tokens") or count_tokens(c["text"], model_name) for c in chunks]
+    return {
+        "chunks": len(chunks),
+        "tokens": sum(tokens),
+        "mean_tokens": statistics.mean(tokens) if tokens else None,
+        "max_tokens": max(tokens) if tokens else None,
+    }
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Compare the structure-aware chunker with the original 500/100-word window.
+
+For each scheme reports chunk count, total indexed tokens and how much of
+that is duplicated overlap, mean/max chunk size, embedding requests needed
+(at 100 texts per batch) and chunking throughput.
+
+Usage:
+    python chunking_benchmark.py --documents doucuments
+    python chunking_benchmark.py --synthetic 300        # offline, generated textbook pages
+"""
+
+import argparse
+import math
+import random
+import time
+from typing import List
+
+from chunker import DEFAULT_TARGET_TOKENS, Page, chunk_pages, chunk_summary, window_chunks
+from prompt_budget import count_tokens
+
+EMBED_BATCH_SIZE = 100
+
+_WORDS = ("light wave lens focal length image object distance refraction index medium angle ray "
+          "current voltage resistance circuit measured value observed reading experiment apparatus "
+          "the a of and to in is that for with as by on").split()
+
+
+def synthetic_pages(n_pages: int, seed: int = 3) -> List[Page]:
+    """Textbook-like pages: numbered section headings, wrapped paragraphs, page numbers."""
+    rng = random.Random(seed)
+    pages, section = [], 0
+    for number in range(1, n_pages + 1):
+        lines = []
+        for _ in range(rng.randint(3, 6)):
+            if rng.random() < 0.25:
+                section += 1
+                lines += ["", f"{section // 5 + 1}.{section % 5 + 1} " + " ".join(w.title() for w in rng.sample(_WORDS[:12], 3))]
+            words = [rng.choice(_WORDS) for _ in range(rng.randint(40, 140))]
+            sentences = " ".join(words).replace(" the ", ". The ")
+            text = sentences[0].upper() + sentences[1:] + "."
+            # Wrap at ~55 characters like a two-column PDF, ending with a short last line.
+            line = ""
+            for word in text.split():
+                if len(line) + len(word) > 55:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = f"{line} {word}".strip()
+            lines.append(line)
+        lines.append(str(number))
+        pages.append(("synthetic.pdf", number, "\n".join(lines)))
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark structure-aware chunking against the word window.")
+    parser.add_argument("--documents", default=None, help="Folder of PDFs to chunk")
+    parser.add_argument("--synthetic", type=int, default=None, metavar="PAGES", help="Generate PAGES pages instead")
+    parser.add_argument("--chunk-tokens", type=int, default=DEFAULT_TARGET_TOKENS)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        pages = synthetic_pages(args.synthetic)
+    else:
+        from rag_cli import load_pages
+        pages = list(load_pages(args.documents or "doucuments"))
+    if not pages:
+        parser.error("No pages to chunk")
+    corpus_tokens = sum(count_tokens(text) for _, _, text in pages)
+    print(f"{len(pages)} pages, {corpus_tokens} tokens of extracted text\n")
+
+    window = window_chunks(pages, 500, 100)
+    # Same mean chunk size as the window, to separate the effect of removing overlap from chunk size.
+    matched = int(chunk_summary(window)["mean_tokens"] or args.chunk_tokens)
+    schemes = {
+        "window 500/100": lambda: window_chunks(pages, 500, 100),
+        f"structured {args.chunk_tokens}": lambda: chunk_pages(pages, args.chunk_tokens, int(args.chunk_tokens * 1.5)),
+        f"structured {matched}": lambda: chunk_pages(pages, matched, int(matched * 1.5)),
+    }
+    print(f"{'scheme':<18}{'chunks':>8}{'tokens':>10}{'overlap':>9}{'mean':>7}{'max':>6}{'embed req':>10}{'pages/s':>10}")
+    print("-" * 78)
+    for name, run in schemes.items():
+        started = time.perf_counter()
+        chunks = run()
+        seconds = time.perf_counter() - started
+        summary = chunk_summary(chunks)
+        overlap = max(0.0, summary["tokens"] / corpus_tokens - 1.0)
+        print(f"{name:<18}{summary['chunks']:>8}{summary['tokens']:>10}{overlap:>8.0%} "
+              f"{summary['mean_tokens'] or 0:>6.0f}{summary['max_tokens'] or 0:>6}"
+              f"{math.ceil(summary['chunks'] / EMBED_BATCH_SIZE):>10}{len(pages) / seconds:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Measure what MMR and sentence compression (``rag_context``) do to RAG prompts.
+
+Builds a generated corpus in which every apparatus has three fact passages
+(measuring range, calibration standard, storage temperature), each repeated
+with small edits in one to four PDFs, as happens when several manuals share
+text. Each query asks for all three facts. For every setting it reports:
+
+- facts: share of the three fact sentences present in the context sent to the model
+- distinct: distinct passages among the chunks kept (1.0 = no near-duplicates)
+- tokens: mean context tokens per prompt
+- ms: mean time of the selection stage, after retrieval
+
+Usage:
+    python context_benchmark.py --apparatus 500 --queries 200
+    python context_benchmark.py --context-tokens 300 600 1200
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from lazy_imports import lazy_import
+from prompt_budget import count_tokens
+from rag_cli import format_chunk
+from rag_context import DEFAULT_DIVERSITY, fetch_depth, select_context
+from rag_index import SEARCH_MODES
+from rag_segments import SegmentedIndex
+from retrieval_benchmark import _FILLER, hashing_embedder
+
+np = lazy_import("numpy")
+
+
+_FACTS = ("has a measuring range of {} units", "is calibrated against reference standard {}",
+          "must be stored below {} degrees")
+
+
+def _sentence(rng: random.Random, words: List[str], length: int = 16) -> str:
+    body = [rng.choice(words if rng.random() < 0.6 else _FILLER) for _ in range(length)]
+    return " ".join(body).capitalize() + "."
+
+
+def synthetic_corpus(n_apparatus: int, sentences: int = 18, seed: int = 11) -> Tuple[Dict[str, List[Dict]], List[Dict]]:
+    """Chunks per PDF name, and queries with the fact sentences each should retrieve.
+
+    Each passage draws its wording from its own small vocabulary, so distinct
+    passages embed apart while the edited copies of one passage stay close.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"term{n:05d}" for n in range(20000)]
+    documents: Dict[str, List[Dict]] = {}
+    queries = []
+    for i in range(n_apparatus):
+        model = f"ap-{1000 + i}"
+        facts = [f"Apparatus {model} {fact.format(rng.randint(10, 900))}." for fact in _FACTS]
+        for passage, fact in enumerate(facts):
+            words = rng.sample(vocabulary, 40)
+            body = [_sentence(rng, words) for _ in range(sentences)]
+            body.insert(rng.randrange(len(body)), fact)
+            for copy in range(rng.randint(1, 4)):
+                edited = list(body)
+                j = rng.randrange(len(edited))
+                if edited[j] != fact:
+                    edited[j] = _sentence(rng, words)  # near-duplicate, not an exact copy
+                source = f"manual-{copy}-{i % 8}.pdf"
+                documents.setdefault(source, []).append(
+                    {"text": " ".join(edited), "source": source, "passage": f"{model}/{passage}"})
+        queries.append({"query": f"What range, calibration standard and storage temperature does apparatus {model} need?",
+                        "facts": facts})
+    return documents, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MMR and extractive compression of RAG context.")
+    parser.add_argument("--apparatus", type=int, default=500, help="Apparatus in the generated corpus")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=4, help="Chunks passed to the model")
+    # The offline hashing embedder ranks these passages poorly, so rank by BM25 by default;
+    # MMR still measures redundancy with the embeddings.
+    parser.add_argument("--mode", choices=SEARCH_MODES, default="sparse", help="Retrieval mode")
+    parser.add_argument("--diversity", type=float, default=DEFAULT_DIVERSITY)
+    parser.add_argument("--context-tokens", type=int, nargs="+", default=[1200, 600, 300])
+    parser.add_argument("--hash-dim", type=int, default=256)
+    args = parser.parse_args()
+
+    documents, queries = synthetic_corpus(args.apparatus)
+    queries = random.Random(5).sample(queries, min(args.queries, len(queries)))
+    embed = hashing_embedder(args.hash_dim)
+    with tempfile.TemporaryDirectory() as directory:
+        index = SegmentedIndex.open(directory, {"benchmark": 1})
+        index.update({name: name for name in documents},
+                     lambda names: [chunk for name in names for chunk in documents[name]], embed)
+        snapshot = index.snapshot()
+        print(f"{len(snapshot.chunks)} chunks in {len(documents)} PDFs, {len(queries)} queries, k={args.k}\n")
+
+        settings = [("top-k verbatim", 0.0, 0), (f"MMR {args.diversity}", args.diversity, 0)]
+        settings += [(f"MMR + {tokens} tokens", args.diversity, tokens) for tokens in args.context_tokens]
+        print(f"{'setting':<22}{'facts':>7}{'distinct':>10}{'tokens':>8}{'ms':>7}")
+        print("-" * 54)
+        vectors = np.asarray(embed([q["query"] for q in queries], "retrieval_query"), dtype=np.float32)
+        for name, diversity, tokens in settings:
+            facts, distinct, sizes, times = [], [], [], []
+            for q, vector in zip(queries, vectors):
+                hits = snapshot.search(q["query"], vector, k=fetch_depth(args.k, diversity), mode=args.mode)
+                started = time.perf_counter()
+                selected = select_context(snapshot, q["query"], hits, args.k, diversity, tokens)
+                times.append((time.perf_counter() - started) * 1000)
+                context = "\n\n".join(format_chunk(chunk) for chunk, _ in selected)
+                facts.append(sum(fact in context for fact in q["facts"]) / len(q["facts"]))
+                distinct.append(len({chunk["passage"] for chunk, _ in selected}) / max(1, len(selected)))
+                sizes.append(count_tokens(context))
+            print(f"{name:<22}{statistics.mean(facts):>7.2f}{statistics.mean(distinct):>10.2f}"
+                  f"{statistics.mean(sizes):>8.0f}{statistics.mean(times):>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Registry of reusable prompt prefixes.
+
+The per-sandbox prefix (topic, aim, retrieved context) is identical for
+every section and feedback call on that sandbox. ``ContextCache`` registers
+it with the provider once (``ModelProvider.create_context``), hands the same
+``CachedContext`` to all later calls until it expires, and tracks how many
+input tokens were served from the provider's cache. Providers only hold a
+prefix server-side when it is long enough (``GeminiProvider.min_cached_chars``);
+shorter ones are resent in front of each prompt.
+
+Contexts dropped from the LRU are not deleted: another thread may still be
+sending a request that uses one, so they are left to expire with their TTL.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+from providers import CachedContext, Completion, ModelProvider
+
+
+class ContextCache:
+    """LRU of registered prefixes for one generator, safe to share between threads."""
+
+    def __init__(self, ttl_seconds: float = 3600.0, max_entries: int = 64):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedContext]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"registered": 0, "reused": 0, "calls": 0, "input_tokens": 0, "cached_tokens": 0}
+
+    def get(self, provider: ModelProvider, prefix: str) -> CachedContext:
+        """The live context for ``prefix``, registering it with ``provider`` if needed."""
+        key = CachedContext(prefix, ttl_seconds=0).key
+        with self._lock:
+            context = self._entries.get(key)
+            if context is not None and not context.expired():
+                self._entries.move_to_end(key)
+                self._stats["reused"] += 1
+                return context
+
+        # Register outside the lock: it may be a network call.
+        created = provider.create_context(prefix, ttl_seconds=self.ttl_seconds)
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and not current.expired() and current is not context:
+                # Another thread registered the same prefix meanwhile; keep theirs.
+                duplicate, created = created, current
+            else:
+                duplicate = None
+                self._entries[key] = created
+                self._stats["registered"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)  # may still be in use elsewhere; expires with its TTL
+        if duplicate is not None:
+            provider.delete_context(duplicate)  # never handed out
+        return created
+
+    def record(self, completion: Completion):
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["input_tokens"] += completion.input_tokens
+            self._stats["cached_tokens"] += completion.cached_tokens
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        stats["cached_ratio"] = stats["cached_tokens"] / stats["input_tokens"] if stats["input_tokens"] else 0.0
+        return stats
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Measure near-duplicate chunk elimination (``chunk_dedup``) at ingestion.
+
+Generates a department's shelf: a textbook, its second edition (about one
+word in 50 changed, plus new pages), and lecture notes that copy a third of
+the textbook's pages among their own. The corpus is ingested into a
+segmented index with dedup off and on, with embedding calls simulated at
+``--embed-ms`` per request of up to 100 texts. Reports chunks indexed,
+embedding requests, dense index size at ``--dim`` dimensions, MinHash+LSH
+time and ingestion throughput, plus how many merges join chunks that come
+from different pages of the original text (false merges).
+
+Usage:
+    python dedup_benchmark.py --pages 400
+    python dedup_benchmark.py --pages 2000 --embed-ms 0
+"""
+
+import argparse
+import math
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+from chunk_dedup import DEDUP_THRESHOLD, duplicate_groups, minhash_signatures
+from chunker import Page, chunk_pages
+from chunking_benchmark import synthetic_pages
+from lazy_imports import lazy_import
+from rag_segments import SegmentedIndex
+
+np = lazy_import("numpy")
+
+EMBED_BATCH_SIZE = 100
+
+
+def synthetic_shelf(n_pages: int, edit_rate: float = 0.02, seed: int = 5) -> List[Page]:
+    """Pages of the three PDFs, in order."""
+    rng = random.Random(seed)
+    base = [text for _, _, text in synthetic_pages(n_pages)]
+    extra = [text for _, _, text in synthetic_pages(n_pages // 4, seed=seed + 1)]
+    notes = [text for _, _, text in synthetic_pages(n_pages // 3, seed=seed + 2)]
+
+    def edit(text: str) -> str:
+        lines = text.split("\n")
+        for i, line in enumerate(lines):
+            words = line.split(" ")
+            if len(words) > 4 and rng.random() < edit_rate * len(words):
+                words[rng.randrange(len(words))] = rng.choice(("revised", "updated", "corrected"))
+                lines[i] = " ".join(words)
+        return "\n".join(lines)
+
+    second = [edit(text) for text in base]
+    for text in extra:
+        second.insert(rng.randrange(len(second)), text)
+    copied = rng.sample(base, n_pages // 3)
+    lecture = notes + copied
+    rng.shuffle(lecture)
+    return ([("textbook-1e.pdf", i + 1, t) for i, t in enumerate(base)]
+            + [("textbook-2e.pdf", i + 1, t) for i, t in enumerate(second)]
+            + [("lecture-notes.pdf", i + 1, t) for i, t in enumerate(lecture)])
+
+
+def simulated_embedder(dim: int, request_ms: float):
+    def embed(texts: List[str], task_type: str) -> "np.ndarray":
+        time.sleep(request_ms / 1000 * math.ceil(len(texts) / EMBED_BATCH_SIZE))
+        return np.random.RandomState(len(texts)).standard_normal((len(texts), dim)).astype(np.float32)
+    return embed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark near-duplicate chunk elimination at ingestion.")
+    parser.add_argument("--pages", type=int, default=400, help="Pages of the first edition")
+    parser.add_argument("--threshold", type=float, default=DEDUP_THRESHOLD)
+    parser.add_argument("--embed-ms", type=float, default=300.0, help="Simulated latency per embedding request")
+    parser.add_argument("--dim", type=int, default=768)
+    args = parser.parse_args()
+
+    pages = synthetic_shelf(args.pages)
+    by_source: Dict[str, List[Page]] = {}
+    for page in pages:
+        by_source.setdefault(page[0], []).append(page)
+    chunks = chunk_pages(pages)
+    print(f"{len(pages)} pages in {len(by_source)} PDFs, {len(chunks)} chunks\n")
+
+    started = time.perf_counter()
+    signatures = minhash_signatures([c["text"] for c in chunks])
+    signed = time.perf_counter()
+    groups = duplicate_groups(signatures, args.threshold)
+    grouped = time.perf_counter()
+    # A merge is false when representative and duplicate share no sentence-long run of words.
+    false = 0
+    for i in np.flatnonzero(groups != np.arange(len(chunks))):
+        head, words = chunks[groups[i]]["text"], chunks[i]["text"].split()
+        false += not any(" ".join(words[j:j + 8]) in head for j in range(0, max(1, len(words) - 8), 4))
+    print(f"MinHash: {(signed - started) * 1000:.0f} ms, LSH + verification: {(grouped - signed) * 1000:.0f} ms "
+          f"({len(chunks) / (grouped - started):.0f} chunks/s); "
+          f"{int((groups != np.arange(len(chunks))).sum())} duplicates, {false} false merges\n")
+
+    print(f"{'dedup':<8}{'chunks':>8}{'embed req':>11}{'dense MB':>10}{'ingest s':>10}{'pages/s':>9}")
+    print("-" * 56)
+    for threshold in (0.0, args.threshold):
+        with tempfile.TemporaryDirectory() as directory:
+            index = SegmentedIndex.open(directory, {"dedup_threshold": threshold})
+            embed = simulated_embedder(args.dim, args.embed_ms)
+            started = time.perf_counter()
+            stats = index.update({name: name for name in by_source},
+                                 lambda names: chunk_pages(p for name in names for p in by_source[name]), embed)
+            seconds = time.perf_counter() - started
+            print(f"{'on' if threshold else 'off':<8}{stats['chunks']:>8}"
+                  f"{math.ceil(stats['chunks'] / EMBED_BATCH_SIZE):>11}{index.dense_nbytes / 2 ** 20:>10.1f}"
+                  f"{seconds:>10.2f}{len(pages) / seconds:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
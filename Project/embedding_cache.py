@@ -0,0 +1,191 @@
+"""
+Persistent, machine-wide embedding cache.
+
+Vectors are keyed by (embedding model, task type, SHA-256 of the text), so a
+chunk that appears in several PDFs, several corpora or several projects is
+embedded once, and a repeated question costs no API call.
+
+Each (model, task type) pair is one shard of three files in the cache
+directory::
+
+    <shard>.json   model, task type, dimension
+    <shard>.keys   32-byte digests, one per row, append-only
+    <shard>.f32    float32 vectors, one row per digest, append-only
+
+The key file is read into a dict (digest -> row) when a shard is opened and
+the vectors are memory-mapped, so lookups only touch the rows they need.
+Appends hold an exclusive file lock (where the platform has ``fcntl``) and
+trim any half-written tail first, so several processes can share one cache.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+
+from lazy_imports import lazy_import
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, appends are still safe within a process
+    fcntl = None
+
+np = lazy_import("numpy")
+
+DEFAULT_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache",
+                                                                      "virtual-labs", "embeddings")
+_KEY_BYTES = 32
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class _Shard:
+    """Cached vectors of one (model, task type)."""
+
+    def __init__(self, directory: str, model: str, task_type: str):
+        name = hashlib.sha256(f"{model}\0{task_type}".encode("utf-8")).hexdigest()[:16]
+        base = os.path.join(directory, name)
+        self.model = model
+        self.task_type = task_type
+        self.header_path = base + ".json"
+        self.keys_path = base + ".keys"
+        self.vectors_path = base + ".f32"
+        self.lock_path = base + ".lock"
+        self.dim: Optional[int] = None
+        self.rows: Dict[bytes, int] = {}
+        self.count = 0
+        self._vectors = None
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def refresh(self):
+        """Pick up rows appended since the last look, by this or another process."""
+        with self._lock:
+            if self.dim is None:
+                if not os.path.exists(self.header_path):
+                    return
+                with open(self.header_path) as f:
+                    self.dim = int(json.load(f)["dim"])
+            count = self._complete_rows()
+            if count <= self.count:
+                return
+            with open(self.keys_path, "rb") as f:
+                f.seek(self.count * _KEY_BYTES)
+                data = f.read((count - self.count) * _KEY_BYTES)
+            for i in range(len(data) // _KEY_BYTES):
+                self.rows.setdefault(data[i * _KEY_BYTES:(i + 1) * _KEY_BYTES], self.count + i)
+            self.count = count
+            self._vectors = None
+
+    def _complete_rows(self) -> int:
+        """Rows present in both files; a crash between the two appends leaves a tail that is ignored."""
+        if self.dim is None or not os.path.exists(self.keys_path) or not os.path.exists(self.vectors_path):
+            return 0
+        return min(os.path.getsize(self.keys_path) // _KEY_BYTES,
+                   os.path.getsize(self.vectors_path) // (4 * self.dim))
+
+    def vectors(self) -> "np.ndarray":
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+            return self._vectors
+
+    def lookup(self, digests: Sequence[bytes]) -> Dict[bytes, int]:
+        """Row of each cached digest; rows only ever grow, so they stay valid for ``read``."""
+        with self._lock:
+            return {d: self.rows[d] for d in digests if d in self.rows}
+
+    def read(self, rows: Sequence[int]) -> "np.ndarray":
+        """A copy of the given rows, read while no refresh can swap the memory map."""
+        with self._lock:
+            return self.vectors()[list(rows)]
+
+    def append(self, digests: Sequence[bytes], vectors: "np.ndarray"):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, open(self.lock_path, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            self.refresh()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self.header_path, "w") as f:
+                    json.dump({"model": self.model, "task_type": self.task_type, "dim": self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"{self.model} returned {vectors.shape[1]}-dim vectors, cache holds {self.dim}-dim")
+            keep = [i for i, d in enumerate(digests) if d not in self.rows]
+            if not keep:
+                return
+            for path, width in ((self.keys_path, _KEY_BYTES), (self.vectors_path, 4 * self.dim)):
+                with open(path, "ab") as f:
+                    f.truncate(self.count * width)  # drop a half-written tail before appending
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors[keep].tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(digests[i] for i in keep))
+            self.refresh()
+
+
+class EmbeddingCache:
+    """Embedding lookups that only send texts never embedded before to the model."""
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._shards: Dict[tuple, _Shard] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _shard(self, model: str, task_type: str) -> _Shard:
+        with self._lock:
+            key = (model, task_type)
+            if key not in self._shards:
+                self._shards[key] = _Shard(self.directory, model, task_type)
+            return self._shards[key]
+
+    def embed(self, texts: List[str], task_type: str, model: str,
+              embed: Callable[[List[str], str], Sequence[Sequence[float]]]) -> "np.ndarray":
+        """One row per text: cached rows as stored, the rest from ``embed`` (each distinct text once), then cached."""
+        shard = self._shard(model, task_type)
+        shard.refresh()
+        digests = [text_digest(t) for t in texts]
+        found = shard.lookup(digests)
+        missing: Dict[bytes, str] = {}
+        for digest, text in zip(digests, texts):
+            if digest not in found:
+                missing.setdefault(digest, text)
+        n_missing = sum(1 for d in digests if d in missing)
+        with self._lock:
+            self.misses += n_missing
+            self.hits += len(digests) - n_missing
+
+        fresh: Dict[bytes, "np.ndarray"] = {}
+        if missing:
+            vectors = np.asarray(embed(list(missing.values()), task_type), dtype=np.float32)
+            fresh = dict(zip(missing, vectors))
+            try:
+                shard.append(list(missing), vectors)
+            except OSError as e:
+                print(f"Warning: could not write embedding cache {self.directory}: {e}", file=sys.stderr)
+        if not texts:
+            return np.zeros((0, shard.dim or 0), dtype=np.float32)
+        dim = shard.dim or len(next(iter(fresh.values())))
+        result = np.empty((len(texts), dim), dtype=np.float32)
+        cached = [(i, found[d]) for i, d in enumerate(digests) if d in found]
+        if cached:
+            positions, rows = zip(*cached)
+            result[list(positions)] = shard.read(rows)
+        for i, digest in enumerate(digests):
+            if digest in fresh:
+                result[i] = fresh[digest]
+        return result
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
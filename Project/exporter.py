@@ -0,0 +1,129 @@
+"""
+ZIP export of generated sandboxes.
+
+Archives are built straight from in-memory file contents (see
+``SandboxGenerator.sandbox_files``) instead of re-reading a saved sandbox
+from disk. ``iter_zip`` streams an archive in chunks; ``build_zip`` returns
+whole archive bytes for APIs that need them (e.g. ``st.download_button``)
+and caches them by content hash so identical exports are only built once.
+"""
+
+import hashlib
+import io
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Union
+
+FileContent = Union[str, bytes]
+
+# Fixed timestamp so identical content always yields byte-identical archives.
+_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def _as_bytes(content: FileContent) -> bytes:
+    return content.encode("utf-8") if isinstance(content, str) else content
+
+
+def select_files(files: Dict[str, FileContent], prefix: Optional[str] = None) -> Dict[str, FileContent]:
+    """Files under ``prefix`` (e.g. ``"simulation/"``), or all files when no prefix is given."""
+    if not prefix:
+        return dict(files)
+    return {path: content for path, content in files.items() if path.startswith(prefix)}
+
+
+def content_hash(files: Dict[str, FileContent]) -> str:
+    """Stable SHA-256 over paths and contents, independent of dict order."""
+    digest = hashlib.sha256()
+    for path in sorted(files):
+        data = _as_bytes(files[path])
+        digest.update(path.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(hashlib.sha256(data).digest())
+    return digest.hexdigest()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable stream that collects what ZipFile writes into it."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(files: Dict[str, FileContent], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield a deflated ZIP archive of ``files`` in chunks of at most ``chunk_size`` bytes.
+
+    Only one member's compressed output is held in memory at a time.
+    """
+    sink = _ChunkSink()
+    pending = b""
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for path in sorted(files):
+            info = zipfile.ZipInfo(path, date_time=_ZIP_DATE_TIME)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            zipf.writestr(info, _as_bytes(files[path]))
+            pending += sink.drain()
+            while len(pending) >= chunk_size:
+                yield pending[:chunk_size]
+                pending = pending[chunk_size:]
+    pending += sink.drain()
+    while pending:
+        yield pending[:chunk_size]
+        pending = pending[chunk_size:]
+
+
+class ArchiveCache:
+    """Small thread-safe LRU of built archives keyed by content hash."""
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_archive_cache = ArchiveCache()
+
+
+def build_zip(files: Dict[str, FileContent], cache: Optional[ArchiveCache] = None) -> bytes:
+    """Whole-archive bytes for ``files``, reused from the cache when content is unchanged."""
+    cache = cache or _archive_cache
+    key = content_hash(files)
+    data = cache.get(key)
+    if data is None:
+        data = b"".join(iter_zip(files))
+        cache.put(key, data)
+    return data
@@ -0,0 +1,216 @@
+"""
+Persistent SQLite job queue for sandbox generation.
+
+Holds two tables: ``sandboxes`` (one row per requested sandbox, with its
+latest SandboxState as JSON) and ``jobs`` (work items for the worker pool).
+Jobs survive process restarts; jobs left ``running`` by a crashed worker are
+put back on the queue by ``recover``.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sandboxes (
+    id TEXT PRIMARY KEY,
+    topic TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    state TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    sandbox_id TEXT NOT NULL REFERENCES sandboxes(id),
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+
+class QueueFull(Exception):
+    """Raised when enqueueing would exceed the queue's pending-job limit."""
+
+
+class JobQueue:
+    """Thread-safe job queue backed by a single SQLite database file."""
+
+    def __init__(self, path: str = "sandbox_jobs.db", max_pending: int = 100, max_attempts: int = 3):
+        self.path = path
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+        self._work_available = threading.Condition(self._lock)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- Sandboxes ---
+    def create_sandbox(self, topic: str, model_name: str, state: Dict[str, Any]) -> str:
+        """Register a sandbox and enqueue its full generation job."""
+        sandbox_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._check_capacity()
+                self._conn.execute(
+                    "INSERT INTO sandboxes (id, topic, model_name, status, state, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (sandbox_id, topic, model_name, QUEUED, json.dumps(state), now, now),
+                )
+                self._insert_job(sandbox_id, "generate", {}, now)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._work_available.notify()
+        return sandbox_id
+
+    def get_sandbox(self, sandbox_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM sandboxes WHERE id = ?", (sandbox_id,)).fetchone()
+        if row is None:
+            return None
+        sandbox = dict(row)
+        sandbox["state"] = json.loads(sandbox["state"]) if sandbox["state"] else None
+        return sandbox
+
+    def update_sandbox(self, sandbox_id: str, status: str, state: Optional[Dict[str, Any]] = None,
+                       error: Optional[str] = None):
+        with self._lock:
+            if state is None:
+                self._conn.execute(
+                    "UPDATE sandboxes SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                    (status, error, time.time(), sandbox_id),
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE sandboxes SET status = ?, state = ?, error = ?, updated_at = ? WHERE id = ?",
+                    (status, json.dumps(state), error, time.time(), sandbox_id),
+                )
+
+    # --- Jobs ---
+    def _check_capacity(self):
+        pending = self._conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+        ).fetchone()[0]
+        if pending >= self.max_pending:
+            raise QueueFull(f"{pending} jobs pending; try again later")
+
+    def _insert_job(self, sandbox_id: str, kind: str, payload: Dict[str, Any], now: float) -> str:
+        job_id = uuid.uuid4().hex
+        self._conn.execute(
+            "INSERT INTO jobs (id, sandbox_id, kind, payload, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, sandbox_id, kind, json.dumps(payload), QUEUED, now, now),
+        )
+        return job_id
+
+    def enqueue(self, sandbox_id: str, kind: str, payload: Optional[Dict[str, Any]] = None) -> str:
+        """Add a job for an existing sandbox. Raises ``QueueFull`` under backpressure."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._check_capacity()
+                job_id = self._insert_job(sandbox_id, kind, payload or {}, time.time())
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._work_available.notify()
+        return job_id
+
+    def claim(self, worker: str, timeout: float = 1.0) -> Optional[Dict[str, Any]]:
+        """Atomically take the oldest queued job, waiting up to ``timeout`` seconds for one.
+
+        Jobs for a sandbox that already has a running job are skipped, so
+        feedback updates never race the generation they refine.
+        """
+        deadline = time.time() + timeout
+        with self._lock:
+            while True:
+                row = self._conn.execute(
+                    "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, updated_at = ? "
+                    "WHERE id = (SELECT id FROM jobs AS j WHERE j.status = ? AND NOT EXISTS ("
+                    "  SELECT 1 FROM jobs AS r WHERE r.sandbox_id = j.sandbox_id AND r.status = ?)"
+                    " ORDER BY j.created_at LIMIT 1) "
+                    "RETURNING *",
+                    (RUNNING, worker, time.time(), QUEUED, RUNNING),
+                ).fetchone()
+                if row is not None:
+                    job = dict(row)
+                    job["payload"] = json.loads(job["payload"])
+                    return job
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._work_available.wait(remaining)
+
+    def complete(self, job_id: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (DONE, time.time(), job_id),
+            )
+            self._work_available.notify_all()
+
+    def fail(self, job_id: str, error: str) -> bool:
+        """Record a failure; the job is retried until ``max_attempts``. Returns True if retried."""
+        with self._lock:
+            attempts = self._conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+            retry = attempts < self.max_attempts
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (QUEUED if retry else FAILED, error, time.time(), job_id),
+            )
+            self._work_available.notify_all()
+        return retry
+
+    def recover(self) -> int:
+        """Requeue jobs left running by a previous process. Call once before starting workers."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, updated_at = ? WHERE status = ?",
+                (QUEUED, time.time(), RUNNING),
+            )
+            return cursor.rowcount
+
+    def jobs_for(self, sandbox_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, status, attempts, error, created_at, updated_at FROM jobs "
+                "WHERE sandbox_id = ? ORDER BY created_at", (sandbox_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update({status: count for status, count in rows})
+        return counts
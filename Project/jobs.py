@@ -0,0 +1,119 @@
+"""
+Background job execution.
+
+Long-running LLM calls are submitted to a shared thread pool and tracked as
+``Job`` objects. Jobs live in the process-wide ``JobManager`` rather than in a
+Streamlit script run, so they keep going across reruns and their results are
+picked up by whichever rerun polls them after completion.
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    """A unit of background work with status, progress and a result."""
+
+    def __init__(self, description: str = ""):
+        self.id = uuid.uuid4().hex
+        self.description = description
+        self.status = PENDING
+        self.progress = 0.0
+        self.message = "Waiting for a worker..."
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def update(self, progress: Optional[float] = None, message: Optional[str] = None):
+        """Report progress from inside the job function."""
+        with self._lock:
+            if progress is not None:
+                self.progress = progress
+            if message is not None:
+                self.message = message
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Consistent copy of the job's public fields."""
+        with self._lock:
+            return {
+                "id": self.id,
+                "description": self.description,
+                "status": self.status,
+                "progress": self.progress,
+                "message": self.message,
+                "error": self.error,
+                "elapsed": self.elapsed,
+            }
+
+
+class JobManager:
+    """Runs jobs on a bounded thread pool and keeps them addressable by id."""
+
+    def __init__(self, max_workers: int = 4, retention_seconds: float = 3600.0):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sandbox-job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self.retention_seconds = retention_seconds
+
+    def submit(self, fn: Callable[..., Any], *args, description: str = "", **kwargs) -> Job:
+        """Schedule ``fn(job, *args, **kwargs)``; its return value becomes ``job.result``."""
+        job = Job(description)
+        with self._lock:
+            self._prune_locked()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        if not job_id:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_jobs(self) -> List[Job]:
+        with self._lock:
+            return [job for job in self._jobs.values() if not job.finished]
+
+    def _run(self, job: Job, fn: Callable[..., Any], args, kwargs):
+        job.status = RUNNING
+        job.started_at = time.time()
+        job.update(message=f"Running {job.description}..." if job.description else "Running...")
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.update(progress=1.0, message="Done")
+            job.status = DONE
+        except Exception as e:
+            job.error = str(e)
+            job.update(message=f"Failed: {e}")
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+
+    def _prune_locked(self):
+        """Forget finished jobs nobody collected within the retention window."""
+        cutoff = time.time() - self.retention_seconds
+        stale = [job_id for job_id, job in self._jobs.items()
+                 if job.finished and job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in stale:
+            del self._jobs[job_id]
@@ -6,7 +6,7 @@ This provides a command-line interface for testing the human-in-the-loop functio
 
 import json
 import os
-from langgraph_experiment_generator import SandboxGenerator, SandboxState, SystemPrompts
+from langgraph_experiment_generator import SandboxGenerator, new_sandbox_state
 
 def print_step_header(step_name: str, progress: float):
     """Print a formatted step header."""
@@ -72,23 +72,7 @@ def main():
         return
     
     # Initialize state
-    current_state = SandboxState(
-        sandbox_topic=sandbox_topic,
-        current_step="sandbox_name",
-        sandbox_name="",
-        aim="",
-        pretest=[],
-        posttest=[],
-        theory="",
-        procedure="",
-        references="",
-        user_feedback="",
-        user_action="save",
-        progress=0.0,
-        completed_steps=[],
-        system_message="Starting sandbox generation...",
-        user_message=""
-    )
+    current_state = new_sandbox_state(sandbox_topic)
     
     # Start workflow
     print(f"\n🚀 Starting generation for: {sandbox_topic}")
@@ -96,8 +80,7 @@ def main():
     try:
         # Step 1: Generate sandbox name
         print_step_header("sandbox_name", 14.3)
-        prompt = SystemPrompts.SANDBOX_NAME_PROMPT.format(topic=sandbox_topic)
-        name = generator.generate_content(prompt).strip()
+        name = generator.generate_section("sandbox_name", sandbox_topic).strip()
         
         # Clean up the name
         name = name.lower()
@@ -115,15 +98,13 @@ def main():
         
         # Step 2: Generate aim
         print_step_header("aim", 28.6)
-        prompt = SystemPrompts.AIM_PROMPT.format(topic=sandbox_topic)
-        aim = generator.generate_content(prompt)
+        aim = generator.generate_section("aim", sandbox_topic)
         current_state["aim"] = aim
         print_content(aim, "aim")
         
         feedback, action = get_user_feedback()
         if action == "update" and feedback:
-            prompt = f"{SystemPrompts.AIM_PROMPT.format(topic=sandbox_topic)}\n\nUser feedback: {feedback}\n\nPlease update the aim based on this feedback."
-            current_state["aim"] = generator.generate_content(prompt)
+            current_state["aim"] = generator.generate_section("aim", sandbox_topic, feedback=feedback)
             print_content(current_state["aim"], "aim")
         
         current_state["current_step"] = "pretest"
@@ -132,17 +113,15 @@ def main():
         
         # Step 3: Generate pretest
         print_step_header("pretest", 42.9)
-        prompt = SystemPrompts.PRETEST_PROMPT.format(topic=sandbox_topic)
-        content = generator.generate_content(prompt)
-        pretest = generator.parse_json_content(content)
+        content = generator.generate_section("pretest", sandbox_topic, aim=current_state["aim"])
+        pretest, _ = generator.filter_quiz(current_state, "pretest", generator.parse_json_content(content))
         current_state["pretest"] = pretest
         print_content(pretest, "pretest")
         
         feedback, action = get_user_feedback()
         if action == "update" and feedback:
-            prompt = f"{SystemPrompts.PRETEST_PROMPT.format(topic=sandbox_topic)}\n\nUser feedback: {feedback}\n\nPlease update the pretest questions based on this feedback."
-            content = generator.generate_content(prompt)
-            current_state["pretest"] = generator.parse_json_content(content)
+            content = generator.generate_section("pretest", sandbox_topic, aim=current_state["aim"], feedback=feedback)
+            current_state["pretest"], _ = generator.filter_quiz(current_state, "pretest", generator.parse_json_content(content))
             print_content(current_state["pretest"], "pretest")
         
         current_state["current_step"] = "posttest"
@@ -151,17 +130,15 @@ def main():
         
         # Step 4: Generate posttest
         print_step_header("posttest", 57.1)
-        prompt = SystemPrompts.POSTTEST_PROMPT.format(topic=sandbox_topic)
-        content = generator.generate_content(prompt)
-        posttest = generator.parse_json_content(content)
+        content = generator.generate_section("posttest", sandbox_topic, aim=current_state["aim"])
+        posttest, _ = generator.filter_quiz(current_state, "posttest", generator.parse_json_content(content))
         current_state["posttest"] = posttest
         print_content(posttest, "posttest")
         
         feedback, action = get_user_feedback()
         if action == "update" and feedback:
-            prompt = f"{SystemPrompts.POSTTEST_PROMPT.format(topic=sandbox_topic)}\n\nUser feedback: {feedback}\n\nPlease update the posttest questions based on this feedback."
-            content = generator.generate_content(prompt)
-            current_state["posttest"] = generator.parse_json_content(content)
+            content = generator.generate_section("posttest", sandbox_topic, aim=current_state["aim"], feedback=feedback)
+            current_state["posttest"], _ = generator.filter_quiz(current_state, "posttest", generator.parse_json_content(content))
             print_content(current_state["posttest"], "posttest")
         
         current_state["current_step"] = "theory"
@@ -170,15 +147,13 @@ def main():
         
         # Step 5: Generate theory
         print_step_header("theory", 71.4)
-        prompt = SystemPrompts.THEORY_PROMPT.format(topic=sandbox_topic)
-        theory = generator.generate_content(prompt)
+        theory = generator.generate_section("theory", sandbox_topic, aim=current_state["aim"])
         current_state["theory"] = theory
         print_content(theory, "theory")
         
         feedback, action = get_user_feedback()
         if action == "update" and feedback:
-            prompt = f"{SystemPrompts.THEORY_PROMPT.format(topic=sandbox_topic)}\n\nUser feedback: {feedback}\n\nPlease update the theory content based on this feedback."
-            current_state["theory"] = generator.generate_content(prompt)
+            current_state["theory"] = generator.generate_section("theory", sandbox_topic, aim=current_state["aim"], feedback=feedback)
             print_content(current_state["theory"], "theory")
         
         current_state["current_step"] = "procedure"
@@ -187,15 +162,13 @@ def main():
         
         # Step 6: Generate procedure
         print_step_header("procedure", 85.7)
-        prompt = SystemPrompts.PROCEDURE_PROMPT.format(topic=sandbox_topic)
-        procedure = generator.generate_content(prompt)
+        procedure = generator.generate_section("procedure", sandbox_topic, aim=current_state["aim"])
         current_state["procedure"] = procedure
         print_content(procedure, "procedure")
         
         feedback, action = get_user_feedback()
         if action == "update" and feedback:
-            prompt = f"{SystemPrompts.PROCEDURE_PROMPT.format(topic=sandbox_topic)}\n\nUser feedback: {feedback}\n\nPlease update the procedure based on this feedback."
-            current_state["procedure"] = generator.generate_content(prompt)
+            current_state["procedure"] = generator.generate_section("procedure", sandbox_topic, aim=current_state["aim"], feedback=feedback)
             print_content(current_state["procedure"], "procedure")
         
         current_state["current_step"] = "references"
@@ -204,15 +177,13 @@ def main():
         
         # Step 7: Generate references
         print_step_header("references", 100.0)
-        prompt = SystemPrompts.REFERENCES_PROMPT.format(topic=sandbox_topic)
-        references = generator.generate_content(prompt)
+        references = generator.generate_section("references", sandbox_topic, aim=current_state["aim"])
         current_state["references"] = references
         print_content(references, "references")
         
         feedback, action = get_user_feedback()
         if action == "update" and feedback:
-            prompt = f"{SystemPrompts.REFERENCES_PROMPT.format(topic=sandbox_topic)}\n\nUser feedback: {feedback}\n\nPlease update the references based on this feedback."
-            current_state["references"] = generator.generate_content(prompt)
+            current_state["references"] = generator.generate_section("references", sandbox_topic, aim=current_state["aim"], feedback=feedback)
             print_content(current_state["references"], "references")
         
         current_state["current_step"] = "complete"
@@ -1,11 +1,21 @@
 import json
 import os
-from typing import Dict, Any, List, TypedDict, Annotated, Literal
-from langgraph.graph import StateGraph, END
-from pydantic import BaseModel, Field
-import google.generativeai as genai
+import threading
+from typing import Dict, Any, List, Optional, Tuple, TypedDict, Literal, TYPE_CHECKING
 from dotenv import load_dotenv
-import openai
+from providers import CachedContext, create_provider
+from prompt_budget import (
+    AssembledPrompt, PromptPart, assemble_prompt, count_tokens, output_tokens_for,
+    PRIORITY_INSTRUCTIONS, PRIORITY_FEEDBACK, PRIORITY_CONTEXT, PRIORITY_HISTORY, SECTION_OUTPUT_TOKENS,
+)
+from context_cache import ContextCache
+from quiz_filter import near_duplicate_questions, question_text
+from simulation_templates import DEFAULT_SKELETON, get_skeleton
+from sandbox_writer import check_sandbox_name, write_sandbox
+
+if TYPE_CHECKING:
+    from langgraph.graph import StateGraph
+    from sandbox_store import SandboxStore
 
 # Load environment variables
 load_dotenv()
@@ -28,6 +38,26 @@ class SandboxState(TypedDict):
     system_message: str
     user_message: str
 
+def new_sandbox_state(sandbox_topic: str) -> SandboxState:
+    """Initial state for a sandbox that has not generated anything yet."""
+    return SandboxState(
+        sandbox_topic=sandbox_topic,
+        current_step="sandbox_name",
+        sandbox_name="",
+        aim="",
+        pretest=[],
+        posttest=[],
+        theory="",
+        procedure="",
+        references="",
+        user_feedback="",
+        user_action="save",
+        progress=0.0,
+        completed_steps=[],
+        system_message="Starting sandbox generation...",
+        user_message=""
+    )
+
 class SystemPrompts:
     """System prompts for different stages of sandbox generation."""
     
@@ -103,57 +133,182 @@ Include clear instructions and safety measures. Format as markdown."""
 
     REFERENCES_PROMPT = """You are an academic researcher. Create a list of academic references and sources for the sandbox: {topic}"""
 
+    QUIZ_REPLACEMENT_PROMPT = """You are an expert educator. Write {count} new multiple choice questions for the {quiz} of the sandbox: {topic}.
+
+Each question must test something different from all of these existing questions:
+{existing}
+
+Format as JSON array with structure:
+[
+  {{
+    "question": "Question text",
+    "options": ["A", "B", "C", "D"],
+    "correctAnswer": "A",
+    "explanation": "Why this is correct"
+  }}
+]"""
+
+# Prompt template per workflow section.
+SECTION_PROMPTS = {
+    "sandbox_name": SystemPrompts.SANDBOX_NAME_PROMPT,
+    "aim": SystemPrompts.AIM_PROMPT,
+    "pretest": SystemPrompts.PRETEST_PROMPT,
+    "posttest": SystemPrompts.POSTTEST_PROMPT,
+    "theory": SystemPrompts.THEORY_PROMPT,
+    "procedure": SystemPrompts.PROCEDURE_PROMPT,
+    "references": SystemPrompts.REFERENCES_PROMPT,
+}
+
+# How each reviewable section is referred to in feedback prompts and messages.
+SECTION_LABELS = {
+    "aim": "aim",
+    "pretest": "pretest questions",
+    "posttest": "posttest questions",
+    "theory": "theory content",
+    "procedure": "procedure",
+    "references": "references",
+}
+
+QUIZ_SECTIONS = ("pretest", "posttest")
+
+# Rounds of replacing near-duplicate quiz questions before accepting the quiz as is.
+MAX_QUIZ_REPAIR_ROUNDS = 2
+
+# Upper bound on follow-up requests when a reply hits the output limit.
+MAX_CONTINUATIONS = 3
+CONTINUATION_INSTRUCTION = (
+    "Your previous response was cut off because it reached the output limit. "
+    "Continue exactly where it stopped. Do not repeat any text above and do not add a preamble."
+)
+
+
+# Budget left for section instructions, feedback and history after the shared prefix.
+PREFIX_HEADROOM_TOKENS = 2048
+
+
+def stitch_continuation(text: str, continuation: str, max_overlap: int = 200) -> str:
+    """Append ``continuation`` to ``text``, dropping any overlap the model repeated."""
+    for size in range(min(len(text), len(continuation), max_overlap), 7, -1):
+        if text.endswith(continuation[:size]):
+            return text + continuation[size:]
+    return text + continuation
+
 class SandboxGenerator:
     """LangGraph-based sandbox generator with human-in-the-loop."""
     
-    def __init__(self, model_name: str = "gemini-2.5-flash-preview-05-20"):
+    def __init__(self, model_name: str = "gemini-2.5-flash-preview-05-20", raise_errors: bool = False):
         self.model_name = model_name
-        self.model = None
+        # Interactive callers show a failed call as text; job runners want the exception, to retry.
+        self.raise_errors = raise_errors
+        self.provider = None
+        self._graph = None
+        self._graph_lock = threading.Lock()
         self._setup_model()
     
     def _setup_model(self):
         """Setup the AI model based on the model name."""
-        if self.model_name.startswith("gemini"):
-            api_key = os.getenv("GOOGLE_API_KEY")
-            if not api_key:
-                raise ValueError("GOOGLE_API_KEY not found in environment variables")
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel(self.model_name)
-        elif self.model_name.startswith("gpt"):
-            api_key = os.getenv("OPENAI_API_KEY")
-            if not api_key:
-                raise ValueError("OPENAI_API_KEY not found in environment variables")
-            openai.api_key = api_key
-            self.model = self.model_name
-        else:
-            raise ValueError(f"Unsupported model: {self.model_name}")
+        self.provider = create_provider(self.model_name)
+        self.context_cache = ContextCache()
     
     def update_model(self, model_name: str):
         """Update the AI model."""
         self.model_name = model_name
         self._setup_model()
+        with self._graph_lock:
+            self._graph = None
     
-    def generate_content(self, prompt: str) -> str:
-        """Generate content using the selected AI model."""
+    def generate_content(self, prompt: str, max_output_tokens: Optional[int] = None,
+                         section: Optional[str] = None, max_continuations: int = MAX_CONTINUATIONS,
+                         context: Optional[CachedContext] = None) -> str:
+        """Generate content using the selected AI model.
+        
+        The output cap is ``max_output_tokens`` if given, else the allowance for ``section``.
+        A reply cut off by that cap is resumed with up to ``max_continuations``
+        follow-up requests and stitched together, rather than left truncated.
+        ``context`` is a registered prefix that precedes the prompt (see ``sandbox_context``).
+        A failed call returns "Error generating content: ..." unless ``raise_errors`` is set.
+        """
+        if max_output_tokens is None and section is not None:
+            max_output_tokens = output_tokens_for(section, self.model_name)
         try:
-            if self.model_name.startswith("gemini"):
-                response = self.model.generate_content(prompt)
-                return response.text
-            elif self.model_name.startswith("gpt"):
-                response = openai.ChatCompletion.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": "You are an expert educational content generator."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=2000,
-                    temperature=0.7
-                )
-                return response.choices[0].message.content
-            else:
-                return f"Error: Unsupported model {self.model_name}"
+            completion = self.provider.complete(prompt, max_output_tokens=max_output_tokens, context=context)
         except Exception as e:
+            if self.raise_errors:
+                raise
             return f"Error generating content: {str(e)}"
+        self.context_cache.record(completion)
+        
+        text = completion.text
+        for _ in range(max_continuations):
+            if not completion.truncated:
+                break
+            try:
+                completion = self.provider.complete(self._continuation_prompt(prompt, text, max_output_tokens),
+                                                    max_output_tokens=max_output_tokens, context=context)
+            except Exception:
+                break  # keep what was generated so far
+            self.context_cache.record(completion)
+            if not completion.text.strip():
+                break
+            text = stitch_continuation(text, completion.text)
+        return text
+    
+    def _continuation_prompt(self, prompt: str, partial: str, max_output_tokens: Optional[int]) -> str:
+        parts = [
+            PromptPart("instructions", prompt, PRIORITY_INSTRUCTIONS, required=True),
+            PromptPart("partial", partial, PRIORITY_CONTEXT, label="Your response so far", keep="tail"),
+            PromptPart("continue", CONTINUATION_INSTRUCTION, PRIORITY_INSTRUCTIONS, required=True),
+        ]
+        return assemble_prompt(parts, self.model_name, max_output_tokens=max_output_tokens).text
+    
+    def sandbox_prefix(self, topic: str, aim: str = "") -> str:
+        """Shared opening of every prompt for one sandbox: topic and aim.
+        
+        The aim is trimmed so the prefix leaves room for any section's
+        instructions and output. The prefix is short, below Gemini's minimum
+        for an explicit cache, so there it is resent with each prompt.
+        """
+        parts = [PromptPart("topic", f"You are helping build a virtual lab sandbox on: {topic}",
+                            PRIORITY_INSTRUCTIONS, required=True)]
+        if aim:
+            parts.append(PromptPart("aim", aim, PRIORITY_FEEDBACK, label="Sandbox aim"))
+        return assemble_prompt(parts, self.model_name, max_output_tokens=max(SECTION_OUTPUT_TOKENS.values()),
+                               reserved_tokens=PREFIX_HEADROOM_TOKENS).text
+    
+    def sandbox_context(self, topic: str, aim: str = "") -> CachedContext:
+        """The registered prefix for a sandbox, created with the provider on first use."""
+        return self.context_cache.get(self.provider, self.sandbox_prefix(topic, aim))
+    
+    def build_prompt(self, section: str, topic: str, feedback: str = "", history: str = "",
+                     prefix_tokens: int = 0) -> AssembledPrompt:
+        """Assemble a section prompt within the model's token budget.
+        
+        Instructions are always kept; feedback and history are trimmed in that
+        order of importance when the budget is tight. ``prefix_tokens`` is the
+        size of the shared prefix sent ahead of the prompt.
+        """
+        parts = [PromptPart("instructions", SECTION_PROMPTS[section].format(topic=topic),
+                            PRIORITY_INSTRUCTIONS, required=True)]
+        if history:
+            parts.append(PromptPart("history", history, PRIORITY_HISTORY, label="Conversation so far", keep="tail"))
+        if feedback:
+            parts.append(PromptPart("feedback", feedback, PRIORITY_FEEDBACK, label="User feedback"))
+            parts.append(PromptPart("update_request",
+                                    f"Please update the {SECTION_LABELS[section]} based on this feedback.",
+                                    PRIORITY_INSTRUCTIONS, required=True))
+        return assemble_prompt(parts, self.model_name, section, reserved_tokens=prefix_tokens)
+    
+    def generate_section(self, section: str, topic: str, feedback: str = "", aim: str = "",
+                         history: str = "") -> str:
+        """Generate (or, with ``feedback``, regenerate) one section's raw text.
+        
+        The sandbox prefix (topic and ``aim``) is registered once and reused
+        by every section and feedback call on the sandbox.
+        """
+        cached = self.sandbox_context(topic, aim)
+        prompt = self.build_prompt(section, topic, feedback=feedback, history=history,
+                                   prefix_tokens=count_tokens(cached.prefix, self.model_name))
+        return self.generate_content(prompt.text, max_output_tokens=prompt.max_output_tokens, context=cached)
     
     def parse_json_content(self, content: str) -> List[Dict[str, Any]]:
         """Parse JSON content from generated text."""
@@ -168,6 +323,47 @@ class SandboxGenerator:
         except json.JSONDecodeError:
             return []
     
+    def filter_quiz(self, state: SandboxState, section: str,
+                    questions: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """Replace questions that near-duplicate each other or the other quiz.
+        
+        Returns the quiz and the number of questions replaced. Only the
+        offending items are regenerated, in one request per round.
+        """
+        other = state.get("posttest" if section == "pretest" else "pretest") or []
+        questions = list(questions)
+        replaced = 0
+        for _ in range(MAX_QUIZ_REPAIR_ROUNDS):
+            duplicates = near_duplicate_questions(questions, reference=other, provider=self.provider)
+            if not duplicates:
+                break
+            offending = set(duplicates)
+            keep = [q for i, q in enumerate(questions) if i not in offending]
+            prompt = SystemPrompts.QUIZ_REPLACEMENT_PROMPT.format(
+                count=len(duplicates),
+                quiz=section,
+                topic=state["sandbox_topic"],
+                existing="\n".join(f"- {question_text(q)}" for q in list(other) + keep),
+            )
+            fresh = self.parse_json_content(self.generate_content(prompt, section=section))[:len(duplicates)]
+            if not fresh:
+                break
+            for index, question in zip(duplicates, fresh):
+                questions[index] = question
+                replaced += 1
+        return questions, replaced
+    
+    def _quiz(self, state: SandboxState, section: str, content: str) -> Tuple[List[Dict[str, Any]], str]:
+        """Parse and de-duplicate a generated quiz; the note describes any replacements."""
+        questions, replaced = self.filter_quiz(state, section, self.parse_json_content(content))
+        note = f" Replaced {replaced} near-duplicate questions." if replaced else ""
+        return questions, note
+    
+    @staticmethod
+    def _shared_aim(state: SandboxState, section: str) -> str:
+        # The aim joins the shared prefix once it exists, except when the aim itself is being written.
+        return "" if section in ("sandbox_name", "aim") else state.get("aim", "")
+    
     def workflow_step(self, state: SandboxState) -> SandboxState:
         """Main workflow step that handles the entire process."""
         current_step = state.get("current_step", "sandbox_name")
@@ -175,46 +371,22 @@ class SandboxGenerator:
         user_feedback = state.get("user_feedback", "")
         
         # Handle user feedback for updates
-        if user_action == "update" and user_feedback:
-            if current_step == "aim":
-                prompt = f"{SystemPrompts.AIM_PROMPT.format(topic=state['sandbox_topic'])}\n\nUser feedback: {user_feedback}\n\nPlease update the aim based on this feedback."
-                state["aim"] = self.generate_content(prompt)
-                state["system_message"] = "Updated aim based on your feedback. Review again."
-                return state
-            elif current_step == "pretest":
-                prompt = f"{SystemPrompts.PRETEST_PROMPT.format(topic=state['sandbox_topic'])}\n\nUser feedback: {user_feedback}\n\nPlease update the pretest questions based on this feedback."
-                content = self.generate_content(prompt)
-                state["pretest"] = self.parse_json_content(content)
-                state["system_message"] = f"Updated pretest questions based on your feedback. Review again."
-                return state
-            elif current_step == "posttest":
-                prompt = f"{SystemPrompts.POSTTEST_PROMPT.format(topic=state['sandbox_topic'])}\n\nUser feedback: {user_feedback}\n\nPlease update the posttest questions based on this feedback."
-                content = self.generate_content(prompt)
-                state["posttest"] = self.parse_json_content(content)
-                state["system_message"] = f"Updated posttest questions based on your feedback. Review again."
-                return state
-            elif current_step == "theory":
-                prompt = f"{SystemPrompts.THEORY_PROMPT.format(topic=state['sandbox_topic'])}\n\nUser feedback: {user_feedback}\n\nPlease update the theory content based on this feedback."
-                state["theory"] = self.generate_content(prompt)
-                state["system_message"] = "Updated theory content based on your feedback. Review again."
-                return state
-            elif current_step == "procedure":
-                prompt = f"{SystemPrompts.PROCEDURE_PROMPT.format(topic=state['sandbox_topic'])}\n\nUser feedback: {user_feedback}\n\nPlease update the procedure based on this feedback."
-                state["procedure"] = self.generate_content(prompt)
-                state["system_message"] = "Updated procedure based on your feedback. Review again."
-                return state
-            elif current_step == "references":
-                prompt = f"{SystemPrompts.REFERENCES_PROMPT.format(topic=state['sandbox_topic'])}\n\nUser feedback: {user_feedback}\n\nPlease update the references based on this feedback."
-                state["references"] = self.generate_content(prompt)
-                state["system_message"] = "Updated references based on your feedback. Review again."
-                return state
+        if user_action == "update" and user_feedback and current_step in SECTION_LABELS:
+            content = self.generate_section(current_step, state["sandbox_topic"], feedback=user_feedback,
+                                            aim=self._shared_aim(state, current_step))
+            note = ""
+            if current_step in QUIZ_SECTIONS:
+                state[current_step], note = self._quiz(state, current_step, content)
+            else:
+                state[current_step] = content
+            state["system_message"] = f"Updated {SECTION_LABELS[current_step]} based on your feedback. Review again.{note}"
+            return state
         
         # Handle save action - move to next step
         if user_action == "save":
             if current_step == "sandbox_name":
                 # Generate sandbox name
-                prompt = SystemPrompts.SANDBOX_NAME_PROMPT.format(topic=state["sandbox_topic"])
-                name = self.generate_content(prompt).strip()
+                name = self.generate_section("sandbox_name", state["sandbox_topic"]).strip()
                 
                 # Clean up the name
                 name = name.lower()
@@ -230,8 +402,7 @@ class SandboxGenerator:
                 
             elif current_step == "aim":
                 # Generate aim
-                prompt = SystemPrompts.AIM_PROMPT.format(topic=state["sandbox_topic"])
-                aim = self.generate_content(prompt)
+                aim = self.generate_section("aim", state["sandbox_topic"])
                 
                 state["aim"] = aim
                 state["current_step"] = "pretest"
@@ -241,32 +412,29 @@ class SandboxGenerator:
                 
             elif current_step == "pretest":
                 # Generate pretest
-                prompt = SystemPrompts.PRETEST_PROMPT.format(topic=state["sandbox_topic"])
-                content = self.generate_content(prompt)
-                pretest = self.parse_json_content(content)
+                content = self.generate_section("pretest", state["sandbox_topic"], aim=state["aim"])
+                pretest, note = self._quiz(state, "pretest", content)
                 
                 state["pretest"] = pretest
                 state["current_step"] = "posttest"
-                state["system_message"] = f"Generated {len(pretest)} pretest questions. Review and provide feedback."
+                state["system_message"] = f"Generated {len(pretest)} pretest questions.{note} Review and provide feedback."
                 state["progress"] = 42.9
                 state["completed_steps"].append("pretest")
                 
             elif current_step == "posttest":
                 # Generate posttest
-                prompt = SystemPrompts.POSTTEST_PROMPT.format(topic=state["sandbox_topic"])
-                content = self.generate_content(prompt)
-                posttest = self.parse_json_content(content)
+                content = self.generate_section("posttest", state["sandbox_topic"], aim=state["aim"])
+                posttest, note = self._quiz(state, "posttest", content)
                 
                 state["posttest"] = posttest
                 state["current_step"] = "theory"
-                state["system_message"] = f"Generated {len(posttest)} posttest questions. Review and provide feedback."
+                state["system_message"] = f"Generated {len(posttest)} posttest questions.{note} Review and provide feedback."
                 state["progress"] = 57.1
                 state["completed_steps"].append("posttest")
                 
             elif current_step == "theory":
                 # Generate theory
-                prompt = SystemPrompts.THEORY_PROMPT.format(topic=state["sandbox_topic"])
-                theory = self.generate_content(prompt)
+                theory = self.generate_section("theory", state["sandbox_topic"], aim=state["aim"])
                 
                 state["theory"] = theory
                 state["current_step"] = "procedure"
@@ -276,8 +444,7 @@ class SandboxGenerator:
                 
             elif current_step == "procedure":
                 # Generate procedure
-                prompt = SystemPrompts.PROCEDURE_PROMPT.format(topic=state["sandbox_topic"])
-                procedure = self.generate_content(prompt)
+                procedure = self.generate_section("procedure", state["sandbox_topic"], aim=state["aim"])
                 
                 state["procedure"] = procedure
                 state["current_step"] = "references"
@@ -287,8 +454,7 @@ class SandboxGenerator:
                 
             elif current_step == "references":
                 # Generate references
-                prompt = SystemPrompts.REFERENCES_PROMPT.format(topic=state["sandbox_topic"])
-                references = self.generate_content(prompt)
+                references = self.generate_section("references", state["sandbox_topic"], aim=state["aim"])
                 
                 state["references"] = references
                 state["current_step"] = "complete"
@@ -313,8 +479,10 @@ class SandboxGenerator:
         # Continue for all other cases
         return "continue"
     
-    def build_graph(self) -> StateGraph:
+    def build_graph(self) -> "StateGraph":
         """Build the LangGraph workflow."""
+        from langgraph.graph import StateGraph, END
+
         workflow = StateGraph(SandboxState)
         
         # Add single workflow node
@@ -335,520 +503,84 @@ class SandboxGenerator:
         
         return workflow
     
-    def save_content(self, state: SandboxState) -> str:
-        """Save generated content to files."""
-        sandbox_name = state["sandbox_name"]
-        os.makedirs(sandbox_name, exist_ok=True)
-        
-        # Create simulation directory structure
-        simulation_dir = os.path.join(sandbox_name, "simulation")
-        src_dir = os.path.join(simulation_dir, "src")
-        os.makedirs(simulation_dir, exist_ok=True)
-        os.makedirs(src_dir, exist_ok=True)
-        
-        # Create basic simulation files
-        self._create_simulation_files(simulation_dir, src_dir, state)
-        
-        # Save all files
-        with open(f"{sandbox_name}/aim.md", "w") as f:
-            f.write(state["aim"])
-        
-        with open(f"{sandbox_name}/sandbox-name.md", "w") as f:
-            f.write(state["sandbox_name"])
-        
-        with open(f"{sandbox_name}/pretest.json", "w") as f:
-            json.dump({"questions": state["pretest"]}, f, indent=4)
-        
-        with open(f"{sandbox_name}/posttest.json", "w") as f:
-            json.dump({"questions": state["posttest"]}, f, indent=4)
-        
-        with open(f"{sandbox_name}/theory.md", "w") as f:
-            f.write(state["theory"])
-        
-        with open(f"{sandbox_name}/procedure.md", "w") as f:
-            f.write(state["procedure"])
-        
-        with open(f"{sandbox_name}/reference.md", "w") as f:
-            f.write(state["references"])
-        
-        return sandbox_name
-    
-    def _create_simulation_files(self, simulation_dir: str, src_dir: str, state: SandboxState):
-        """Create basic simulation files."""
-        sandbox_topic = state["sandbox_topic"]
-        sandbox_name = state["sandbox_name"]
-        
-        # Create index.html
-        html_content = f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{sandbox_topic} - Interactive Simulation</title>
-    <link rel="stylesheet" href="src/style.css">
-</head>
-<body>
-    <div class="container">
-        <header>
-            <h1>{sandbox_topic}</h1>
-            <p>Interactive Simulation for Educational Purposes</p>
-        </header>
-        
-        <main>
-            <div class="simulation-area">
-                <div class="controls">
-                    <h3>Simulation Controls</h3>
-                    <div class="control-group">
-                        <label for="parameter1">Parameter 1:</label>
-                        <input type="range" id="parameter1" min="0" max="100" value="50">
-                        <span id="value1">50</span>
-                    </div>
-                    <div class="control-group">
-                        <label for="parameter2">Parameter 2:</label>
-                        <input type="range" id="parameter2" min="0" max="100" value="25">
-                        <span id="value2">25</span>
-                    </div>
-                    <button id="startBtn">Start Simulation</button>
-                    <button id="resetBtn">Reset</button>
-                </div>
-                
-                <div class="visualization">
-                    <canvas id="simulationCanvas" width="600" height="400"></canvas>
-                    <div class="data-display">
-                        <h4>Real-time Data</h4>
-                        <div id="dataOutput">Waiting for simulation to start...</div>
-                    </div>
-                </div>
-            </div>
-            
-            <div class="instructions">
-                <h3>Instructions</h3>
-                <ol>
-                    <li>Adjust the parameters using the sliders above</li>
-                    <li>Click "Start Simulation" to begin the simulation</li>
-                    <li>Observe the changes in the visualization</li>
-                    <li>Record your observations in the data display</li>
-                    <li>Use "Reset" to start over with new parameters</li>
-                </ol>
-            </div>
-        </main>
-        
-        <footer>
-            <p>This simulation demonstrates the principles of {sandbox_topic.lower()}</p>
-        </footer>
-    </div>
-    
-    <script src="src/main.js"></script>
-</body>
-</html>"""
-        
-        with open(os.path.join(simulation_dir, "index.html"), "w") as f:
-            f.write(html_content)
-        
-        # Create style.css
-        css_content = """/* Simulation Styles */
-* {
-    margin: 0;
-    padding: 0;
-    box-sizing: border-box;
-}
-
-body {
-    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-    min-height: 100vh;
-    color: #333;
-}
-
-.container {
-    max-width: 1200px;
-    margin: 0 auto;
-    padding: 20px;
-}
-
-header {
-    text-align: center;
-    margin-bottom: 30px;
-    color: white;
-}
-
-header h1 {
-    font-size: 2.5em;
-    margin-bottom: 10px;
-    text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
-}
-
-header p {
-    font-size: 1.2em;
-    opacity: 0.9;
-}
-
-.simulation-area {
-    background: white;
-    border-radius: 15px;
-    padding: 30px;
-    box-shadow: 0 10px 30px rgba(0,0,0,0.2);
-    margin-bottom: 30px;
-}
-
-.controls {
-    margin-bottom: 30px;
-    padding: 20px;
-    background: #f8f9fa;
-    border-radius: 10px;
-}
-
-.controls h3 {
-    margin-bottom: 20px;
-    color: #495057;
-}
-
-.control-group {
-    margin-bottom: 15px;
-    display: flex;
-    align-items: center;
-    gap: 15px;
-}
-
-.control-group label {
-    min-width: 120px;
-    font-weight: 600;
-}
-
-.control-group input[type="range"] {
-    flex: 1;
-    height: 6px;
-    border-radius: 3px;
-    background: #ddd;
-    outline: none;
-    -webkit-appearance: none;
-}
-
-.control-group input[type="range"]::-webkit-slider-thumb {
-    -webkit-appearance: none;
-    width: 20px;
-    height: 20px;
-    border-radius: 50%;
-    background: #667eea;
-    cursor: pointer;
-}
-
-.control-group span {
-    min-width: 40px;
-    text-align: center;
-    font-weight: 600;
-    color: #667eea;
-}
-
-button {
-    background: #667eea;
-    color: white;
-    border: none;
-    padding: 12px 24px;
-    border-radius: 8px;
-    cursor: pointer;
-    font-size: 16px;
-    font-weight: 600;
-    margin-right: 10px;
-    transition: all 0.3s ease;
-}
-
-button:hover {
-    background: #5a6fd8;
-    transform: translateY(-2px);
-    box-shadow: 0 5px 15px rgba(102, 126, 234, 0.4);
-}
-
-.visualization {
-    display: flex;
-    gap: 30px;
-    align-items: flex-start;
-}
-
-#simulationCanvas {
-    border: 2px solid #e9ecef;
-    border-radius: 10px;
-    background: #f8f9fa;
-    flex: 1;
-}
-
-.data-display {
-    flex: 1;
-    padding: 20px;
-    background: #f8f9fa;
-    border-radius: 10px;
-    border: 2px solid #e9ecef;
-}
-
-.data-display h4 {
-    margin-bottom: 15px;
-    color: #495057;
-}
-
-#dataOutput {
-    font-family: 'Courier New', monospace;
-    font-size: 14px;
-    line-height: 1.6;
-    color: #6c757d;
-}
-
-.instructions {
-    background: white;
-    border-radius: 15px;
-    padding: 30px;
-    box-shadow: 0 10px 30px rgba(0,0,0,0.2);
-}
-
-.instructions h3 {
-    margin-bottom: 20px;
-    color: #495057;
-}
-
-.instructions ol {
-    padding-left: 20px;
-}
-
-.instructions li {
-    margin-bottom: 10px;
-    line-height: 1.6;
-    color: #6c757d;
-}
-
-footer {
-    text-align: center;
-    margin-top: 30px;
-    color: white;
-    opacity: 0.8;
-}
-
-/* Responsive Design */
-@media (max-width: 768px) {
-    .visualization {
-        flex-direction: column;
-    }
-    
-    .control-group {
-        flex-direction: column;
-        align-items: flex-start;
-        gap: 10px;
-    }
-    
-    .control-group label {
-        min-width: auto;
-    }
-}"""
-        
-        with open(os.path.join(src_dir, "style.css"), "w") as f:
-            f.write(css_content)
-        
-        # Create main.js
-        js_content = f"""// {sandbox_topic} Simulation
-class ExperimentSimulation {{
-    constructor() {{
-        this.canvas = document.getElementById('simulationCanvas');
-        this.ctx = this.canvas.getContext('2d');
-        this.isRunning = false;
-        this.animationId = null;
-        this.time = 0;
-        
-        this.initializeControls();
-        this.setupEventListeners();
-        this.drawInitialState();
-    }}
-    
-    initializeControls() {{
-        this.param1Slider = document.getElementById('parameter1');
-        this.param2Slider = document.getElementById('parameter2');
-        this.value1Display = document.getElementById('value1');
-        this.value2Display = document.getElementById('value2');
-        this.startBtn = document.getElementById('startBtn');
-        this.resetBtn = document.getElementById('resetBtn');
-        this.dataOutput = document.getElementById('dataOutput');
-        
-        // Update displays when sliders change
-        this.param1Slider.addEventListener('input', (e) => {{
-            this.value1Display.textContent = e.target.value;
-            this.updateDataDisplay();
-        }});
-        
-        this.param2Slider.addEventListener('input', (e) => {{
-            this.value2Display.textContent = e.target.value;
-            this.updateDataDisplay();
-        }});
-    }}
-    
-    setupEventListeners() {{
-        this.startBtn.addEventListener('click', () => this.toggleSimulation());
-        this.resetBtn.addEventListener('click', () => this.resetSimulation());
-    }}
-    
-    toggleSimulation() {{
-        if (this.isRunning) {{
-            this.stopSimulation();
-        }} else {{
-            this.startSimulation();
-        }}
-    }}
-    
-    startSimulation() {{
-        this.isRunning = true;
-        this.startBtn.textContent = 'Stop Simulation';
-        this.startBtn.style.background = '#dc3545';
-        this.animate();
-    }}
+    def compiled_graph(self):
+        """Return the compiled workflow, compiling it once per generator."""
+        with self._graph_lock:
+            if self._graph is None:
+                self._graph = self.build_graph().compile()
+            return self._graph
     
-    stopSimulation() {{
-        this.isRunning = false;
-        this.startBtn.textContent = 'Start Simulation';
-        this.startBtn.style.background = '#667eea';
-        if (this.animationId) {{
-            cancelAnimationFrame(this.animationId);
-        }}
-    }}
+    def _document_files(self, state: SandboxState) -> Dict[str, str]:
+        """Render the markdown and JSON documents, keyed by file name."""
+        return {
+            "aim.md": state["aim"],
+            "sandbox-name.md": state["sandbox_name"],
+            "pretest.json": json.dumps({"questions": state["pretest"]}, indent=4),
+            "posttest.json": json.dumps({"questions": state["posttest"]}, indent=4),
+            "theory.md": state["theory"],
+            "procedure.md": state["procedure"],
+            "reference.md": state["references"],
+        }
     
-    resetSimulation() {{
-        this.stopSimulation();
-        this.time = 0;
-        this.param1Slider.value = 50;
-        this.param2Slider.value = 25;
-        this.value1Display.textContent = '50';
-        this.value2Display.textContent = '25';
-        this.drawInitialState();
-        this.updateDataDisplay();
-    }}
+    def sandbox_files(self, state: SandboxState, skeleton: str = DEFAULT_SKELETON) -> Dict[str, str]:
+        """Render every sandbox file in memory, keyed by path relative to the sandbox directory."""
+        files = self._document_files(state)
+        sim_skeleton = get_skeleton(skeleton)
+        context = sim_skeleton.context(state["sandbox_topic"], state["sandbox_name"])
+        for path, content in sim_skeleton.render_all(context).items():
+            files[f"simulation/{path}"] = content
+        return files
     
-    animate() {{
-        if (!this.isRunning) return;
-        
-        this.time += 0.016; // Approximately 60 FPS
-        this.updateSimulation();
-        this.draw();
-        this.updateDataDisplay();
-        
-        this.animationId = requestAnimationFrame(() => this.animate());
-    }}
-    
-    updateSimulation() {{
-        // This is where the specific experiment logic would go
-        // For now, we'll create a simple animated visualization
-        const param1 = parseFloat(this.param1Slider.value);
-        const param2 = parseFloat(this.param2Slider.value);
-        
-        // Example: Create a wave pattern based on parameters
-        this.waveData = [];
-        for (let x = 0; x < this.canvas.width; x++) {{
-            const y = this.canvas.height/2 + 
-                     Math.sin(x * 0.02 + this.time) * param1 * 0.5 +
-                     Math.cos(x * 0.01 + this.time * 0.5) * param2 * 0.3;
-            this.waveData.push({{x, y}});
-        }}
-    }}
-    
-    draw() {{
-        // Clear canvas
-        this.ctx.clearRect(0, 0, this.canvas.width, this.canvas.height);
-        
-        // Draw background grid
-        this.drawGrid();
-        
-        // Draw simulation data
-        if (this.waveData) {{
-            this.drawWave();
-        }}
-        
-        // Draw particles or objects based on experiment type
-        this.drawParticles();
-    }}
-    
-    drawGrid() {{
-        this.ctx.strokeStyle = '#e9ecef';
-        this.ctx.lineWidth = 1;
-        
-        // Vertical lines
-        for (let x = 0; x < this.canvas.width; x += 50) {{
-            this.ctx.beginPath();
-            this.ctx.moveTo(x, 0);
-            this.ctx.lineTo(x, this.canvas.height);
-            this.ctx.stroke();
-        }}
-        
-        // Horizontal lines
-        for (let y = 0; y < this.canvas.height; y += 50) {{
-            this.ctx.beginPath();
-            this.ctx.moveTo(0, y);
-            this.ctx.lineTo(this.canvas.width, y);
-            this.ctx.stroke();
-        }}
-    }}
-    
-    drawWave() {{
-        this.ctx.strokeStyle = '#667eea';
-        this.ctx.lineWidth = 3;
-        this.ctx.beginPath();
-        
-        for (let i = 0; i < this.waveData.length; i++) {{
-            const point = this.waveData[i];
-            if (i === 0) {{
-                this.ctx.moveTo(point.x, point.y);
-            }} else {{
-                this.ctx.lineTo(point.x, point.y);
-            }}
-        }}
-        
-        this.ctx.stroke();
-    }}
-    
-    drawParticles() {{
-        const param1 = parseFloat(this.param1Slider.value);
-        const param2 = parseFloat(this.param2Slider.value);
-        
-        // Draw some particles that respond to the parameters
-        for (let i = 0; i < 5; i++) {{
-            const x = 100 + i * 100;
-            const y = 100 + Math.sin(this.time + i) * param1 * 0.5;
-            
-            this.ctx.fillStyle = `hsl(${{240 + param2 * 2}}, 70%, 60%)`;
-            this.ctx.beginPath();
-            this.ctx.arc(x, y, 10 + param1 * 0.1, 0, Math.PI * 2);
-            this.ctx.fill();
-        }}
-    }}
-    
-    drawInitialState() {{
-        this.ctx.clearRect(0, 0, this.canvas.width, this.canvas.height);
-        this.drawGrid();
-        
-        // Draw initial message
-        this.ctx.fillStyle = '#6c757d';
-        this.ctx.font = '20px Arial';
-        this.ctx.textAlign = 'center';
-        this.ctx.fillText('Adjust parameters and click Start to begin simulation', 
-                         this.canvas.width/2, this.canvas.height/2);
-    }}
-    
-    updateDataDisplay() {{
-        const param1 = parseFloat(this.param1Slider.value);
-        const param2 = parseFloat(this.param2Slider.value);
-        
-        this.dataOutput.innerHTML = `
-            <strong>Current Parameters:</strong><br>
-            Parameter 1: ${{param1}}<br>
-            Parameter 2: ${{param2}}<br><br>
-            <strong>Simulation Status:</strong><br>
-            Running: ${{this.isRunning ? 'Yes' : 'No'}}<br>
-            Time: ${{this.time.toFixed(2)}}s<br><br>
-            <strong>Calculated Values:</strong><br>
-            Amplitude: ${{(param1 * 0.5).toFixed(2)}}<br>
-            Frequency: ${{(param2 * 0.01).toFixed(3)}}<br>
-            Phase: ${{(this.time * 0.5).toFixed(2)}}
-        `;
-    }}
-}}
-
-// Initialize simulation when page loads
-document.addEventListener('DOMContentLoaded', () => {{
-    new ExperimentSimulation();
-}});"""
-        
-        with open(os.path.join(src_dir, "main.js"), "w") as f:
-            f.write(js_content) 
\ No newline at end of file
+    def save_content(self, state: SandboxState, skeleton: str = DEFAULT_SKELETON,
+                     link_assets: bool = False, store: Optional["SandboxStore"] = None,
+                     output_dir: str = "") -> str:
+        """Save generated content to files, in ``output_dir``/<sandbox name>; returns that path.
+        
+        The sandbox directory is staged and renamed into place atomically (see
+        ``sandbox_writer``). Only the per-sandbox simulation files are rendered;
+        the skeleton's static assets are copied, or hard-linked with ``link_assets``
+        (which shares them with the template; only for output treated as read-only).
+        When a ``store`` is given, the files are also committed as a new version.
+        Raises ValueError for an empty or unsafe sandbox name.
+        """
+        sandbox_name = check_sandbox_name(state["sandbox_name"])
+        dest = os.path.join(output_dir, sandbox_name)
+        sim_skeleton = get_skeleton(skeleton)
+        context = sim_skeleton.context(state["sandbox_topic"], sandbox_name)
+        files = self._document_files(state)
+        for path, content in sim_skeleton.render(context).items():
+            files[f"simulation/{path}"] = content
+        static_assets = {f"simulation/{path}": source for path, source in sim_skeleton.static_assets.items()}
+        
+        write_sandbox(dest, files, static_assets=static_assets, link_assets=link_assets)
+        if store is not None:
+            for path, content in sim_skeleton.static_contents().items():
+                files[f"simulation/{path}"] = content
+            store.commit(sandbox_name, files, metadata={
+                "sandbox_topic": state["sandbox_topic"],
+                "model_name": self.model_name,
+                "skeleton": skeleton,
+            })
+        return dest
+
+
+_shared_generators: Dict[Tuple[str, bool], SandboxGenerator] = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_generator(model_name: str = "gemini-2.5-flash-preview-05-20",
+                         raise_errors: bool = False) -> SandboxGenerator:
+    """Process-wide generator for ``model_name`` (and ``raise_errors``, see ``generate_content``).
+
+    One instance (and its compiled graph) is shared by every caller using
+    the same model. Its only per-sandbox state is ``context_cache``, the
+    registered prefixes keyed by topic and aim, which is safe to share
+    between threads. Callers must not call ``update_model`` on a shared
+    instance.
+    """
+    with _shared_lock:
+        generator = _shared_generators.get((model_name, raise_errors))
+        if generator is None:
+            generator = SandboxGenerator(model_name, raise_errors)
+            _shared_generators[(model_name, raise_errors)] = generator
+        return generator
@@ -1,9 +1,12 @@
 import streamlit as st
+import copy
 import json
-import os
-import zipfile
-import io
-from langgraph_experiment_generator import SandboxGenerator, SandboxState, SystemPrompts
+import time
+from langgraph_experiment_generator import SandboxGenerator, new_sandbox_state, get_shared_generator
+from jobs import JobManager, DONE
+from exporter import build_zip, select_files, content_hash
+from chat_memory import ChatMemory
+from prompt_budget import PromptPart, assemble_prompt, PRIORITY_INSTRUCTIONS, PRIORITY_CONTEXT, PRIORITY_HISTORY
 
 # Page configuration
 st.set_page_config(
@@ -93,16 +96,117 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Initialize session state
-if 'generator' not in st.session_state:
-    st.session_state.generator = SandboxGenerator()
+@st.cache_resource(show_spinner=False)
+def get_generator(model_name: str) -> SandboxGenerator:
+    """Generator (and compiled graph) shared by every session using this model."""
+    generator = get_shared_generator(model_name)
+    generator.compiled_graph()
+    return generator
+
+@st.cache_resource(show_spinner=False)
+def get_job_manager() -> JobManager:
+    """Background executor shared by all sessions; jobs outlive script reruns."""
+    return JobManager(max_workers=8)
+
+def step_logic(state, generator, feedback, action):
+    """Step logic for the workflow."""
+    state["user_feedback"] = feedback
+    state["user_action"] = "save" if action == "skip" else action
+    return generator.workflow_step(state)
+
+def run_step_job(job, state, generator, feedback, action):
+    """Background job body for one workflow step: a single section call, so only its message is reported."""
+    step = state["current_step"].replace("_", " ")
+    verb = "Updating" if action == "update" else "Generating"
+    job.update(message=f"{verb} {step}...")
+    return step_logic(state, generator, feedback, action)
+
+CHAT_INSTRUCTIONS = """You are a helpful AI assistant for an educational sandbox generator. 
+The user is working on creating educational content and may ask questions about the process, 
+request help with content generation, or need guidance.
+Please provide a helpful, informative response that assists the user with their sandbox generation process.
+Keep responses concise but helpful."""
+
+# Messages shown initially in the chat panel; "Show earlier" pages back through the buffer.
+CHAT_PAGE_SIZE = 30
+
+def build_chat_prompt(generator, message, history, state=None):
+    """Chat prompt with the conversation memory and current sandbox, within the model's budget."""
+    parts = [PromptPart("instructions", CHAT_INSTRUCTIONS, PRIORITY_INSTRUCTIONS, required=True)]
+    if state:
+        parts.append(PromptPart("sandbox", f"Topic: {state['sandbox_topic']}\nCurrent step: {state['current_step']}",
+                                PRIORITY_CONTEXT, label="Current sandbox"))
+    parts.append(PromptPart("history", history, PRIORITY_HISTORY, label="Conversation so far", keep="tail"))
+    parts.append(PromptPart("message", message, PRIORITY_INSTRUCTIONS, label="User message", required=True))
+    return assemble_prompt(parts, generator.model_name, section="chat")
+
+def run_chat_job(job, generator, message, memory, state):
+    """Background job body for a chat reply.
+    
+    ``memory`` is a snapshot taken before ``message`` was added. If it is over
+    its token cap, old messages are folded into the summary first; the new
+    summary is returned so the session's memory can apply it too. If the
+    summary call fails, the summary is None and the messages stay pending.
+    """
+    summary = None
+    summary_request = memory.summary_request()
+    if summary_request is not None:
+        job.update(message="Summarising earlier conversation...")
+        epoch, last_seq, summary_prompt = summary_request
+        # Raise rather than return error text, which would replace the summary and drop the messages.
+        summarizer = get_shared_generator(generator.model_name, raise_errors=True)
+        try:
+            summary = (epoch, last_seq, summarizer.generate_content(summary_prompt, section="chat_summary"))
+        except Exception:
+            pass  # summarised on a later message
+        else:
+            memory.apply_summary(*summary)
+    job.update(message="Thinking...")
+    prompt = build_chat_prompt(generator, message, memory.context(), state)
+    reply = generator.generate_content(prompt.text, max_output_tokens=prompt.max_output_tokens)
+    return {"reply": reply, "summary": summary}
+
+def submit_job(kind, fn, *args, messages=None, description=""):
+    """Start a background job for this session; results are applied on a later rerun."""
+    job = get_job_manager().submit(fn, *args, description=description)
+    st.session_state.active_job_id = job.id
+    st.session_state.job_kind = kind
+    st.session_state.job_messages = messages or []
+
+# Initialize session state. Sessions only hold their own SandboxState and UI
+# flags; the generator is a shared resource looked up by model name.
+if 'current_state' not in st.session_state:
     st.session_state.current_state = None
     st.session_state.is_generating = False
     st.session_state.completed = False
     st.session_state.feedback = ""
     st.session_state.action = ""
-    st.session_state.chat_history = []
+    st.session_state.chat_memory = ChatMemory()
+    st.session_state.chat_visible = CHAT_PAGE_SIZE
     st.session_state.selected_model = "gemini-2.5-flash-preview-05-20"
+    st.session_state.active_job_id = None
+    st.session_state.job_kind = ""
+    st.session_state.job_messages = []
+
+# Collect the result of this session's background job once it has finished.
+active_job = get_job_manager().get(st.session_state.active_job_id)
+if active_job is not None and active_job.finished:
+    if active_job.status == DONE:
+        if st.session_state.job_kind == "step":
+            st.session_state.current_state = active_job.result
+            for message in st.session_state.job_messages:
+                st.session_state.chat_memory.append(message["role"], message["content"])
+        elif st.session_state.job_kind == "chat":
+            if active_job.result["summary"] is not None:
+                st.session_state.chat_memory.apply_summary(*active_job.result["summary"])
+            st.session_state.chat_memory.append("assistant", active_job.result["reply"])
+    else:
+        st.session_state.chat_memory.append(
+            "assistant", f"I apologize, but I encountered an error: {active_job.error}. Please try again.")
+    st.session_state.active_job_id = None
+    st.session_state.job_messages = []
+    active_job = None
+job_running = active_job is not None
 
 # Main header
 st.markdown('<h1 class="main-header">🧪 Human-in-the-Loop Sandbox Generator</h1>', unsafe_allow_html=True)
@@ -134,9 +238,9 @@ with left_col:
     )
     
     if selected_model != st.session_state.selected_model:
-        st.session_state.selected_model = selected_model
         try:
-            st.session_state.generator.update_model(selected_model)
+            get_generator(selected_model)
+            st.session_state.selected_model = selected_model
             st.success(f"Model changed to: {model_options[selected_model]}")
         except Exception as e:
             st.error(f"Failed to update model: {str(e)}")
@@ -151,34 +255,15 @@ with left_col:
         help="Describe the sandbox you want to generate content for"
     )
     
-    if st.button("🚀 Start Generation", type="primary", use_container_width=True):
+    if st.button("🚀 Start Generation", type="primary", use_container_width=True, disabled=job_running):
         if sandbox_topic.strip():
-            initial_state = SandboxState(
-                sandbox_topic=sandbox_topic,
-                current_step="sandbox_name",
-                sandbox_name="",
-                aim="",
-                pretest=[],
-                posttest=[],
-                theory="",
-                procedure="",
-                references="",
-                user_feedback="",
-                user_action="save",
-                progress=0.0,
-                completed_steps=[],
-                system_message="Starting sandbox generation...",
-                user_message=""
-            )
+            initial_state = new_sandbox_state(sandbox_topic)
             st.session_state.current_state = initial_state
             st.session_state.is_generating = True
             st.session_state.completed = False
             st.session_state.feedback = ""
             st.session_state.action = ""
-            st.session_state.chat_history.append({
-                "role": "system",
-                "content": f"Started new sandbox generation for: {sandbox_topic}"
-            })
+            st.session_state.chat_memory.append("system", f"Started new sandbox generation for: {sandbox_topic}")
             st.rerun()
         else:
             st.error("Please enter a sandbox topic.")
@@ -189,20 +274,23 @@ with left_col:
         st.markdown('<div class="settings-box">', unsafe_allow_html=True)
         st.subheader("📥 Downloads")
         
-        # Main ZIP download
-        sandbox_name = st.session_state.generator.save_content(st.session_state.current_state)
-        buffer = io.BytesIO()
-        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(sandbox_name):
-                for file in files:
-                    filepath = os.path.join(root, file)
-                    arcname = os.path.relpath(filepath, sandbox_name)
-                    with open(filepath, 'rb') as f:
-                        zipf.writestr(arcname, f.read())
+        # Archives are built from the in-memory state and cached by content hash,
+        # so reruns neither touch the disk nor re-zip unchanged content.
+        generator = get_generator(st.session_state.selected_model)
+        sandbox_name = st.session_state.current_state["sandbox_name"]
+        sandbox_files = generator.sandbox_files(st.session_state.current_state)
+        files_hash = content_hash(sandbox_files)
+        if st.session_state.get("saved_hash") != files_hash:
+            try:
+                generator.save_content(st.session_state.current_state)
+            except (ValueError, FileExistsError) as e:
+                st.error(f"Not saved to disk: {e}")  # the downloads below still work
+            st.session_state.saved_hash = files_hash
         
+        # Main ZIP download
         st.download_button(
             label="📦 All Files (ZIP)",
-            data=buffer.getvalue(),
+            data=build_zip(sandbox_files),
             file_name=f"{sandbox_name}.zip",
             mime="application/zip",
             use_container_width=True
@@ -260,19 +348,11 @@ with left_col:
             )
         
         # Simulation directory download
-        sim_dir = os.path.join(sandbox_name, "simulation")
-        if os.path.exists(sim_dir):
-            sim_buffer = io.BytesIO()
-            with zipfile.ZipFile(sim_buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(sim_dir):
-                    for file in files:
-                        filepath = os.path.join(root, file)
-                        arcname = os.path.relpath(filepath, sandbox_name)
-                        with open(filepath, 'rb') as f:
-                            zipf.writestr(arcname, f.read())
+        simulation_files = select_files(sandbox_files, "simulation/")
+        if simulation_files:
             st.download_button(
                 label="🕹️ Simulation (ZIP)",
-                data=sim_buffer.getvalue(),
+                data=build_zip(simulation_files),
                 file_name=f"{sandbox_name}_simulation.zip",
                 mime="application/zip",
                 use_container_width=True
@@ -285,7 +365,7 @@ with middle_col:
     
     if st.session_state.current_state is not None:
         state = st.session_state.current_state
-        generator = st.session_state.generator
+        generator = get_generator(st.session_state.selected_model)
         
         # Progress bar
         st.markdown('<div class="progress-container">', unsafe_allow_html=True)
@@ -294,6 +374,11 @@ with middle_col:
         st.caption(f"Progress: {progress:.1f}% - {state.get('current_step', 'Unknown').title()}")
         st.markdown('</div>', unsafe_allow_html=True)
         
+        # Background job status
+        if job_running:
+            job_info = active_job.snapshot()
+            st.info(f"⏳ {job_info['message']} ({job_info['elapsed']:.0f}s) — you can keep browsing, the result will appear here.")
+        
         # System message
         if state.get("system_message"):
             st.markdown(f'<div class="content-box">{state["system_message"]}</div>', unsafe_allow_html=True)
@@ -373,43 +458,40 @@ with middle_col:
             
             col1, col2, col3 = st.columns([1, 1, 1])
             with col1:
-                if st.button("🔄 Update", use_container_width=True, key="update_btn"):
+                if st.button("🔄 Update", use_container_width=True, key="update_btn", disabled=job_running):
                     st.session_state.feedback = feedback
                     st.session_state.action = "update"
-                    st.session_state.current_state = step_logic(state, generator, feedback, "update")
-                    st.session_state.chat_history.append({
-                        "role": "user",
-                        "content": f"Feedback: {feedback}"
-                    })
-                    st.session_state.chat_history.append({
-                        "role": "assistant",
-                        "content": "Updated content based on your feedback."
-                    })
+                    st.session_state.chat_memory.append("user", f"Feedback: {feedback}")
+                    submit_job("step", run_step_job, copy.deepcopy(state), generator, feedback, "update",
+                               description=f"update {current_step}",
+                               messages=[{
+                                   "role": "assistant",
+                                   "content": "Updated content based on your feedback."
+                               }])
                     st.rerun()
             with col2:
-                if st.button("💾 Save & Continue", type="primary", use_container_width=True, key="save_btn"):
+                if st.button("💾 Save & Continue", type="primary", use_container_width=True, key="save_btn", disabled=job_running):
                     st.session_state.feedback = feedback
                     st.session_state.action = "save"
-                    st.session_state.current_state = step_logic(state, generator, feedback, "save")
                     if feedback:
-                        st.session_state.chat_history.append({
-                            "role": "user",
-                            "content": f"Feedback: {feedback}"
-                        })
-                    st.session_state.chat_history.append({
-                        "role": "assistant",
-                        "content": f"Completed {current_step} step and moving to next."
-                    })
+                        st.session_state.chat_memory.append("user", f"Feedback: {feedback}")
+                    submit_job("step", run_step_job, copy.deepcopy(state), generator, feedback, "save",
+                               description=f"save {current_step}",
+                               messages=[{
+                                   "role": "assistant",
+                                   "content": f"Completed {current_step} step and moving to next."
+                               }])
                     st.rerun()
             with col3:
-                if st.button("⏭️ Skip Feedback", use_container_width=True, key="skip_btn"):
+                if st.button("⏭️ Skip Feedback", use_container_width=True, key="skip_btn", disabled=job_running):
                     st.session_state.feedback = ""
                     st.session_state.action = "skip"
-                    st.session_state.current_state = step_logic(state, generator, "", "skip")
-                    st.session_state.chat_history.append({
-                        "role": "assistant",
-                        "content": f"Skipped feedback for {current_step} step."
-                    })
+                    submit_job("step", run_step_job, copy.deepcopy(state), generator, "", "skip",
+                               description=f"skip {current_step}",
+                               messages=[{
+                                   "role": "assistant",
+                                   "content": f"Skipped feedback for {current_step} step."
+                               }])
                     st.rerun()
     
     else:
@@ -438,16 +520,14 @@ with middle_col:
 with right_col:
     st.markdown('<h3 class="step-header">💬 Chat</h3>', unsafe_allow_html=True)
     
-    # Chat history with scrollable container
-    st.markdown('<div class="chat-container">', unsafe_allow_html=True)
-    for message in st.session_state.chat_history:
-        if message["role"] == "user":
-            st.markdown(f'<div class="chat-message chat-user"><strong>You:</strong> {message["content"]}</div>', unsafe_allow_html=True)
-        elif message["role"] == "assistant":
-            st.markdown(f'<div class="chat-message chat-ai"><strong>AI:</strong> {message["content"]}</div>', unsafe_allow_html=True)
-        elif message["role"] == "system":
-            st.markdown(f'<div class="chat-message chat-ai"><strong>System:</strong> {message["content"]}</div>', unsafe_allow_html=True)
-    st.markdown('</div>', unsafe_allow_html=True)
+    # Chat history: only the newest page of the ring buffer is rendered, as one element
+    memory = st.session_state.chat_memory
+    if len(memory.messages) > st.session_state.chat_visible:
+        hidden = len(memory.messages) - st.session_state.chat_visible
+        if st.button(f"Show earlier ({hidden})", use_container_width=True, key="chat_earlier"):
+            st.session_state.chat_visible += CHAT_PAGE_SIZE
+            st.rerun()
+    st.markdown(memory.render_html(st.session_state.chat_visible), unsafe_allow_html=True)
     
     # Chat input
     st.markdown("---")
@@ -459,39 +539,22 @@ with right_col:
     
     col1, col2 = st.columns([3, 1])
     with col1:
-        if st.button("Send", use_container_width=True):
+        if st.button("Send", use_container_width=True, disabled=job_running):
             if chat_input.strip():
-                st.session_state.chat_history.append({
-                    "role": "user",
-                    "content": chat_input
-                })
+                memory = st.session_state.chat_memory
+                snapshot = copy.deepcopy(memory)
+                memory.append("user", chat_input)
                 
-                # Generate AI response using the selected model
-                try:
-                    chat_prompt = f"""You are a helpful AI assistant for an educational sandbox generator. 
-The user is working on creating educational content and may ask questions about the process, 
-request help with content generation, or need guidance.
-
-User message: {chat_input}
-
-Please provide a helpful, informative response that assists the user with their sandbox generation process.
-Keep responses concise but helpful."""
-
-                    ai_response = st.session_state.generator.generate_content(chat_prompt)
-                    st.session_state.chat_history.append({
-                        "role": "assistant",
-                        "content": ai_response
-                    })
-                except Exception as e:
-                    st.session_state.chat_history.append({
-                        "role": "assistant",
-                        "content": f"I apologize, but I encountered an error: {str(e)}. Please try again."
-                    })
+                # Generate AI response using the selected model in the background
+                submit_job("chat", run_chat_job, get_generator(st.session_state.selected_model), chat_input,
+                           snapshot, copy.deepcopy(st.session_state.current_state),
+                           description="chat reply")
                 st.rerun()
     
     with col2:
         if st.button("Clear", use_container_width=True):
-            st.session_state.chat_history = []
+            st.session_state.chat_memory.clear()
+            st.session_state.chat_visible = CHAT_PAGE_SIZE
             st.rerun()
 
 # Footer
@@ -502,100 +565,7 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-def step_logic(state, generator, feedback, action):
-    """Step logic for the workflow."""
-    current_step = state["current_step"]
-    sandbox_topic = state["sandbox_topic"]
-    
-    if action == "update" and feedback:
-        if current_step == "aim":
-            prompt = f"{SystemPrompts.AIM_PROMPT.format(topic=sandbox_topic)}\n\nUser feedback: {feedback}\n\nPlease update the aim based on this feedback."
-            state["aim"] = generator.generate_content(prompt)
-            state["system_message"] = "Updated aim based on your feedback. Review again."
-        elif current_step == "pretest":
-            prompt = f"{SystemPrompts.PRETEST_PROMPT.format(topic=sandbox_topic)}\n\nUser feedback: {feedback}\n\nPlease update the pretest questions based on this feedback."
-            content = generator.generate_content(prompt)
-            state["pretest"] = generator.parse_json_content(content)
-            state["system_message"] = f"Updated pretest questions based on your feedback. Review again."
-        elif current_step == "posttest":
-            prompt = f"{SystemPrompts.POSTTEST_PROMPT.format(topic=sandbox_topic)}\n\nUser feedback: {feedback}\n\nPlease update the posttest questions based on this feedback."
-            content = generator.generate_content(prompt)
-            state["posttest"] = generator.parse_json_content(content)
-            state["system_message"] = f"Updated posttest questions based on your feedback. Review again."
-        elif current_step == "theory":
-            prompt = f"{SystemPrompts.THEORY_PROMPT.format(topic=sandbox_topic)}\n\nUser feedback: {feedback}\n\nPlease update the theory content based on this feedback."
-            state["theory"] = generator.generate_content(prompt)
-            state["system_message"] = "Updated theory content based on your feedback. Review again."
-        elif current_step == "procedure":
-            prompt = f"{SystemPrompts.PROCEDURE_PROMPT.format(topic=sandbox_topic)}\n\nUser feedback: {feedback}\n\nPlease update the procedure based on this feedback."
-            state["procedure"] = generator.generate_content(prompt)
-            state["system_message"] = "Updated procedure based on your feedback. Review again."
-        elif current_step == "references":
-            prompt = f"{SystemPrompts.REFERENCES_PROMPT.format(topic=sandbox_topic)}\n\nUser feedback: {feedback}\n\nPlease update the references based on this feedback."
-            state["references"] = generator.generate_content(prompt)
-            state["system_message"] = "Updated references based on your feedback. Review again."
-        return state
-    
-    if action in ["save", "skip"]:
-        if current_step == "sandbox_name":
-            prompt = SystemPrompts.SANDBOX_NAME_PROMPT.format(topic=sandbox_topic)
-            name = generator.generate_content(prompt).strip()
-            name = name.lower().replace(" ", "-")
-            name = ''.join(c for c in name if c.isalnum() or c in ['-', '_'])
-            name = name[:50]
-            state["sandbox_name"] = name
-            state["current_step"] = "aim"
-            state["system_message"] = f"Generated sandbox name: {name}"
-            state["progress"] = 14.3
-            state["completed_steps"].append("sandbox_name")
-        elif current_step == "aim":
-            prompt = SystemPrompts.AIM_PROMPT.format(topic=sandbox_topic)
-            aim = generator.generate_content(prompt)
-            state["aim"] = aim
-            state["current_step"] = "pretest"
-            state["system_message"] = "Generated aim document. Review and provide feedback."
-            state["progress"] = 28.6
-            state["completed_steps"].append("aim")
-        elif current_step == "pretest":
-            prompt = SystemPrompts.PRETEST_PROMPT.format(topic=sandbox_topic)
-            content = generator.generate_content(prompt)
-            pretest = generator.parse_json_content(content)
-            state["pretest"] = pretest
-            state["current_step"] = "posttest"
-            state["system_message"] = f"Generated {len(pretest)} pretest questions. Review and provide feedback."
-            state["progress"] = 42.9
-            state["completed_steps"].append("pretest")
-        elif current_step == "posttest":
-            prompt = SystemPrompts.POSTTEST_PROMPT.format(topic=sandbox_topic)
-            content = generator.generate_content(prompt)
-            posttest = generator.parse_json_content(content)
-            state["posttest"] = posttest
-            state["current_step"] = "theory"
-            state["system_message"] = f"Generated {len(posttest)} posttest questions. Review and provide feedback."
-            state["progress"] = 57.1
-            state["completed_steps"].append("posttest")
-        elif current_step == "theory":
-            prompt = SystemPrompts.THEORY_PROMPT.format(topic=sandbox_topic)
-            theory = generator.generate_content(prompt)
-            state["theory"] = theory
-            state["current_step"] = "procedure"
-            state["system_message"] = "Generated theory content. Review and provide feedback."
-            state["progress"] = 71.4
-            state["completed_steps"].append("theory")
-        elif current_step == "procedure":
-            prompt = SystemPrompts.PROCEDURE_PROMPT.format(topic=sandbox_topic)
-            procedure = generator.generate_content(prompt)
-            state["procedure"] = procedure
-            state["current_step"] = "references"
-            state["system_message"] = "Generated procedure steps. Review and provide feedback."
-            state["progress"] = 85.7
-            state["completed_steps"].append("procedure")
-        elif current_step == "references":
-            prompt = SystemPrompts.REFERENCES_PROMPT.format(topic=sandbox_topic)
-            references = generator.generate_content(prompt)
-            state["references"] = references
-            state["current_step"] = "complete"
-            state["system_message"] = "Generated references. Review and provide feedback."
-            state["progress"] = 100.0
-            state["completed_steps"].append("references")
-    return state 
\ No newline at end of file
+# Poll the background job: rerun until it finishes so its result is picked up.
+if job_running:
+    time.sleep(1.0)
+    st.rerun()
@@ -0,0 +1,57 @@
+"""
+Deferred module imports.
+
+Heavy dependencies (provider SDKs, numpy, PyPDF2, langgraph) cost hundreds of
+milliseconds to import. Entry points bind them through ``lazy_import`` so the
+real import only happens on first attribute access.
+"""
+
+import importlib
+import importlib.util
+import sys
+import threading
+from types import ModuleType
+
+_lock = threading.Lock()
+
+
+class _MissingModule(ModuleType):
+    """Placeholder for an optional dependency that is not installed."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_missing_name"] = name
+
+    def __getattr__(self, attr):
+        raise ImportError(
+            f"'{self._missing_name}' is required for this feature but is not installed"
+        )
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Return a module object that is only executed on first attribute access."""
+    with _lock:
+        if name in sys.modules:
+            return sys.modules[name]
+        try:
+            spec = importlib.util.find_spec(name)
+        except ModuleNotFoundError:
+            spec = None
+        if spec is None or spec.loader is None:
+            return _MissingModule(name)
+        loader = importlib.util.LazyLoader(spec.loader)
+        spec.loader = loader
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        loader.exec_module(module)
+        return module
+
+
+def is_available(name: str) -> bool:
+    """Check whether an optional dependency can be imported, without importing it."""
+    if name in sys.modules:
+        return True
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
@@ -1,49 +1,26 @@
 import json
 from experiment_generator import ExperimentGenerator
-import os
+from sandbox_writer import check_sandbox_name, write_sandbox
 
 def save_content(content: dict, experiment_name: str):
     """Save generated content to files."""
+    experiment_name = check_sandbox_name(experiment_name)
     print(f"\n=== Saving Content to Files ===")
     print(f"Creating directory: {experiment_name}")
     
-    # Create directory for the experiment
-    os.makedirs(experiment_name, exist_ok=True)
-    
-    # Save aim.md
-    print("Saving aim.md...")
-    with open(f"{experiment_name}/aim.md", "w") as f:
-        f.write(content["aim"])
-    
-    # Save experiment name
-    print("Saving experiment-name.md...")
-    with open(f"{experiment_name}/experiment-name.md", "w") as f:
-        f.write(content["experiment_name"])
-    
-    # Save pretest.json
-    print("Saving pretest.json...")
-    with open(f"{experiment_name}/pretest.json", "w") as f:
-        json.dump({"questions": content["pretest"]}, f, indent=4)
-    
-    # Save posttest.json
-    print("Saving posttest.json...")
-    with open(f"{experiment_name}/posttest.json", "w") as f:
-        json.dump({"questions": content["posttest"]}, f, indent=4)
-    
-    # Save theory.md
-    print("Saving theory.md...")
-    with open(f"{experiment_name}/theory.md", "w") as f:
-        f.write(content["theory"])
-    
-    # Save procedure.md
-    print("Saving procedure.md...")
-    with open(f"{experiment_name}/procedure.md", "w") as f:
-        f.write(content["procedure"])
-    
-    # Save reference.md
-    print("Saving reference.md...")
-    with open(f"{experiment_name}/reference.md", "w") as f:
-        f.write(content["references"])
+    files = {
+        "aim.md": content["aim"],
+        "experiment-name.md": content["experiment_name"],
+        "pretest.json": json.dumps({"questions": content["pretest"]}, indent=4),
+        "posttest.json": json.dumps({"questions": content["posttest"]}, indent=4),
+        "theory.md": content["theory"],
+        "procedure.md": content["procedure"],
+        "reference.md": content["references"],
+    }
+    # Staged and renamed into place, so a crash never leaves a half-written experiment
+    for filename in files:
+        print(f"Saving {filename}...")
+    write_sandbox(experiment_name, files)
     
     print("\n✓ All files saved successfully!")
 
@@ -0,0 +1,213 @@
+"""
+Selective, cached page extraction for RAG ingestion.
+
+Each PDF can be limited to page ranges and/or chapters named in its outline
+(bookmarks); only the selected pages are extracted. Extracted page text is
+cached in SQLite by (file hash, page), so widening or changing a selection
+only parses pages that were never seen before, and renamed or copied files
+reuse their cache entries.
+
+A selection file maps PDF file names to what to ingest::
+
+    {
+        "physics-textbook.pdf": {"chapters": ["Optics", "Wave Motion"], "doc_type": "textbook"},
+        "lab-manual.pdf": {"pages": "1-12, 40-", "doc_type": "manual"},
+        "*": {"pages": "1-200"}
+    }
+
+Files without an entry (and no ``"*"`` default) are ingested in full. The
+optional ``doc_type`` is stored on the file's chunks for filtering (see
+``rag_filters``).
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_CACHE_PATH = "pdf_page_cache.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    file_hash TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (file_hash, page)
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    file_hash TEXT NOT NULL
+);
+"""
+
+
+def parse_page_ranges(spec: str, page_count: int) -> List[int]:
+    """0-based page indices for a 1-based spec such as ``"1-5, 9, 20-"``."""
+    pages = set()
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        start_text, sep, end_text = part.partition("-")
+        try:
+            start = int(start_text) if start_text else 1
+            end = (int(end_text) if end_text else page_count) if sep else start
+        except ValueError:
+            raise ValueError(f"Invalid page range '{part}' in '{spec}'")
+        if start < 1 or end < start:
+            raise ValueError(f"Invalid page range '{part}' in '{spec}'")
+        pages.update(range(start - 1, min(end, page_count)))
+    return sorted(pages)
+
+
+def outline_chapters(reader) -> List[Tuple[str, int, int]]:
+    """``(title, first_page, end_page)`` for every outline entry, 0-based and end-exclusive.
+
+    A chapter runs until the next entry at the same or a shallower level.
+    """
+    flat: List[Tuple[str, int, int]] = []  # (title, page, depth)
+
+    def walk(items, depth):
+        for item in items:
+            if isinstance(item, list):
+                walk(item, depth + 1)
+                continue
+            try:
+                flat.append((str(item.title).strip(), reader.get_destination_page_number(item), depth))
+            except Exception:
+                continue  # entries pointing outside the document or to named actions
+
+    walk(reader.outline or [], 0)
+    page_count = len(reader.pages)
+    chapters = []
+    for i, (title, page, depth) in enumerate(flat):
+        end = next((p for _, p, d in flat[i + 1:] if d <= depth and p > page), page_count)
+        chapters.append((title, page, max(end, page + 1)))
+    return chapters
+
+
+def select_pages(reader, selection: Optional[Dict[str, Any]]) -> List[int]:
+    """0-based pages chosen by a selection entry (``pages`` and/or ``chapters``); all pages if empty."""
+    page_count = len(reader.pages)
+    if not selection or not (selection.get("pages") or selection.get("chapters")):
+        return list(range(page_count))
+    pages = set()
+    if selection.get("pages"):
+        pages.update(parse_page_ranges(str(selection["pages"]), page_count))
+    wanted = [str(c).strip().lower() for c in selection.get("chapters") or []]
+    if wanted:
+        chapters = outline_chapters(reader)
+        if not chapters:
+            raise ValueError("Chapter selection needs a PDF outline, but this PDF has no bookmarks")
+        matched = set()
+        for title, start, end in chapters:
+            lowered = title.lower()
+            # A chapter is chosen by exact title or by a prefix such as "Chapter 3".
+            hits = [w for w in wanted if lowered == w or lowered.startswith(w)]
+            if hits:
+                matched.update(hits)
+                pages.update(range(start, end))
+        missing = [w for w in wanted if w not in matched]
+        if missing:
+            raise ValueError(f"No outline entry matches: {', '.join(missing)}")
+    return sorted(pages)
+
+
+def load_selection(path: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    if not path:
+        return {}
+    with open(path) as f:
+        selection = json.load(f)
+    if not isinstance(selection, dict):
+        raise ValueError("Selection file must map PDF names to {'pages': ..., 'chapters': [...]}")
+    return selection
+
+
+def selection_for(selections: Dict[str, Dict[str, Any]], filename: str) -> Optional[Dict[str, Any]]:
+    """The entry for ``filename``: exact name first, then glob patterns such as ``"*"``."""
+    if filename in selections:
+        return selections[filename]
+    for pattern in sorted(selections, key=len, reverse=True):
+        if fnmatch.fnmatch(filename, pattern):
+            return selections[pattern]
+    return None
+
+
+class PageCache:
+    """SQLite cache of extracted page text keyed by (file hash, page)."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def file_hash(self, path: str) -> str:
+        """SHA-256 of the file, remembered per (path, size, mtime) so unchanged files are not re-read."""
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime, file_hash FROM files WHERE path = ?", (key,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        file_hash = digest.hexdigest()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO files (path, size, mtime, file_hash) VALUES (?, ?, ?, ?)",
+                               (key, stat.st_size, stat.st_mtime, file_hash))
+        return file_hash
+
+    def get_many(self, file_hash: str, pages: Sequence[int]) -> Dict[int, str]:
+        found: Dict[int, str] = {}
+        with self._lock:
+            for start in range(0, len(pages), 500):  # stay under SQLite's bound-parameter limit
+                batch = list(pages[start:start + 500])
+                rows = self._conn.execute(
+                    f"SELECT page, text FROM pages WHERE file_hash = ? AND page IN ({','.join('?' * len(batch))})",
+                    (file_hash, *batch),
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def put_many(self, file_hash: str, texts: Dict[int, str]):
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO pages (file_hash, page, text) VALUES (?, ?, ?)",
+                                   [(file_hash, page, text) for page, text in texts.items()])
+
+
+def extract_pages(pdf_path: str, selection: Optional[Dict[str, Any]] = None,
+                  cache: Optional[PageCache] = None) -> List[Tuple[int, str]]:
+    """``(page_number, text)`` for the selected pages of one PDF, 1-based, in page order.
+
+    Pages already in ``cache`` are not parsed again.
+    """
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(pdf_path)
+    pages = select_pages(reader, selection)
+    cached: Dict[int, str] = {}
+    file_hash = None
+    if cache is not None:
+        file_hash = cache.file_hash(pdf_path)
+        cached = cache.get_many(file_hash, pages)
+        cache.hits += len(cached)
+    missing = {page: reader.pages[page].extract_text() or "" for page in pages if page not in cached}
+    if cache is not None and missing:
+        cache.misses += len(missing)
+        cache.put_many(file_hash, missing)
+    cached.update(missing)
+    return [(page + 1, cached[page]) for page in pages]
@@ -0,0 +1,203 @@
+"""
+Token-budget-aware prompt assembly.
+
+Prompts are assembled from named parts (instructions, retrieved context,
+conversation history, user feedback). Each part is counted with the
+provider's tokenizer, or a calibrated estimate when no local tokenizer is
+available, and lower-priority parts are trimmed or dropped so the prompt
+plus the section's output allowance fits the model's context window.
+"""
+
+import math
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from lazy_imports import is_available
+
+# Output token allowance per section. Long-form sections get enough room that
+# they are not truncated mid-document; short ones stay cheap. Thinking models
+# (the default gemini-2.5-flash) count their thinking tokens against this cap
+# too, so even the shortest sections leave several hundred tokens for it.
+SECTION_OUTPUT_TOKENS: Dict[str, int] = {
+    "sandbox_name": 1024,
+    "aim": 1536,
+    "pretest": 2048,
+    "posttest": 2048,
+    "theory": 6144,
+    "procedure": 4096,
+    "references": 1536,
+    "chat": 1024,
+    "chat_summary": 1536,
+    "answer": 2048,
+}
+DEFAULT_OUTPUT_TOKENS = 2048
+
+# Context window per model-name prefix; longest matching prefix wins.
+CONTEXT_WINDOWS: Dict[str, int] = {
+    "gemini": 1_048_576,
+    "gemini-1.5-flash": 1_048_576,
+    "gemini-1.5-pro": 2_097_152,
+    "gpt": 8_192,
+    "gpt-4": 8_192,
+    "gpt-4o": 128_000,
+    "gpt-4-turbo": 128_000,
+    "gpt-3.5-turbo": 16_385,
+    "fake": 32_768,
+}
+DEFAULT_CONTEXT_WINDOW = 8_192
+# Output never takes more than this share of the window, so small-window models
+# (gpt-4: 8k) keep room for the input.
+MAX_OUTPUT_SHARE = 0.5
+# Headroom for chat formatting and estimator error.
+SAFETY_MARGIN_TOKENS = 256
+
+# Characters per token measured on English educational prose; used when no
+# local tokenizer is installed. Slightly conservative so estimates run high.
+_CHARS_PER_TOKEN: Dict[str, float] = {"gemini": 3.8, "gpt": 3.8}
+_DEFAULT_CHARS_PER_TOKEN = 3.6
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Part priorities: higher is kept first when the budget is tight.
+PRIORITY_INSTRUCTIONS = 100
+PRIORITY_FEEDBACK = 80
+PRIORITY_CONTEXT = 60
+PRIORITY_HISTORY = 40
+
+
+def _longest_prefix(table: Dict[str, object], model_name: str):
+    for prefix in sorted(table, key=len, reverse=True):
+        if model_name.startswith(prefix):
+            return table[prefix]
+    return None
+
+
+def context_window(model_name: str) -> int:
+    return _longest_prefix(CONTEXT_WINDOWS, model_name) or DEFAULT_CONTEXT_WINDOW
+
+
+def output_tokens_for(section: Optional[str], model_name: str = "") -> int:
+    """Output allowance for ``section``, capped at ``MAX_OUTPUT_SHARE`` of the window of ``model_name``."""
+    allowance = SECTION_OUTPUT_TOKENS.get(section or "", DEFAULT_OUTPUT_TOKENS)
+    return min(allowance, int(context_window(model_name) * MAX_OUTPUT_SHARE)) if model_name else allowance
+
+
+@lru_cache(maxsize=8)
+def _tiktoken_encoding(model_name: str):
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model_name: str = "") -> int:
+    """Token count of ``text`` for ``model_name``.
+
+    Uses tiktoken for OpenAI models when it is installed; otherwise an
+    estimate from character and word counts, whichever is larger.
+    """
+    if not text:
+        return 0
+    if model_name.startswith("gpt") and is_available("tiktoken"):
+        return len(_tiktoken_encoding(model_name).encode(text))
+    chars_per_token = _longest_prefix(_CHARS_PER_TOKEN, model_name) or _DEFAULT_CHARS_PER_TOKEN
+    by_chars = len(text) / chars_per_token
+    by_words = len(_WORD_PATTERN.findall(text)) * 1.1
+    return int(math.ceil(max(by_chars, by_words)))
+
+
+class PromptPart:
+    """One named piece of a prompt."""
+
+    def __init__(self, name: str, text: str, priority: int, label: str = "",
+                 keep: str = "head", required: bool = False):
+        self.name = name
+        self.text = text.strip()
+        self.priority = priority
+        self.label = label
+        self.keep = keep  # which end survives truncation: "head" or "tail"
+        self.required = required
+
+    def render(self, text: Optional[str] = None) -> str:
+        body = self.text if text is None else text
+        return f"{self.label}:\n{body}" if self.label else body
+
+
+class AssembledPrompt:
+    """Result of ``assemble_prompt``."""
+
+    def __init__(self, text: str, input_tokens: int, max_output_tokens: int,
+                 allocations: Dict[str, int], truncated: List[str], dropped: List[str]):
+        self.text = text
+        self.input_tokens = input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.allocations = allocations
+        self.truncated = truncated
+        self.dropped = dropped
+
+
+def _truncate_to_tokens(text: str, max_tokens: int, model_name: str, keep: str) -> str:
+    """Cut ``text`` at a line or word boundary so it fits ``max_tokens``."""
+    if count_tokens(text, model_name) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    # Binary search on character length, then snap to whitespace.
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        piece = text[:mid] if keep == "head" else text[-mid:]
+        if count_tokens(piece, model_name) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    piece = text[:lo] if keep == "head" else text[len(text) - lo:]
+    if keep == "head":
+        cut = max(piece.rfind("\n"), piece.rfind(" "))
+        piece = (piece[:cut] if cut > len(piece) // 2 else piece).rstrip() + " …"
+    else:
+        cut = min(i for i in (piece.find("\n"), piece.find(" "), len(piece)) if i >= 0)
+        piece = "… " + (piece[cut:] if cut < len(piece) // 2 else piece).lstrip()
+    return piece
+
+
+def assemble_prompt(parts: List[PromptPart], model_name: str, section: Optional[str] = None,
+                    max_output_tokens: Optional[int] = None, reserved_tokens: int = 0) -> AssembledPrompt:
+    """Join ``parts`` into a prompt that fits the model's window with room for the output.
+
+    Parts are kept in their given order. Budget is handed out by priority;
+    a part that does not fit is truncated (keeping its ``keep`` end) or, if
+    less than a few dozen tokens would remain, dropped. Required parts are
+    never cut. The output allowance is capped at ``MAX_OUTPUT_SHARE`` of the
+    window. ``reserved_tokens`` is taken off the budget for input sent
+    separately, such as a cached prefix.
+    """
+    output_tokens = min(max_output_tokens or output_tokens_for(section),
+                        int(context_window(model_name) * MAX_OUTPUT_SHARE))
+    budget = context_window(model_name) - output_tokens - SAFETY_MARGIN_TOKENS - reserved_tokens
+    separator_tokens = 2
+
+    parts = [p for p in parts if p.text]
+    costs = {p.name: count_tokens(p.render(), model_name) + separator_tokens for p in parts}
+    allocations: Dict[str, int] = {}
+    remaining = budget
+    for part in sorted(parts, key=lambda p: (not p.required, -p.priority)):
+        grant = costs[part.name] if part.required else min(costs[part.name], max(0, remaining))
+        allocations[part.name] = grant
+        remaining -= grant
+
+    rendered, truncated, dropped = [], [], []
+    for part in parts:
+        grant = allocations[part.name]
+        if grant >= costs[part.name]:
+            rendered.append(part.render())
+            continue
+        label_tokens = count_tokens(part.label, model_name) + separator_tokens + 1
+        if grant - label_tokens < 32:
+            dropped.append(part.name)
+            continue
+        rendered.append(part.render(_truncate_to_tokens(part.text, grant - label_tokens, model_name, part.keep)))
+        truncated.append(part.name)
+
+    text = "\n\n".join(rendered)
+    return AssembledPrompt(text, count_tokens(text, model_name), output_tokens, allocations, truncated, dropped)
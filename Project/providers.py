@@ -0,0 +1,332 @@
+"""
+Model provider registry.
+
+Each provider wraps one LLM SDK. SDKs are imported when a provider is first
+constructed rather than when this module is imported, so entry points that
+never talk to a given vendor never pay for its import.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_REGISTRY: Dict[str, Type["ModelProvider"]] = {}
+_configure_lock = threading.Lock()
+_configured_keys: Dict[str, str] = {}
+
+
+def register_provider(prefix: str) -> Callable[[Type["ModelProvider"]], Type["ModelProvider"]]:
+    """Class decorator registering a provider for model names starting with ``prefix``."""
+    def decorator(cls: Type["ModelProvider"]) -> Type["ModelProvider"]:
+        _REGISTRY[prefix] = cls
+        return cls
+    return decorator
+
+
+def supported_prefixes() -> List[str]:
+    """Model name prefixes that have a registered provider."""
+    return sorted(_REGISTRY)
+
+
+def create_provider(model_name: str) -> "ModelProvider":
+    """Instantiate the provider responsible for ``model_name``."""
+    # Longest prefix wins so e.g. "gpt-4o" could be registered separately from "gpt".
+    for prefix in sorted(_REGISTRY, key=len, reverse=True):
+        if model_name.startswith(prefix):
+            return _REGISTRY[prefix](model_name)
+    raise ValueError(f"Unsupported model: {model_name}")
+
+
+def _require_env(name: str) -> str:
+    value = os.getenv(name)
+    if not value:
+        raise ValueError(f"{name} not found in environment variables")
+    return value
+
+
+# Normalised finish reasons.
+FINISH_STOP = "stop"
+FINISH_LENGTH = "length"  # output limit reached; the text is cut off
+FINISH_OTHER = "other"    # safety block, recitation, ...
+
+
+class Completion:
+    """Generated text plus why the model stopped and, when reported, input token usage."""
+
+    def __init__(self, text: str, finish_reason: str = FINISH_STOP, input_tokens: int = 0,
+                 cached_tokens: int = 0):
+        self.text = text
+        self.finish_reason = finish_reason
+        self.input_tokens = input_tokens
+        self.cached_tokens = cached_tokens  # part of input_tokens served from a prompt cache
+
+    @property
+    def truncated(self) -> bool:
+        return self.finish_reason == FINISH_LENGTH
+
+
+class CachedContext:
+    """A prompt prefix registered for reuse across calls.
+
+    ``handle`` is the provider's server-side cache object. It is None when the
+    provider has no explicit cache (or the prefix is too short for one). In
+    that case the prefix is sent in front of every prompt, which still lets
+    providers with automatic prefix caching reuse it.
+    """
+
+    def __init__(self, prefix: str, handle: Any = None, ttl_seconds: float = 3600.0):
+        self.prefix = prefix
+        self.handle = handle
+        self.key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        self.expires_at = time.time() + ttl_seconds
+
+    @property
+    def server_side(self) -> bool:
+        return self.handle is not None
+
+    def expired(self, margin_seconds: float = 60.0) -> bool:
+        return time.time() > self.expires_at - margin_seconds
+
+
+class ModelProvider:
+    """Base class for a text generation backend.
+
+    Subclasses implement ``complete``; ``generate`` returns just the text.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    def complete(self, prompt: str, max_output_tokens: Optional[int] = None,
+                 context: Optional[CachedContext] = None) -> Completion:
+        """Generate a completion for ``prompt``, capped at ``max_output_tokens`` when given.
+
+        ``context`` is a prefix from ``create_context`` that logically precedes the prompt.
+        """
+        raise NotImplementedError
+
+    def generate(self, prompt: str, max_output_tokens: Optional[int] = None,
+                 context: Optional[CachedContext] = None) -> str:
+        return self.complete(prompt, max_output_tokens=max_output_tokens, context=context).text
+
+    def create_context(self, prefix: str, ttl_seconds: float = 3600.0) -> CachedContext:
+        """Register ``prefix`` for reuse. The default keeps it client-side."""
+        return CachedContext(prefix, ttl_seconds=ttl_seconds)
+
+    def delete_context(self, context: CachedContext):
+        """Release a server-side cache early; it otherwise expires with its TTL."""
+
+    @staticmethod
+    def _full_prompt(prompt: str, context: Optional[CachedContext]) -> str:
+        """The prompt as sent when ``context`` is not held server-side."""
+        if context is None or context.server_side:
+            return prompt
+        return f"{context.prefix}\n\n{prompt}"
+
+    def embed(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        """Embed ``texts``; providers without an embedding endpoint raise."""
+        raise NotImplementedError(f"{type(self).__name__} does not support embeddings")
+
+
+@register_provider("gemini")
+class GeminiProvider(ModelProvider):
+    """Google Gemini via ``google.generativeai``."""
+
+    # Roughly 4096 tokens, below which the API rejects explicit caches. The
+    # per-sandbox prefix (topic and aim) is far shorter, so sandbox generation
+    # resends it; only prefixes carrying long shared material are cached.
+    min_cached_chars = 16_000
+    embed_batch_size = 100
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        api_key = _require_env("GOOGLE_API_KEY")
+        import google.generativeai as genai
+
+        # genai.configure mutates process-wide client state; only redo it when the key changes.
+        with _configure_lock:
+            if _configured_keys.get("gemini") != api_key:
+                genai.configure(api_key=api_key)
+                _configured_keys["gemini"] = api_key
+        self.genai = genai
+        self.model = genai.GenerativeModel(model_name)
+        self._cached_models: Dict[str, Tuple[CachedContext, Any]] = {}
+
+    def create_context(self, prefix: str, ttl_seconds: float = 3600.0) -> CachedContext:
+        # Explicit caching needs a recent SDK and a prefix above the API's minimum size;
+        # otherwise fall back to resending the prefix.
+        # Callers stop using a context once it expires (without always deleting it); drop those models.
+        for key, (stale, _) in list(self._cached_models.items()):
+            if stale.expired(margin_seconds=0):
+                self._cached_models.pop(key, None)
+        caching = getattr(self.genai, "caching", None)
+        if caching is None or len(prefix) < self.min_cached_chars:
+            return CachedContext(prefix, ttl_seconds=ttl_seconds)
+        try:
+            handle = caching.CachedContent.create(
+                model=f"models/{self.model_name}",
+                contents=[prefix],
+                ttl=datetime.timedelta(seconds=ttl_seconds),
+            )
+        except Exception:
+            return CachedContext(prefix, ttl_seconds=ttl_seconds)
+        context = CachedContext(prefix, handle=handle, ttl_seconds=ttl_seconds)
+        self._cached_models[context.key] = (context, self.genai.GenerativeModel.from_cached_content(cached_content=handle))
+        return context
+
+    def delete_context(self, context: CachedContext):
+        self._cached_models.pop(context.key, None)
+        if context.server_side:
+            try:
+                context.handle.delete()
+            except Exception:
+                pass  # already expired
+
+    def complete(self, prompt: str, max_output_tokens: Optional[int] = None,
+                 context: Optional[CachedContext] = None) -> Completion:
+        generation_config = {"max_output_tokens": max_output_tokens} if max_output_tokens else None
+        model = self.model
+        if context is not None and context.server_side:
+            model = self._cached_models.get(context.key, (context, self.model))[1]
+        response = model.generate_content(self._full_prompt(prompt, context), generation_config=generation_config)
+        usage = getattr(response, "usage_metadata", None)
+        input_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+        candidate = response.candidates[0] if response.candidates else None
+        reason = getattr(getattr(candidate, "finish_reason", None), "name", "STOP")
+        try:
+            text = response.text
+        except ValueError:
+            # No text parts, e.g. the limit was hit before any output or the reply was blocked.
+            text = ""
+        if reason == "MAX_TOKENS":
+            finish = FINISH_LENGTH
+        else:
+            finish = FINISH_STOP if reason in ("STOP", "FINISH_REASON_UNSPECIFIED") else FINISH_OTHER
+        if not text and finish != FINISH_LENGTH:
+            # Blocked prompt, no candidates, or a safety/recitation stop: report it rather than
+            # returning "" as if the model had answered.
+            block = getattr(getattr(response, "prompt_feedback", None), "block_reason", None)
+            detail = f"prompt blocked ({getattr(block, 'name', block)})" if block else f"finish reason {reason}"
+            raise ValueError(f"Gemini returned no text: {detail}")
+        return Completion(text, finish, input_tokens, cached_tokens)
+
+    def embed(self, texts: List[str], task_type: str = "retrieval_query",
+              model: str = "models/embedding-001") -> List[List[float]]:
+        # embed_content accepts a list of texts and embeds them in one request (up to 100 each).
+        embeddings = []
+        for start in range(0, len(texts), self.embed_batch_size):
+            batch = list(texts[start:start + self.embed_batch_size])
+            response = self.genai.embed_content(model=model, content=batch, task_type=task_type)
+            embeddings.extend(response["embedding"])
+        return embeddings
+
+
+@register_provider("gpt")
+class OpenAIProvider(ModelProvider):
+    """OpenAI chat completion models."""
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        api_key = _require_env("OPENAI_API_KEY")
+        import openai
+
+        self.client = openai.OpenAI(api_key=api_key)
+
+    # OpenAI caches repeated prompt prefixes automatically, so contexts stay
+    # client-side and are sent first, right after the fixed system message.
+    def complete(self, prompt: str, max_output_tokens: Optional[int] = None,
+                 context: Optional[CachedContext] = None) -> Completion:
+        response = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=[
+                {"role": "system", "content": "You are an expert educational content generator."},
+                {"role": "user", "content": self._full_prompt(prompt, context)}
+            ],
+            max_tokens=max_output_tokens or 2000,
+            temperature=0.7
+        )
+        choice = response.choices[0]
+        reason = {"stop": FINISH_STOP, "length": FINISH_LENGTH}.get(choice.finish_reason, FINISH_OTHER)
+        usage = getattr(response, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        return Completion(choice.message.content or "", reason,
+                          getattr(usage, "prompt_tokens", 0) or 0, getattr(details, "cached_tokens", 0) or 0)
+
+
+@register_provider("fake")
+class FakeProvider(ModelProvider):
+    """Offline provider returning deterministic canned output, for tests and benchmarks.
+
+    Quiz prompts (those asking for a JSON array) get a small valid question
+    list; every other prompt gets a prompt-specific tag followed by its first line.
+    Output longer than ~4 characters per allowed token is cut and reported as
+    truncated, like a real model hitting its limit. Contexts are held
+    "server-side" in memory, emulating explicit prompt caching; input usage is
+    reported at ~4 characters per token.
+    """
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        self.calls = 0
+        self.contexts: Dict[str, CachedContext] = {}
+
+    def create_context(self, prefix: str, ttl_seconds: float = 3600.0) -> CachedContext:
+        for handle, stale in list(self.contexts.items()):
+            if stale.expired(margin_seconds=0):  # expired server-side, as with a real cache
+                self.contexts.pop(handle, None)
+        handle = uuid.uuid4().hex
+        self.contexts[handle] = CachedContext(prefix, handle=handle, ttl_seconds=ttl_seconds)
+        return self.contexts[handle]
+
+    def delete_context(self, context: CachedContext):
+        self.contexts.pop(context.handle, None)
+
+    def complete(self, prompt: str, max_output_tokens: Optional[int] = None,
+                 context: Optional[CachedContext] = None) -> Completion:
+        cached = ""
+        if context is not None and context.server_side:
+            if context.handle not in self.contexts:
+                raise ValueError(f"Unknown or expired cached context: {context.handle}")
+            cached = self.contexts[context.handle].prefix
+        full_prompt = f"{cached}\n\n{prompt}" if cached else self._full_prompt(prompt, context)
+        # Reply to the section prompt itself, so output does not depend on how the prefix was sent.
+        text = self._reply(prompt)
+        usage = {"input_tokens": len(full_prompt) // 4, "cached_tokens": len(cached) // 4}
+        if max_output_tokens and len(text) > max_output_tokens * 4:
+            return Completion(text[:max_output_tokens * 4], FINISH_LENGTH, **usage)
+        return Completion(text, FINISH_STOP, **usage)
+
+    def _reply(self, prompt: str) -> str:
+        self.calls += 1
+        first_line = prompt.strip().splitlines()[0] if prompt.strip() else ""
+        if "JSON array" in prompt:
+            questions = [
+                {
+                    "question": f"Sample question {i + 1}: {first_line[:60]}",
+                    "options": ["A", "B", "C", "D"],
+                    "correctAnswer": "A",
+                    "explanation": "Canned answer from the fake provider.",
+                }
+                for i in range(5)
+            ]
+            return json.dumps(questions, indent=2)
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        return f"fake-{digest} {first_line}\n"
+
+    def embed(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        # Deterministic 64-dimensional vectors derived from a hash of each text.
+        embeddings = []
+        for text in texts:
+            digest = hashlib.sha256(f"{task_type}:{text}".encode("utf-8")).digest() * 2
+            embeddings.append([(b - 127.5) / 127.5 for b in digest])
+        return embeddings
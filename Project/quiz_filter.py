@@ -0,0 +1,96 @@
+"""
+Near-duplicate detection for quiz questions.
+
+All questions are embedded at once, either with one batched provider call or
+with local hashed n-gram vectors when the provider has no embedding
+endpoint, and compared through a single similarity matrix. Only the
+offending items are reported, so callers can regenerate just those.
+"""
+
+import re
+import zlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from lazy_imports import lazy_import
+from providers import ModelProvider
+
+np = lazy_import("numpy")
+
+# Cosine similarity at or above which two questions count as duplicates.
+# Hashed n-gram vectors score paraphrases lower than semantic embeddings do.
+EMBEDDING_THRESHOLD = 0.92
+HASHING_THRESHOLD = 0.8
+HASHING_DIM = 2048
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def question_text(item: Dict[str, Any]) -> str:
+    """The text a question is compared on: the question plus its correct option."""
+    question = str(item.get("question", ""))
+    options = item.get("options") or []
+    answer = str(item.get("correctAnswer", ""))
+    # correctAnswer is either an option letter or the option text itself.
+    if len(answer) == 1 and answer.upper() in "ABCDEFGH":
+        index = ord(answer.upper()) - ord("A")
+        if index < len(options):
+            answer = str(options[index])
+    return f"{question} {answer}".strip()
+
+
+def hashing_vectors(texts: Sequence[str], dim: int = HASHING_DIM) -> "np.ndarray":
+    """L2-normalised hashed unigram+bigram counts with sublinear term frequency."""
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+        grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for gram in grams:
+            matrix[row, zlib.crc32(gram.encode("utf-8")) % dim] += 1.0
+    np.log1p(matrix, out=matrix)
+    return _normalise(matrix)
+
+
+def _normalise(matrix: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def embed_questions(texts: Sequence[str], provider: Optional[ModelProvider] = None) -> Tuple["np.ndarray", float]:
+    """Unit vectors for ``texts`` and the duplicate threshold that suits them.
+
+    Uses one batched ``provider.embed`` call when possible, else hashed n-grams.
+    """
+    if provider is not None and texts:
+        try:
+            vectors = np.asarray(provider.embed(list(texts), task_type="semantic_similarity"), dtype=np.float32)
+            return _normalise(vectors), EMBEDDING_THRESHOLD
+        except Exception:
+            pass  # no embedding endpoint, quota, network: fall back to local vectors
+    return hashing_vectors(texts), HASHING_THRESHOLD
+
+
+def find_duplicates(vectors: "np.ndarray", threshold: float, fixed: int = 0) -> List[int]:
+    """Indices (among rows ``fixed`` onwards) that duplicate an earlier row.
+
+    The first ``fixed`` rows are reference questions that are never reported,
+    e.g. an already-approved pretest when checking a posttest. Of each
+    duplicate pair the later row is reported, so the earliest copy survives.
+    """
+    n = len(vectors)
+    if n < 2:
+        return []
+    sims = vectors @ vectors.T
+    # Only compare each row with rows before it.
+    sims[np.triu_indices(n)] = -1.0
+    duplicated = (sims >= threshold).any(axis=1)
+    duplicated[:fixed] = False
+    return [int(i) - fixed for i in np.flatnonzero(duplicated)]
+
+
+def near_duplicate_questions(questions: List[Dict[str, Any]], reference: Sequence[Dict[str, Any]] = (),
+                             provider: Optional[ModelProvider] = None) -> List[int]:
+    """Indices of ``questions`` that repeat another question or one in ``reference``."""
+    texts = [question_text(q) for q in reference] + [question_text(q) for q in questions]
+    vectors, threshold = embed_questions(texts, provider)
+    return find_duplicates(vectors, threshold, fixed=len(reference))
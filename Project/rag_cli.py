@@ -1,50 +1,74 @@
+from __future__ import annotations
+
+import argparse
 import os
 import glob
-import google.generativeai as genai
-from dotenv import load_dotenv
-from typing import List, Tuple
-from PyPDF2 import PdfReader
-import numpy as np
-
-# Load environment and configure Gemini
-load_dotenv()
-api_key = os.getenv("GOOGLE_API_KEY")
-if not api_key:
-    raise ValueError("GOOGLE_API_KEY not found in environment variables")
-genai.configure(api_key=api_key)
-
-# Use Gemini for embedding and generation
-gemini_model = genai.GenerativeModel('gemini-2.5-flash-preview-05-20')
-embed_model = genai.embed_content
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from lazy_imports import lazy_import
+from prompt_budget import PromptPart, assemble_prompt, PRIORITY_INSTRUCTIONS, PRIORITY_CONTEXT
+from answer_cache import ANSWER_CACHE_FILE, DEFAULT_SEMANTIC_THRESHOLD, AnswerCache, answer_scope
+from embedding_cache import DEFAULT_CACHE_DIR as DEFAULT_EMBEDDING_CACHE_DIR, EmbeddingCache
+from chunk_dedup import DEDUP_THRESHOLD
+from chunker import CHUNK_FORMAT, DEFAULT_TARGET_TOKENS, Page, chunk_pages, window_chunks
+from pdf_ingest import DEFAULT_CACHE_PATH, PageCache, extract_pages, load_selection, selection_for
+from providers import GeminiProvider
+from rag_context import DEFAULT_CONTEXT_TOKENS, DEFAULT_DIVERSITY, fetch_depth, select_context
+from rag_filters import FILTER_FIELDS, parse_filter_args
+from rag_index import EMBEDDING_STORAGE, SEARCH_MODES
+from rag_segments import SegmentedIndex
+
+np = lazy_import("numpy")
+
+# Use Gemini for embedding and generation. The SDK is configured on first use,
+# not at import time.
+GEMINI_MODEL_NAME = 'gemini-2.5-flash-preview-05-20'
+EMBEDDING_MODEL_NAME = 'models/embedding-001'
+DOCUMENTS_DIR = "doucuments"
+INDEX_DIR = "rag_index"
+# Shared by every corpus and project on the machine; None sends every text to the API.
+embedding_cache_dir: Optional[str] = DEFAULT_EMBEDDING_CACHE_DIR
+
+
+@lru_cache(maxsize=1)
+def get_gemini() -> GeminiProvider:
+    """Shared Gemini provider, created on first use."""
+    return GeminiProvider(GEMINI_MODEL_NAME)
 
 # --- PDF Loading and Chunking ---
-def load_and_chunk_pdfs(folder: str, chunk_size: int = 500, overlap: int = 100) -> List[Tuple[str, str]]:
-    """Load all PDFs in folder, return list of (chunk_text, source_name)."""
-    pdf_files = glob.glob(os.path.join(folder, '*.pdf'))
-    chunks = []
-    for pdf_path in pdf_files:
-        reader = PdfReader(pdf_path)
-        all_text = "\n".join(page.extract_text() or '' for page in reader.pages)
-        # Simple sliding window chunking
-        words = all_text.split()
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = " ".join(words[i:i+chunk_size])
-            if chunk.strip():
-                chunks.append((chunk, os.path.basename(pdf_path)))
-    return chunks
+def load_pages(folder: str, selections: Optional[Dict[str, Dict[str, Any]]] = None,
+               cache: Optional[PageCache] = None, names: Optional[List[str]] = None) -> Iterator[Page]:
+    """(source_name, page_number, text) for the selected pages of every PDF in folder (or only ``names``).
+
+    ``selections`` limits each file to page ranges or outline chapters (see
+    ``pdf_ingest``); extracted pages are reused from ``cache``.
+    """
+    for pdf_path in sorted(glob.glob(os.path.join(folder, '*.pdf'))):
+        source = os.path.basename(pdf_path)
+        if names is not None and source not in names:
+            continue
+        for page_number, text in extract_pages(pdf_path, selection_for(selections or {}, source), cache):
+            yield source, page_number, text
+
+def load_and_chunk_pdfs(folder: str, chunk_size: int = 500, overlap: int = 100,
+                        selections: Optional[Dict[str, Dict[str, Any]]] = None,
+                        cache: Optional[PageCache] = None) -> List[Tuple[str, str]]:
+    """Legacy fixed word-window chunking; returns list of (chunk_text, source_name)."""
+    return [(c["text"], c["source"]) for c in window_chunks(load_pages(folder, selections, cache), chunk_size, overlap)]
 
 # --- Embedding ---
-def embed_texts(texts: List[str]) -> List[np.ndarray]:
-    """Embed a list of texts using Gemini."""
-    embeddings = []
-    for text in texts:
-        response = embed_model(
-            model="models/embedding-001",
-            content=text,
-            task_type="retrieval_query"
-        )
-        embeddings.append(np.array(response["embedding"]))
-    return embeddings
+@lru_cache(maxsize=None)
+def get_embedding_cache(directory: str) -> EmbeddingCache:
+    return EmbeddingCache(directory)
+
+def embed_texts(texts: List[str], task_type: str = "retrieval_query") -> np.ndarray:
+    """Embed a list of texts using Gemini, one row per text; texts embedded before come from the cache."""
+    if embedding_cache_dir is None:
+        return _embed_with_gemini(texts, task_type)
+    return get_embedding_cache(embedding_cache_dir).embed(texts, task_type, EMBEDDING_MODEL_NAME, _embed_with_gemini)
+
+def _embed_with_gemini(texts: List[str], task_type: str) -> np.ndarray:
+    return np.asarray(get_gemini().embed(texts, task_type=task_type, model=EMBEDDING_MODEL_NAME), dtype=np.float32)
 
 """questions should be embedded in retrival query 
 anytime a quesiton is asked, it should genrate in retrival query, find the nearest chunks, and use them to generate ananswer
@@ -52,40 +76,240 @@ sent the top k doucments and come back.
 generate using LLMs.
 Chunk embedding are in similarty search
 """
+# --- Index ---
+def document_fingerprints(folder: str, selections: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, List]:
+    """name -> [size, mtime, page selection] of each PDF; a document is re-indexed when this changes."""
+    return {
+        os.path.basename(p): [os.path.getsize(p), int(os.path.getmtime(p)), selection_for(selections or {}, os.path.basename(p))]
+        for p in sorted(glob.glob(os.path.join(folder, '*.pdf')))
+    }
+
+def load_or_build_index(folder: str = DOCUMENTS_DIR, index_dir: str = INDEX_DIR, rebuild: bool = False,
+                        selections: Optional[Dict[str, Dict[str, Any]]] = None,
+                        page_cache: str = DEFAULT_CACHE_PATH, chunk_tokens: int = DEFAULT_TARGET_TOKENS,
+                        storage: str = "float32",
+                        dedup_threshold: float = DEDUP_THRESHOLD) -> Tuple[SegmentedIndex, Dict[str, int]]:
+    """The saved index, brought up to date with ``folder``, and counts of what changed.
+
+    Only PDFs added or changed (content or page selection) since the last run
+    are chunked and embedded, into a new segment; removed ones are tombstoned
+    (see ``rag_segments``). Near-duplicate chunks, e.g. from two editions of
+    a textbook, are embedded once and cite every PDF they appear in (see
+    ``chunk_dedup``; ``dedup_threshold`` 0 keeps them all). A different
+    embedding model, chunk size or threshold starts the index afresh; a
+    different ``storage`` only re-quantizes it.
+    """
+    settings = {"embedding_model": EMBEDDING_MODEL_NAME, "chunk_tokens": chunk_tokens, "chunk_format": CHUNK_FORMAT,
+                "dedup_threshold": dedup_threshold}
+    index = SegmentedIndex.open(index_dir, settings, storage=storage, reset=rebuild)
+
+    def chunk_documents(names: List[str]) -> List[Dict[str, Any]]:
+        """Chunks follow headings, paragraphs and pages and carry page/heading/chapter metadata (see
+        ``chunker``), plus the ``doc_type`` given for their PDF in the selection file."""
+        cache = PageCache(page_cache)
+        try:
+            chunks = chunk_pages(load_pages(folder, selections, cache, names), target_tokens=chunk_tokens,
+                                 max_tokens=max(chunk_tokens, int(chunk_tokens * 1.5)))
+        finally:
+            cache.close()
+        for chunk in chunks:
+            chunk["doc_type"] = (selection_for(selections or {}, chunk["source"]) or {}).get("doc_type")
+        return chunks
+
+    stats = index.update(document_fingerprints(folder, selections), chunk_documents, embed_texts)
+    return index, stats
+
 # --- Similarity Search ---
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+def retrieve_chunks(query: str, index: SegmentedIndex, k: int = 4, mode: str = "hybrid",
+                    filters: Optional[Dict[str, Any]] = None, diversity: float = DEFAULT_DIVERSITY,
+                    context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+                    query_vector: Optional[np.ndarray] = None) -> List[Tuple[Dict[str, Any], float]]:
+    """Best ``k`` chunks as (chunk, score); ``hybrid`` fuses dense and BM25 rankings.
+
+    ``filters`` limits the search by source, doc type, chapter or pages (see ``rag_filters``).
+    The ``k`` are picked by MMR from a deeper candidate list and cut to their
+    sentences most relevant to the query, ``context_tokens`` in all (see
+    ``rag_context``); ``diversity`` 0 and ``context_tokens`` 0 turn the two stages off.
+    The query is embedded unless ``query_vector`` is given.
+    """
+    if query_vector is None and mode != "sparse":
+        query_vector = embed_texts([query])[0]
+    snapshot = index.snapshot()  # ids stay valid even if background compaction swaps segments meanwhile
+    hits = snapshot.search(query, query_vector, k=fetch_depth(k, diversity), mode=mode, filters=filters)
+    return select_context(snapshot, query, hits, k, diversity, context_tokens, GEMINI_MODEL_NAME)
+
+def retrieve_top_k(query: str, index: SegmentedIndex, k: int = 4, mode: str = "hybrid",
+                   filters: Optional[Dict[str, Any]] = None, diversity: float = DEFAULT_DIVERSITY,
+                   context_tokens: int = DEFAULT_CONTEXT_TOKENS) -> List[Tuple[str, float]]:
+    """``retrieve_chunks`` as (text with citation, score)."""
+    return [(format_chunk(chunk), score)
+            for chunk, score in retrieve_chunks(query, index, k, mode, filters, diversity, context_tokens)]
+
+def chunk_citation(chunk: Dict[str, Any]) -> str:
+    """Where a chunk comes from, e.g. ``optics.pdf, p. 12, 3.1 Lenses; also optics-3e.pdf, p. 14``."""
+    citation = [chunk["source"]]
+    if chunk.get("page"):
+        pages = chunk["page"] if chunk.get("page_end") in (None, chunk["page"]) else f'{chunk["page"]}-{chunk["page_end"]}'
+        citation.append(f"p. {pages}")
+    if chunk.get("heading"):
+        citation.append(chunk["heading"])
+    text = ", ".join(str(c) for c in citation)
+    references = chunk.get("references") or []
+    if references:  # near-duplicates of this chunk in other places (see chunk_dedup)
+        also = [chunk_citation({field: r.get(field) for field in ("source", "page", "page_end")}) for r in references[:3]]
+        more = f" and {len(references) - 3} more" if len(references) > 3 else ""
+        text += f"; also {'; '.join(also)}{more}"
+    return text
 
-def retrieve_top_k(query: str, chunk_texts: List[str], chunk_embeds: List[np.ndarray], k: int = 4) -> List[Tuple[str, str]]:
-    query_embed = embed_texts([query])[0]
-    sims = [cosine_similarity(query_embed, emb) for emb in chunk_embeds]
-    top_indices = np.argsort(sims)[-k:][::-1]
-    return [(chunk_texts[i], sims[i]) for i in top_indices]
+def format_chunk(chunk: Dict[str, Any]) -> str:
+    """Chunk text prefixed with its citation, e.g. ``[optics.pdf, p. 12, 3.1 Lenses]``."""
+    return f"[{chunk_citation(chunk)}]\n{chunk['text']}"
 
 # --- RAG Answer Generation ---
 def answer_query(query: str, context_chunks: List[str]) -> str:
-    context = "\n\n".join(context_chunks)
-    prompt = f"""You are an expert assistant. Use the following context from reference documents to answer the user's question.\n\nContext:\n{context}\n\nQuestion: {query}\n\nAnswer in detail, citing the context where relevant."""
-    response = gemini_model.generate_content(prompt)
-    return response.text
+    parts = [
+        PromptPart("instructions", "You are an expert assistant. Use the following context from reference documents to answer the user's question.",
+                   PRIORITY_INSTRUCTIONS, required=True),
+        PromptPart("context", "\n\n".join(context_chunks), PRIORITY_CONTEXT, label="Context"),
+        PromptPart("question", f"Question: {query}\n\nAnswer in detail, citing the context where relevant.",
+                   PRIORITY_INSTRUCTIONS, required=True),
+    ]
+    prompt = assemble_prompt(parts, GEMINI_MODEL_NAME, section="answer")
+    return get_gemini().generate(prompt.text, max_output_tokens=prompt.max_output_tokens)
+
+def answer_settings(k: int, mode: str, filters: Optional[Dict[str, Any]], diversity: float,
+                    context_tokens: int) -> str:
+    """``answer_cache`` scope: answers are only reused for the same model and retrieval settings."""
+    return answer_scope(model=GEMINI_MODEL_NAME, k=k, mode=mode, filters=filters, diversity=diversity,
+                        context_tokens=context_tokens)
+
+def cached_answer(query: str, index: SegmentedIndex, cache: Optional[AnswerCache], k: int = 4, mode: str = "hybrid",
+                  filters: Optional[Dict[str, Any]] = None, diversity: float = DEFAULT_DIVERSITY,
+                  context_tokens: int = DEFAULT_CONTEXT_TOKENS, embed: Optional[Callable[[List[str]], Any]] = None,
+                  answer: Optional[Callable[[str, List[str]], str]] = None) -> Tuple[str, str]:
+    """The answer to ``query`` and where it came from: ``"exact"`` or ``"semantic"`` (see
+    ``answer_cache``), or ``"generated"`` by the model, and then cached.
+
+    ``embed`` and ``answer`` default to ``embed_texts`` and ``answer_query``.
+    """
+    embed = embed or embed_texts
+    answer = answer or answer_query
+    scope = answer_settings(k, mode, filters, diversity, context_tokens)
+    generation = index.version()
+    if cache is not None:
+        hit = cache.get(query, scope, generation)
+        if hit is not None:
+            return hit["answer"], "exact"
+    query_vector = embed([query])[0] if mode != "sparse" else None
+    selected = retrieve_chunks(query, index, k, mode, filters, diversity, context_tokens, query_vector)
+    sources = [(chunk_citation(chunk), float(score)) for chunk, score in selected]
+    if cache is not None:
+        hit = cache.get_similar(query, query_vector, scope, generation, sources)
+        if hit is not None:
+            return hit["answer"], "semantic"
+    text = answer(query, [format_chunk(chunk) for chunk, _ in selected])
+    if cache is not None and text:
+        cache.put(query, query_vector, scope, generation, sources, text)
+    return text, "generated"
 
 # --- CLI Loop ---
+def add_index_arguments(parser: argparse.ArgumentParser):
+    """Options choosing and building the index, shared by this CLI and ``rag_server``."""
+    parser.add_argument("--documents", default=DOCUMENTS_DIR, help="Folder of PDFs")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="Where the retrieval index is stored")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index even if it is up to date")
+    parser.add_argument("--selection", default=None,
+                        help="JSON file choosing pages or outline chapters per PDF (see pdf_ingest.py)")
+    parser.add_argument("--chunk-tokens", type=int, default=DEFAULT_TARGET_TOKENS, help="Target tokens per chunk")
+    parser.add_argument("--page-cache", default=DEFAULT_CACHE_PATH, help="SQLite cache of extracted page text")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                        help="Similarity (0-1) at which near-duplicate chunks are indexed once; 0 keeps every chunk")
+    parser.add_argument("--storage", choices=EMBEDDING_STORAGE, default="float32",
+                        help="Precision of the searched embedding matrix; float16/int8 re-score candidates exactly")
+    parser.add_argument("--embedding-cache", default=DEFAULT_EMBEDDING_CACHE_DIR,
+                        help="Directory of the embedding cache shared across corpora (EMBEDDING_CACHE_DIR)")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="Always call the embedding API")
+
+def add_context_arguments(parser: argparse.ArgumentParser):
+    """Options shaping the retrieved context sent to the model, shared with ``rag_server``."""
+    parser.add_argument("--diversity", type=float, default=DEFAULT_DIVERSITY,
+                        help="MMR trade-off between relevance (0) and novelty among the chunks kept")
+    parser.add_argument("--context-tokens", type=int, default=DEFAULT_CONTEXT_TOKENS,
+                        help="Keep only the most query-relevant sentences, up to this many tokens (0: whole chunks)")
+
+def add_answer_cache_arguments(parser: argparse.ArgumentParser):
+    """Options of the answer cache, shared with ``rag_server``."""
+    parser.add_argument("--answer-cache", default=None,
+                        help=f"SQLite cache of answers (default: {ANSWER_CACHE_FILE} in the index directory)")
+    parser.add_argument("--no-answer-cache", action="store_true", help="Always ask the model")
+    parser.add_argument("--semantic-threshold", type=float, default=DEFAULT_SEMANTIC_THRESHOLD,
+                        help="Cosine similarity (0-1) at which a reworded question reuses a cached answer; "
+                             "0 reuses only exact repeats")
+
+def open_answer_cache(args: argparse.Namespace, index: SegmentedIndex) -> Optional[AnswerCache]:
+    """The answer cache ``add_answer_cache_arguments`` options ask for, emptied of answers from
+    earlier versions of the documents."""
+    if args.no_answer_cache:
+        return None
+    cache = AnswerCache(args.answer_cache or os.path.join(args.index_dir, ANSWER_CACHE_FILE), args.semantic_threshold)
+    stale = cache.invalidate(index.version())
+    if stale:
+        print(f"Answer cache: dropped {stale} answers from earlier versions of the documents.")
+    return cache
+
+def open_index(args: argparse.Namespace) -> SegmentedIndex:
+    """Bring the index up to date as ``add_index_arguments`` options say, reporting what changed."""
+    global embedding_cache_dir
+    embedding_cache_dir = None if args.no_embedding_cache else args.embedding_cache
+    print(f"Loading index for '{args.documents}/' (indexing new or changed PDFs)...")
+    index, stats = load_or_build_index(args.documents, args.index_dir, rebuild=args.rebuild,
+                                selections=load_selection(args.selection), page_cache=args.page_cache,
+                                chunk_tokens=args.chunk_tokens, storage=args.storage,
+                                dedup_threshold=args.dedup_threshold)
+    print(f"Added {stats['added']}, changed {stats['changed']}, removed {stats['removed']} PDFs "
+          f"({stats['chunks']} chunks, {stats['duplicates']} near-duplicates merged). Total chunks: {len(index)}.")
+    if embedding_cache_dir is not None:
+        cache_stats = get_embedding_cache(embedding_cache_dir).stats()
+        print(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} embedded.")
+    if index.compaction_candidates():
+        index.compact_in_background()  # merges small segments while questions are answered
+    return index
+
 def main():
+    parser = argparse.ArgumentParser(description="Ask questions about a folder of PDFs.")
+    add_index_arguments(parser)
+    add_context_arguments(parser)
+    add_answer_cache_arguments(parser)
+    parser.add_argument("--mode", choices=SEARCH_MODES, default="hybrid", help="Retrieval mode")
+    parser.add_argument("-k", type=int, default=4, help="Chunks passed to the model")
+    parser.add_argument("--filter", action="append", default=[], metavar="FIELD=VALUE",
+                        help=f"Only search matching chunks; FIELD is one of {', '.join(FILTER_FIELDS)}, "
+                             "e.g. source=physics.pdf or chapter=3-5 (repeatable)")
+    args = parser.parse_args()
+    try:
+        filters = parse_filter_args(args.filter)
+    except ValueError as e:
+        parser.error(str(e))
+
     print("\n=== Gemini RAG CLI ===")
-    print("Loading and chunking PDFs from 'doucuments/'...")
-    chunks_with_src = load_and_chunk_pdfs("doucuments")
-    chunk_texts = [c[0] for c in chunks_with_src]
-    print(f"Total chunks: {len(chunk_texts)}. Embedding...")
-    chunk_embeds = embed_texts(chunk_texts)
+    index = open_index(args)
+    cache = open_answer_cache(args, index)
     print("Ready! Type your question (or 'exit' to quit):\n")
-    while True:
-        query = input("Q: ")
-        if query.strip().lower() in {"exit", "quit"}:
-            break
-        top_chunks = retrieve_top_k(query, chunk_texts, chunk_embeds, k=4)
-        context_chunks = [c[0] for c in top_chunks]
-        answer = answer_query(query, context_chunks)
-        print("\n--- Answer ---\n" + answer + "\n")
+    try:
+        while True:
+            query = input("Q: ")
+            if query.strip().lower() in {"exit", "quit"}:
+                break
+            answer, origin = cached_answer(query, index, cache, k=args.k, mode=args.mode, filters=filters,
+                                           diversity=args.diversity, context_tokens=args.context_tokens)
+            label = "" if origin == "generated" else f" (cached, {origin} match)"
+            print(f"\n--- Answer{label} ---\n" + answer + "\n")
+    finally:
+        if cache is not None:
+            stats = cache.stats()
+            print(f"Answer cache: {stats['exact_hits']} exact and {stats['semantic_hits']} similar-question hits, "
+                  f"{stats['misses']} generated ({stats['hit_rate']:.0%} hit rate).")
+            cache.close()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Thin command-line client for ``rag_server.py``.
+
+Holds no index and loads no models: each question is one JSON line to the
+server, and the answer comes back with its citations.
+
+Usage:
+    python rag_client.py                                 # interactive, like rag_cli.py
+    python rag_client.py --query "What is Snell's law?"  # one question, then exit
+    python rag_client.py --stats
+"""
+
+import argparse
+import json
+import socket
+from typing import Any, Dict, Optional
+
+from rag_filters import FILTER_FIELDS, parse_filter_args
+from rag_index import SEARCH_MODES
+
+DEFAULT_PORT = 8765
+
+
+class RagClient:
+    """One connection to a RAG server; requests on it are answered in order."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, timeout: float = 300.0):
+        self._socket = socket.create_connection((host, port), timeout=timeout)
+        self._file = self._socket.makefile("rwb")
+
+    def request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        self._file.write(json.dumps(payload).encode("utf-8") + b"\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    def ask(self, query: str, k: int = 4, mode: str = "hybrid", answer: bool = True,
+            filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return self.request({"query": query, "k": k, "mode": mode, "answer": answer, "filters": filters})
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+def print_response(response: Dict[str, Any]):
+    if "answer" in response:
+        label = f" (cached, {response['cached']} match)" if response.get("cached") else ""
+        print(f"\n--- Answer{label} ---\n" + response["answer"])
+    else:
+        for text in response.get("chunks", []):
+            print("\n" + text)
+    print("\nSources:")
+    for source in response["sources"]:
+        print(f"  [{source['citation']}]  {source['score']:.3f}")
+    print(f"({response['ms']:.0f} ms)\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ask questions through a running rag_server.py.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--query", default=None, help="Ask one question and exit")
+    parser.add_argument("--mode", choices=SEARCH_MODES, default="hybrid", help="Retrieval mode")
+    parser.add_argument("-k", type=int, default=4, help="Chunks passed to the model")
+    parser.add_argument("--no-answer", action="store_true", help="Only retrieve chunks, do not generate an answer")
+    parser.add_argument("--filter", action="append", default=[], metavar="FIELD=VALUE",
+                        help=f"Only search matching chunks; FIELD is one of {', '.join(FILTER_FIELDS)} (repeatable)")
+    parser.add_argument("--stats", action="store_true", help="Print server statistics and exit")
+    args = parser.parse_args()
+    try:
+        filters = parse_filter_args(args.filter)
+    except ValueError as e:
+        parser.error(str(e))
+
+    client = RagClient(args.host, args.port)
+    try:
+        if args.stats:
+            print(json.dumps(client.request({"op": "stats"}), indent=2))
+            return
+        if args.query:
+            print_response(client.ask(args.query, args.k, args.mode, not args.no_answer, filters))
+            return
+        print("Type your question (or 'exit' to quit):\n")
+        while True:
+            query = input("Q: ")
+            if query.strip().lower() in {"exit", "quit"}:
+                break
+            if not query.strip():
+                continue
+            try:
+                print_response(client.ask(query, args.k, args.mode, not args.no_answer, filters))
+            except RuntimeError as e:
+                print(f"Error: {e}\n")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
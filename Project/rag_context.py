@@ -0,0 +1,148 @@
+"""
+Post-retrieval context selection for RAG prompts.
+
+The chunks retrieved for a question are often similar to each other as well
+as to the question: the same passage in several PDFs, or neighbouring
+chunks of one section. Two local stages, neither of which calls a model,
+run between retrieval and prompt assembly:
+
+1. Maximal marginal relevance (MMR) picks ``k`` of the retrieved candidates,
+   each time the one with the best
+   ``(1 - diversity) * relevance - diversity * redundancy``, where redundancy
+   is the highest cosine similarity to a chunk already picked. The
+   candidate-to-candidate similarities are one matrix product and each pick
+   updates the redundancy vector with one ``np.maximum``.
+2. Extractive compression keeps the sentences of the picked chunks that best
+   match the question (BM25 over the sentences) up to a token budget,
+   dropping sentences repeated between chunks and, in chunks that match,
+   sentences with none of the question's terms unless they follow one that
+   has. Kept sentences stay in document order under their chunk's citation;
+   gaps are marked with "...".
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+from chunker import split_sentences
+from lazy_imports import lazy_import
+from prompt_budget import count_tokens
+from rag_index import BM25Index, tokenize, top_k
+
+np = lazy_import("numpy")
+
+DEFAULT_DIVERSITY = 0.5
+DEFAULT_CONTEXT_TOKENS = 1200
+FETCH_FACTOR = 4  # candidates retrieved per chunk kept, when diversifying
+
+
+def fetch_depth(k: int, diversity: float) -> int:
+    """How many chunks to retrieve so that MMR has ``k`` to choose from."""
+    return k * FETCH_FACTOR if diversity > 0 else k
+
+
+def mmr(relevance: "np.ndarray", vectors: "np.ndarray", k: int, diversity: float = DEFAULT_DIVERSITY) -> "np.ndarray":
+    """Positions of ``k`` candidates in pick order, by maximal marginal relevance.
+
+    ``relevance`` scores the candidates against the query; ``vectors`` are
+    their L2-normalised embeddings. ``diversity`` 0 is plain relevance order.
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    k = min(k, len(relevance))
+    if diversity <= 0 or k <= 1:
+        return top_k(relevance, k)
+    similarity = vectors @ vectors.T
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    gain = (1.0 - diversity) * relevance
+    picked = np.empty(k, dtype=np.int64)
+    for step in range(k):
+        scores = gain - diversity * redundancy
+        scores[picked[:step]] = -np.inf
+        picked[step] = int(np.argmax(scores))
+        np.maximum(redundancy, similarity[picked[step]], out=redundancy)
+    return picked
+
+
+def diversify(hits: Sequence[Tuple[int, float]], vectors: "np.ndarray", k: int,
+              diversity: float = DEFAULT_DIVERSITY) -> List[Tuple[int, float]]:
+    """``k`` of the retrieved ``(id, score)`` hits chosen by MMR, most relevant first.
+
+    Relevance is the retrieval score divided by the best one, so it carries
+    whatever the search mode ranked by (for ``hybrid``, the fused dense and
+    BM25 ranks) on the same 0-1 scale as the cosine redundancy.
+    """
+    if len(hits) <= k or diversity <= 0:
+        return list(hits[:k])
+    scores = np.maximum(np.asarray([score for _, score in hits], dtype=np.float32), 0.0)
+    relevance = scores / scores.max() if scores.max() > 0 else np.ones_like(scores)
+    return [hits[i] for i in mmr(relevance, vectors, k, diversity)]
+
+
+def compress_chunks(query: str, chunks: Sequence[Dict], max_tokens: int = DEFAULT_CONTEXT_TOKENS,
+                    model_name: str = "") -> List[Dict]:
+    """Copies of ``chunks`` holding only their sentences most relevant to ``query``.
+
+    Sentences are taken best first (BM25 against ``query``) while their text
+    fits in ``max_tokens`` (citations not counted); chunks left with no
+    sentence are dropped. ``max_tokens`` 0 leaves the chunks as they are.
+    """
+    if max_tokens <= 0 or not chunks:
+        return list(chunks)
+    sentences: List[Tuple[int, int, str]] = []  # (chunk, position in chunk, text), in retrieval order
+    for c, chunk in enumerate(chunks):
+        sentences.extend((c, position, sentence) for position, sentence in enumerate(split_sentences(chunk["text"])))
+    if not sentences:
+        return []
+    scores = BM25Index.build([text for _, _, text in sentences]).scores(query)
+    matched = {sentences[i][0] for i in np.flatnonzero(scores > 0)}
+    seen = set()
+    candidates = []
+    for i, (c, _, text) in enumerate(sentences):
+        key = " ".join(tokenize(text))
+        if not key or key in seen:
+            continue  # repeated in an earlier chunk (or no words at all)
+        seen.add(key)
+        # In a chunk with matching sentences, one with no query term is only kept right after a
+        # match (it usually continues it); chunks with no match at all (found by meaning, not by
+        # terms) keep their leading sentences.
+        follows_match = i > 0 and scores[i - 1] > 0 and sentences[i - 1][0] == c
+        if scores[i] > 0 or follows_match or c not in matched:
+            candidates.append(i)
+    # Best first; equal scores keep retrieval order.
+    order = sorted(candidates, key=lambda i: -scores[i])
+
+    kept: Dict[int, List[Tuple[int, str]]] = {}
+    used = 0
+    for i in order:
+        c, position, text = sentences[i]
+        tokens = count_tokens(text, model_name)
+        if used + tokens > max_tokens:
+            continue
+        used += tokens
+        kept.setdefault(c, []).append((position, text))
+
+    compressed = []
+    for c, chunk in enumerate(chunks):
+        if c not in kept:
+            continue
+        parts, previous = [], None
+        for position, text in sorted(kept[c]):
+            if previous is not None and position != previous + 1:
+                parts.append("...")
+            parts.append(text)
+            previous = position
+        text = " ".join(parts)
+        compressed.append(dict(chunk, text=text, tokens=count_tokens(text, model_name)))
+    return compressed
+
+
+def select_context(snapshot, query: str, hits: Sequence[Tuple[int, float]], k: int, diversity: float = DEFAULT_DIVERSITY,
+                   context_tokens: int = DEFAULT_CONTEXT_TOKENS, model_name: str = "") -> List[Tuple[Dict, float]]:
+    """The (chunk, score) pairs to put in the prompt: MMR over ``hits`` (ids into
+    ``snapshot.chunks``), then sentence compression of the chunks kept."""
+    if diversity > 0 and len(hits) > k:
+        hits = diversify(hits, snapshot.vectors([i for i, _ in hits]), k, diversity)
+    hits = list(hits[:k])
+    if context_tokens <= 0:
+        return [(snapshot.chunks[i], score) for i, score in hits]
+    chunks = [dict(snapshot.chunks[i], id=i) for i, _ in hits]
+    scores = {i: score for i, score in hits}
+    return [(chunk, scores[chunk.pop("id")]) for chunk in compress_chunks(query, chunks, context_tokens, model_name)]
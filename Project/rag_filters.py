@@ -0,0 +1,159 @@
+"""
+Metadata filters for retrieval.
+
+Chunk metadata is held in columnar arrays per index segment:
+
+    source, doc_type   one packed bitset (1 bit per chunk) per distinct value; a chunk that
+                       stands for near-duplicates has the bits of their values too
+    page, page_end     int32 columns (of the chunk's own location)
+    chapter            int32 column (see ``chunker.heading_chapter``), -1 where unknown
+
+A filter resolves to a boolean mask over the chunks: OR-ing the bitsets of
+the wanted values and comparing the numeric columns, with no per-chunk
+Python. Search applies the mask to the score vectors before top-k, so a
+filtered query scores the same arrays as an unfiltered one, and masks are
+cached per filter, so repeating a filter costs nothing.
+
+Filters are dicts; every given field must match::
+
+    {"source": ["physics-textbook.pdf"], "chapter": [3, 5], "pages": "10-80", "doc_type": ["textbook"]}
+
+``chapter`` is an inclusive range ``[low, high]`` (or one number), ``pages``
+a range spec as in ``pdf_ingest`` (a chunk matches when its pages overlap
+it), ``source`` and ``doc_type`` lists of values (or one value).
+"""
+
+import json
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+
+FILTER_FIELDS = ("source", "doc_type", "chapter", "pages")
+_CATEGORICAL = ("source", "doc_type")
+_MASK_CACHE_SIZE = 64
+
+
+def _int_range(value: Any, field: str) -> Tuple[int, int]:
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        return int(value[0]), int(value[1])
+    if isinstance(value, str) and "-" in value.strip("-"):
+        low, high = value.split("-", 1)
+        return int(low), int(high)
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{field}' filter must be a number or a [low, high] range, got {value!r}")
+    return number, number
+
+
+def _page_ranges(spec: Any) -> List[Tuple[int, int]]:
+    """Inclusive 1-based ranges of a spec such as ``"1-5, 9, 20-"`` (open ends unbounded), or of a
+    list of ``[low, high]`` pairs as ``normalise_filters`` returns."""
+    if isinstance(spec, (list, tuple)):
+        return [_int_range(r, "pages") for r in spec]
+    ranges = []
+    for part in str(spec).replace(" ", "").split(","):
+        if not part:
+            continue
+        start, sep, end = part.partition("-")
+        try:
+            low = int(start) if start else 1
+            high = (int(end) if end else 2 ** 31 - 1) if sep else low
+        except ValueError:
+            raise ValueError(f"Invalid page range '{part}' in '{spec}'")
+        ranges.append((low, high))
+    return ranges
+
+
+def normalise_filters(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Validated filters in canonical form (None when empty), usable as a cache key via ``filter_key``."""
+    if not filters:
+        return None
+    unknown = set(filters) - set(FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown filter field(s) {', '.join(sorted(unknown))}; expected {', '.join(FILTER_FIELDS)}")
+    canonical: Dict[str, Any] = {}
+    for field in _CATEGORICAL:
+        if filters.get(field) is not None:
+            values = filters[field] if isinstance(filters[field], (list, tuple)) else [filters[field]]
+            canonical[field] = sorted(str(v) for v in values)
+    if filters.get("chapter") is not None:
+        canonical["chapter"] = list(_int_range(filters["chapter"], "chapter"))
+    if filters.get("pages") is not None:
+        canonical["pages"] = [list(r) for r in _page_ranges(filters["pages"])]
+    return canonical or None
+
+
+def filter_key(filters: Optional[Dict[str, Any]]) -> str:
+    return json.dumps(normalise_filters(filters), sort_keys=True)
+
+
+def parse_filter_args(specs: Sequence[str]) -> Optional[Dict[str, Any]]:
+    """Filters from command-line ``field=value`` strings, e.g. ``source=a.pdf,b.pdf`` or ``chapter=3-5``."""
+    filters: Dict[str, Any] = {}
+    for spec in specs or []:
+        field, sep, value = spec.partition("=")
+        field = field.strip()
+        if not sep or field not in FILTER_FIELDS:
+            raise ValueError(f"Filter '{spec}' must be field=value with field one of {', '.join(FILTER_FIELDS)}")
+        filters[field] = [v.strip() for v in value.split(",") if v.strip()] if field in _CATEGORICAL else value.strip()
+    return normalise_filters(filters)
+
+
+class ChunkMetadata:
+    """Columnar metadata of one index's chunks, with cached filter masks."""
+
+    def __init__(self, chunks: Sequence[Dict[str, Any]]):
+        n = len(chunks)
+        self.size = n
+        self.bitsets: Dict[str, Dict[str, "np.ndarray"]] = {}
+        for field in _CATEGORICAL:
+            # A chunk standing for near-duplicates elsewhere (see ``chunk_dedup``) has their values too.
+            values = [[str(c.get(field) or "")] + [str(r.get(field) or "") for r in c.get("references", ())]
+                      for c in chunks]
+            vocabulary = {v: i for i, v in enumerate(sorted({v for vs in values for v in vs}))}
+            member = np.zeros((len(vocabulary), n), dtype=bool)
+            rows = [i for i, vs in enumerate(values) for _ in vs]
+            member[[vocabulary[v] for vs in values for v in vs], rows] = True
+            self.bitsets[field] = {v: np.packbits(member[i]) for v, i in vocabulary.items()}
+        self.page = np.fromiter((c.get("page") or 0 for c in chunks), dtype=np.int32, count=n)
+        self.page_end = np.fromiter((c.get("page_end") or c.get("page") or 0 for c in chunks), dtype=np.int32, count=n)
+        self.chapter = np.fromiter((-1 if c.get("chapter") is None else c["chapter"] for c in chunks),
+                                   dtype=np.int32, count=n)
+        self._masks: Dict[str, "np.ndarray"] = {}
+        self._lock = threading.Lock()
+
+    def mask(self, filters: Optional[Dict[str, Any]]) -> Optional["np.ndarray"]:
+        """Boolean mask of the chunks matching ``filters`` (None: no filter)."""
+        filters = normalise_filters(filters)
+        if filters is None:
+            return None
+        key = json.dumps(filters, sort_keys=True)
+        with self._lock:
+            cached = self._masks.get(key)
+        if cached is not None:
+            return cached
+        mask = np.ones(self.size, dtype=bool)
+        for field in _CATEGORICAL:
+            if field in filters:
+                bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+                for value in filters[field]:
+                    if value in self.bitsets[field]:
+                        bits |= self.bitsets[field][value]
+                mask &= np.unpackbits(bits, count=self.size).astype(bool)
+        if "chapter" in filters:
+            low, high = filters["chapter"]
+            mask &= (self.chapter >= low) & (self.chapter <= high)
+        if "pages" in filters:
+            in_pages = np.zeros(self.size, dtype=bool)
+            for low, high in filters["pages"]:
+                in_pages |= (self.page <= high) & (self.page_end >= low)
+            mask &= in_pages
+        with self._lock:
+            if len(self._masks) >= _MASK_CACHE_SIZE:
+                self._masks.pop(next(iter(self._masks)))
+            self._masks[key] = mask
+        return mask
@@ -0,0 +1,411 @@
+"""
+On-disk retrieval index for ``rag_cli``.
+
+An index directory holds, for one chunked corpus:
+
+    chunks.json       chunk texts and their source file
+    embeddings.npy    L2-normalised float32 matrix, one row per chunk
+    embeddings_float16.npy / embeddings_int8.npy + embedding_scales.npy
+                      optional quantized copy searched instead (see ``storage``)
+    bm25.npz          inverted index: per-term postings in CSR layout
+    bm25_vocab.json   term -> row in the postings
+    meta.json         embedding model, sizes, fingerprint of the source files
+
+Dense scores are one matrix-vector product; sparse (BM25) scores are
+accumulated from the postings of the query terms only. Both rankings are
+merged with reciprocal-rank fusion, so exact terms such as formula names or
+apparatus models are found even when the embedding misses them.
+
+With ``storage="float16"`` or ``"int8"`` (scalar quantization with one scale
+per row) the dense scan runs over the quantized matrix, 2x or ~4x smaller
+than float32, and only the best ``rescore`` candidates are re-scored
+exactly from the full-precision rows. All matrices are memory-mapped on
+load, so the full-precision file is only paged in for those candidates.
+"""
+
+import json
+import os
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from lazy_imports import lazy_import
+from rag_filters import ChunkMetadata
+
+np = lazy_import("numpy")
+
+# Embeds a batch of texts for the given task type ("retrieval_document" or "retrieval_query").
+Embedder = Callable[[List[str], str], Sequence[Sequence[float]]]
+
+SEARCH_MODES = ("hybrid", "dense", "sparse")
+EMBEDDING_STORAGE = ("float32", "float16", "int8")
+RESCORE_CANDIDATES = 100
+_SCAN_ROWS = 2048  # rows de-quantized per block, bounding the scan's scratch memory
+RRF_K = 60  # standard reciprocal-rank-fusion damping constant
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were which with "
+    "what how why when where who does do".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased terms; dotted or hyphenated identifiers (``lm-317``, ``v2.1``) stay whole."""
+    return [t for t in _TOKEN_PATTERN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def top_k(scores: "np.ndarray", k: int) -> "np.ndarray":
+    """Indices of the ``k`` highest scores, best first, without a full sort."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index stored as CSR arrays."""
+
+    def __init__(self, vocab: Dict[str, int], indptr: "np.ndarray", doc_ids: "np.ndarray",
+                 term_freqs: "np.ndarray", doc_lengths: "np.ndarray", k1: float = 1.5, b: float = 0.75):
+        self.vocab = vocab
+        self.indptr = indptr          # postings of term t are [indptr[t], indptr[t+1])
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        n_docs = len(doc_lengths)
+        doc_freqs = np.diff(indptr)
+        self.idf = np.log1p((n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        avg_length = float(doc_lengths.mean()) if n_docs else 0.0
+        # Per-document length normalisation, precomputed once.
+        self._norm = (k1 * (1.0 - b + b * doc_lengths / avg_length)).astype(np.float32) if n_docs else doc_lengths
+
+    @classmethod
+    def build(cls, texts: Sequence[str], **params) -> "BM25Index":
+        postings: Dict[str, Dict[int, int]] = {}
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            terms = tokenize(text)
+            lengths[doc_id] = len(terms)
+            for term in terms:
+                counts = postings.setdefault(term, {})
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+        vocab = {term: i for i, term in enumerate(sorted(postings))}
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        doc_ids, term_freqs = [], []
+        for term, i in vocab.items():
+            counts = postings[term]
+            doc_ids.extend(counts.keys())
+            term_freqs.extend(counts.values())
+            indptr[i + 1] = indptr[i] + len(counts)
+        return cls(vocab, indptr, np.asarray(doc_ids, dtype=np.int32),
+                   np.asarray(term_freqs, dtype=np.float32), lengths, **params)
+
+    def doc_freq(self, term: str) -> int:
+        t = self.vocab.get(term)
+        return 0 if t is None else int(self.indptr[t + 1] - self.indptr[t])
+
+    def scores(self, query: str, idf: Optional[Dict[str, float]] = None) -> "np.ndarray":
+        """BM25 score of every document for ``query``.
+
+        ``idf`` overrides this index's own term weights, so several indexes
+        over parts of one corpus can score with corpus-wide statistics.
+        """
+        scores = np.zeros(len(self.doc_lengths), dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            start, end = self.indptr[t], self.indptr[t + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end]
+            weight = self.idf[t] if idf is None else idf[term]
+            # Each document appears once per term's postings, so fancy-index += is safe.
+            scores[docs] += weight * tf * (self.k1 + 1.0) / (tf + self._norm[docs])
+        return scores
+
+    def save(self, directory: str):
+        np.savez(os.path.join(directory, "bm25.npz"), indptr=self.indptr, doc_ids=self.doc_ids,
+                 term_freqs=self.term_freqs, doc_lengths=self.doc_lengths,
+                 params=np.asarray([self.k1, self.b], dtype=np.float64))
+        with open(os.path.join(directory, "bm25_vocab.json"), "w") as f:
+            json.dump(self.vocab, f)
+
+    @classmethod
+    def load(cls, directory: str) -> "BM25Index":
+        with np.load(os.path.join(directory, "bm25.npz")) as data:
+            arrays = {name: data[name] for name in data.files}
+        with open(os.path.join(directory, "bm25_vocab.json")) as f:
+            vocab = json.load(f)
+        k1, b = arrays.pop("params").tolist()
+        return cls(vocab, arrays["indptr"], arrays["doc_ids"], arrays["term_freqs"], arrays["doc_lengths"], k1=k1, b=b)
+
+
+def reciprocal_rank_fusion(rankings: Sequence["np.ndarray"], n_docs: int, k: int = RRF_K,
+                           weights: Optional[Sequence[float]] = None) -> "np.ndarray":
+    """Fused score per document: sum over rankings of ``weight / (k + rank)``, ranks from 1."""
+    fused = np.zeros(n_docs, dtype=np.float32)
+    for i, ranking in enumerate(rankings):
+        weight = 1.0 if weights is None else weights[i]
+        fused[ranking] += weight / (k + np.arange(1, len(ranking) + 1, dtype=np.float32))
+    return fused
+
+
+def bm25_idf(n_docs: int, doc_freq: int) -> float:
+    return float(np.log1p((n_docs - doc_freq + 0.5) / (doc_freq + 0.5)))
+
+
+def rank(mode: str, k: int, candidates: int, n_docs: int, sparse: Callable[[], "np.ndarray"],
+         dense: Optional[Callable[[int], "np.ndarray"]], allowed: Optional["np.ndarray"] = None) -> List[Tuple[int, float]]:
+    """Top ``k`` (row, score) pairs for one search mode.
+
+    ``sparse()`` returns BM25 scores and ``dense(n)`` cosine scores whose best
+    ``n`` must be exact; ``dense`` is None without a query vector. Rows where
+    the boolean ``allowed`` mask is False are never returned, nor, outside
+    dense mode, rows sharing no term with the query.
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode '{mode}'; expected one of {', '.join(SEARCH_MODES)}")
+    if mode == "dense" and dense is None:
+        raise ValueError("Dense search needs a query vector")
+    if not n_docs:
+        return []
+    if mode == "sparse":
+        scores = _mask(sparse(), allowed)
+    elif mode == "dense":
+        scores = _mask(dense(k), allowed)
+    else:
+        sparse_scores = _mask(sparse(), allowed)
+        sparse_ranking = top_k(sparse_scores, candidates)
+        rankings = [sparse_ranking[sparse_scores[sparse_ranking] > 0]]  # terms absent: no sparse vote
+        if dense is not None:
+            dense_scores = _mask(dense(candidates), allowed)
+            dense_ranking = top_k(dense_scores, candidates)
+            rankings.insert(0, dense_ranking[np.isfinite(dense_scores[dense_ranking])])
+        scores = _mask(reciprocal_rank_fusion(rankings, n_docs), allowed)
+    best = top_k(scores, k)
+    if mode != "dense":
+        # BM25 and fused scores are 0 for a chunk sharing no query term and in no ranking.
+        return [(int(i), float(scores[i])) for i in best if scores[i] > 0]
+    return [(int(i), float(scores[i])) for i in best if np.isfinite(scores[i])]
+
+
+def dense_depth(mode: str, k: int, candidates: int) -> int:
+    """How many of the best dense scores ``rank`` will use."""
+    return k if mode == "dense" else candidates
+
+
+def _combine_masks(a: Optional["np.ndarray"], b: Optional["np.ndarray"]) -> Optional["np.ndarray"]:
+    if a is None or b is None:
+        return a if b is None else b
+    return a & b
+
+
+def _mask(scores: "np.ndarray", allowed: Optional["np.ndarray"]) -> "np.ndarray":
+    if allowed is not None:
+        scores[~allowed] = -np.inf
+    return scores
+
+
+def _normalise_rows(matrix: "np.ndarray") -> "np.ndarray":
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class QuantizedMatrix:
+    """A row-wise quantized copy of an embedding matrix, for approximate dot products."""
+
+    def __init__(self, storage: str, data: "np.ndarray", scales: Optional["np.ndarray"] = None):
+        self.storage = storage
+        self.data = data
+        self.scales = scales  # int8 only: row i is data[i] * scales[i]
+
+    @classmethod
+    def quantize(cls, matrix: "np.ndarray", storage: str) -> "QuantizedMatrix":
+        if storage not in EMBEDDING_STORAGE[1:]:
+            raise ValueError(f"Unknown embedding storage '{storage}'; expected one of {', '.join(EMBEDDING_STORAGE)}")
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if storage == "float16":
+            return cls(storage, matrix.astype(np.float16))
+        scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, np.float32)
+        scales[scales == 0] = 1.0
+        data = np.rint(matrix / scales[:, None]).astype(np.int8)
+        return cls(storage, data, scales.astype(np.float32))
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0))
+
+    def dot(self, vectors: "np.ndarray") -> "np.ndarray":
+        """Approximate ``matrix @ vectors`` (a vector, or one column per query), de-quantizing one block of rows at a time."""
+        scores = np.empty((len(self.data),) + vectors.shape[1:], dtype=np.float32)
+        for start in range(0, len(self.data), _SCAN_ROWS):
+            block = np.asarray(self.data[start:start + _SCAN_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ vectors
+        if self.scales is not None:
+            scores *= self.scales.reshape((-1,) + (1,) * (scores.ndim - 1))
+        return scores
+
+    def save(self, directory: str):
+        np.save(os.path.join(directory, f"embeddings_{self.storage}.npy"), self.data)
+        if self.scales is not None:
+            np.save(os.path.join(directory, "embedding_scales.npy"), self.scales)
+
+    @classmethod
+    def load(cls, directory: str, storage: str) -> "QuantizedMatrix":
+        data = np.load(os.path.join(directory, f"embeddings_{storage}.npy"), mmap_mode="r")
+        scales = np.load(os.path.join(directory, "embedding_scales.npy")) if storage == "int8" else None
+        return cls(storage, data, scales)
+
+    @staticmethod
+    def remove(directory: str):
+        for name in ("embeddings_float16.npy", "embeddings_int8.npy", "embedding_scales.npy"):
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class RagIndex:
+    """Chunks with their dense embeddings and BM25 postings."""
+
+    def __init__(self, chunks: List[Dict[str, str]], embeddings: "np.ndarray", bm25: BM25Index,
+                 meta: Optional[Dict] = None, quantized: Optional[QuantizedMatrix] = None,
+                 rescore: int = RESCORE_CANDIDATES):
+        self.chunks = chunks
+        self.embeddings = embeddings  # full precision; only candidate rows are read when quantized
+        self.bm25 = bm25
+        self.meta = meta or {}
+        self.quantized = quantized
+        self.rescore = rescore
+        self._metadata: Optional[ChunkMetadata] = None
+
+    @property
+    def metadata(self) -> ChunkMetadata:
+        """Columnar chunk metadata for filtering, built on first use."""
+        if self._metadata is None:
+            self._metadata = ChunkMetadata(self.chunks)
+        return self._metadata
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @classmethod
+    def build(cls, chunks: List[Dict[str, str]], embed: Embedder, meta: Optional[Dict] = None,
+              storage: str = "float32") -> "RagIndex":
+        texts = [c["text"] for c in chunks]
+        embeddings = embed(texts, "retrieval_document") if texts else np.zeros((0, 0), np.float32)
+        return cls.from_embeddings(chunks, embeddings, meta, storage)
+
+    @classmethod
+    def from_embeddings(cls, chunks: List[Dict[str, str]], embeddings: "np.ndarray", meta: Optional[Dict] = None,
+                        storage: str = "float32") -> "RagIndex":
+        """An index over chunks whose embeddings are already known (e.g. when merging indexes)."""
+        embeddings = _normalise_rows(embeddings) if len(chunks) else np.zeros((0, 0), np.float32)
+        meta = dict(meta or {}, chunks=len(chunks), dim=int(embeddings.shape[1]) if len(chunks) else 0)
+        index = cls(chunks, embeddings, BM25Index.build([c["text"] for c in chunks]), meta)
+        index.set_storage(storage)
+        return index
+
+    @property
+    def storage(self) -> str:
+        return self.quantized.storage if self.quantized is not None else "float32"
+
+    @property
+    def dense_nbytes(self) -> int:
+        """Size of the matrix the dense scan reads."""
+        return self.quantized.nbytes if self.quantized is not None else int(self.embeddings.nbytes)
+
+    def set_storage(self, storage: str):
+        """Search a float16 or int8 copy of the embeddings (quantized from the full-precision rows)."""
+        if storage not in EMBEDDING_STORAGE:
+            raise ValueError(f"Unknown embedding storage '{storage}'; expected one of {', '.join(EMBEDDING_STORAGE)}")
+        self.quantized = None if storage == "float32" else QuantizedMatrix.quantize(self.embeddings, storage)
+        self.meta["storage"] = storage
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "chunks.json"), "w") as f:
+            json.dump(self.chunks, f)
+        np.save(os.path.join(directory, "embeddings.npy"), self.embeddings)
+        self.bm25.save(directory)
+        self.save_storage(directory)
+
+    def save_storage(self, directory: str):
+        """Write the quantized matrix (if any) and meta.json, leaving chunks and full-precision rows as they are."""
+        QuantizedMatrix.remove(directory)
+        if self.quantized is not None:
+            self.quantized.save(directory)
+        # meta.json last: its presence marks a complete index.
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=4)
+
+    @classmethod
+    def load(cls, directory: str) -> "RagIndex":
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        with open(os.path.join(directory, "chunks.json")) as f:
+            chunks = json.load(f)
+        embeddings = np.load(os.path.join(directory, "embeddings.npy"), mmap_mode="r")
+        storage = meta.get("storage", "float32")
+        quantized = QuantizedMatrix.load(directory, storage) if storage != "float32" else None
+        return cls(chunks, embeddings, BM25Index.load(directory), meta, quantized)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, "meta.json"))
+
+    # --- Search ---
+    def dense_scores(self, query_vector: Sequence[float], rescore: Optional[int] = None) -> "np.ndarray":
+        """Cosine score of every chunk.
+
+        With quantized storage the best ``rescore`` candidates of the
+        approximate scan get exact scores; every other score is capped below
+        them, so top-k over the result only ever picks re-scored chunks.
+        """
+        return self.dense_scores_many([query_vector], rescore)[0]
+
+    def dense_scores_many(self, query_vectors: Sequence[Sequence[float]], rescore: Optional[int] = None) -> "np.ndarray":
+        """``dense_scores`` for a batch of queries, one row each, from a single pass over the matrix."""
+        queries = _normalise_rows(np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)))
+        if self.quantized is None:
+            return np.ascontiguousarray((self.embeddings @ queries.T).T)
+        scores = np.ascontiguousarray(self.quantized.dot(queries.T).T)
+        if not scores.shape[1]:
+            return scores
+        for row, q in zip(scores, queries):
+            candidates = np.sort(top_k(row, rescore or self.rescore))  # ascending rows: sequential mmap reads
+            exact = np.asarray(self.embeddings[candidates], dtype=np.float32) @ q
+            np.minimum(row, np.nextafter(exact.min(), np.float32(-np.inf)), out=row)
+            row[candidates] = exact
+        return scores
+
+    def search(self, query: str, query_vector: Optional[Sequence[float]] = None, k: int = 4,
+               mode: str = "hybrid", candidates: int = 50, allowed: Optional["np.ndarray"] = None,
+               filters: Optional[Dict] = None) -> List[Tuple[int, float]]:
+        """Top ``k`` chunk ids with scores.
+
+        ``hybrid`` fuses the top ``candidates`` of the dense and BM25 rankings
+        with RRF; ``dense`` needs ``query_vector``, ``sparse`` does not.
+        ``allowed`` is an optional boolean mask of searchable chunks and
+        ``filters`` metadata conditions (see ``rag_filters``) they must meet.
+        """
+        vectors = None if query_vector is None else [query_vector]
+        return self.search_many([query], vectors, k, mode, candidates, allowed, filters)[0]
+
+    def search_many(self, queries: Sequence[str], query_vectors: Optional[Sequence[Sequence[float]]] = None,
+                    k: int = 4, mode: str = "hybrid", candidates: int = 50, allowed: Optional["np.ndarray"] = None,
+                    filters: Optional[Dict] = None) -> List[List[Tuple[int, float]]]:
+        """``search`` for a batch of queries; dense scores for all of them come from one matrix product."""
+        allowed = _combine_masks(allowed, self.metadata.mask(filters) if filters else None)
+        dense_rows = None
+        if query_vectors is not None and mode != "sparse" and len(self):
+            dense_rows = self.dense_scores_many(query_vectors, max(dense_depth(mode, k, candidates), self.rescore))
+        return [
+            rank(mode, k, candidates, len(self), lambda query=query: self.bm25.scores(query),
+                 None if dense_rows is None else (lambda n, row=dense_rows[i]: row), allowed)
+            for i, query in enumerate(queries)
+        ]
@@ -0,0 +1,419 @@
+"""
+Incrementally updated retrieval index made of immutable segments.
+
+An index directory holds a manifest and one ``RagIndex`` directory per
+segment::
+
+    manifest.json          settings, segments, the documents each holds and its tombstones
+    segments/seg-000001/   a RagIndex (chunks, embeddings, BM25 postings)
+    segments/seg-000002/
+    ...
+
+Each update chunks and embeds only new or changed documents, into one new
+segment. Deleted or changed documents are tombstoned in the segment that
+holds them: their chunks stay on disk but are masked out of every search.
+Compaction merges small segments and segments with many tombstones into
+one, reusing the stored embeddings rather than embedding again, and can run
+in a background thread while queries continue on the previous segments.
+
+With a ``dedup_threshold`` in the settings, near-duplicate chunks are
+collapsed before they are embedded, within each update and again across
+the segments a compaction merges (see ``chunk_dedup``). A collapsed chunk
+stays live while any document it appears in does.
+
+The manifest is replaced atomically and segments are never modified, so a
+search always sees one consistent set of segments.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from chunk_dedup import collapse, duplicate_groups, live_view, minhash_signatures
+from lazy_imports import lazy_import
+from rag_filters import ChunkMetadata, filter_key, normalise_filters
+from rag_index import Embedder, EMBEDDING_STORAGE, RagIndex, bm25_idf, dense_depth, rank, tokenize
+
+np = lazy_import("numpy")
+
+MANIFEST = "manifest.json"
+COMPACT_MIN_CHUNKS = 2000      # live segments smaller than this are merged together
+COMPACT_MAX_DELETED = 0.3      # as is any segment with at least this share of its chunks tombstoned
+_FILTER_CACHE_SIZE = 64
+
+# Chunks (dicts with at least "text" and "source") for the named documents.
+Chunker = Callable[[List[str]], List[Dict]]
+
+_LEGACY_FILES = ("chunks.json", "embeddings.npy", "embeddings_float16.npy", "embeddings_int8.npy",
+                 "embedding_scales.npy", "bm25.npz", "bm25_vocab.json", "meta.json")
+
+
+class Snapshot:
+    """One consistent, read-only view of the index: the segments a search runs over.
+
+    Search results are ids into ``chunks`` of the same snapshot; callers that
+    may race with an update or compaction should take a snapshot first.
+    """
+
+    def __init__(self, manifest: Dict, segments: Dict[str, RagIndex]):
+        self.manifest = manifest
+        self.segments: List[Tuple[str, RagIndex]] = []
+        self.chunks: List[Dict] = []
+        masks = []
+        self._views: Dict[int, List[Dict]] = {}  # segment position -> chunks, where a deletion changed some
+        for entry in manifest["segments"]:
+            index = segments.get(entry["id"])
+            if index is None:
+                continue  # a segment with no chunks has no directory
+            deleted = set(entry["deleted"])
+            self.segments.append((entry["id"], index))
+            if not deleted:
+                masks.append(np.ones(len(index), dtype=bool))
+                self.chunks.extend(index.chunks)
+                continue
+            # Chunks as they read without the deleted documents; None where nothing of a chunk remains.
+            views = [live_view(c, deleted) for c in index.chunks]
+            masks.append(np.fromiter((v is not None for v in views), dtype=bool, count=len(index)))
+            views = [c if v is None else v for c, v in zip(index.chunks, views)]
+            if any(v is not c for c, v in zip(index.chunks, views)):
+                self._views[len(self.segments) - 1] = views
+            self.chunks.extend(views)
+        self.alive = np.concatenate(masks) if masks else np.zeros(0, dtype=bool)
+        self._offsets = np.cumsum([0] + [len(index) for _, index in self.segments])
+        self._filter_masks: Dict[str, "np.ndarray"] = {}
+        self._view_metadata: Dict[int, ChunkMetadata] = {}
+
+    def _metadata(self, position: int) -> ChunkMetadata:
+        """Filter columns of one segment; rebuilt from this snapshot's chunks where deletions changed
+        which documents a collapsed chunk is in."""
+        if position not in self._views:
+            return self.segments[position][1].metadata
+        if position not in self._view_metadata:
+            self._view_metadata[position] = ChunkMetadata(self._views[position])
+        return self._view_metadata[position]
+
+    def filter_mask(self, filters: Optional[Dict]) -> "np.ndarray":
+        """Live chunks matching ``filters`` (see ``rag_filters``), from each segment's cached masks."""
+        filters = normalise_filters(filters)
+        if filters is None or not self.segments:
+            return self.alive
+        key = filter_key(filters)
+        mask = self._filter_masks.get(key)
+        if mask is None:
+            mask = self.alive & np.concatenate([self._metadata(i).mask(filters) for i in range(len(self.segments))])
+            if len(self._filter_masks) >= _FILTER_CACHE_SIZE:
+                self._filter_masks.pop(next(iter(self._filter_masks)))
+            self._filter_masks[key] = mask
+        return mask
+
+    def vectors(self, rows: Sequence[int]) -> "np.ndarray":
+        """Full-precision, L2-normalised embeddings of the given ids into ``chunks``."""
+        rows = np.asarray(rows, dtype=np.int64)
+        dim = next((index.embeddings.shape[1] for _, index in self.segments if len(index)), 0)
+        vectors = np.zeros((len(rows), dim), dtype=np.float32)
+        owners = np.searchsorted(self._offsets, rows, side="right") - 1
+        for s in np.unique(owners):
+            positions = np.flatnonzero(owners == s)
+            vectors[positions] = self.segments[s][1].embeddings[rows[positions] - self._offsets[s]]
+        return vectors
+
+    def search(self, query: str, query_vector: Optional[Sequence[float]] = None, k: int = 4,
+               mode: str = "hybrid", candidates: int = 50, allowed: Optional["np.ndarray"] = None,
+               filters: Optional[Dict] = None) -> List[Tuple[int, float]]:
+        """Top ``k`` live chunks over all segments, as (id into ``chunks``, score).
+
+        BM25 uses corpus-wide document frequencies, so scores are comparable
+        across segments; dense scores are cosines and comparable as they are.
+        ``filters`` restricts the search to chunks with matching metadata.
+        """
+        vectors = None if query_vector is None else [query_vector]
+        return self.search_many([query], vectors, k, mode, candidates, allowed, filters)[0]
+
+    def search_many(self, queries: Sequence[str], query_vectors: Optional[Sequence[Sequence[float]]] = None,
+                    k: int = 4, mode: str = "hybrid", candidates: int = 50, allowed: Optional["np.ndarray"] = None,
+                    filters: Optional[Dict] = None) -> List[List[Tuple[int, float]]]:
+        """``search`` for a batch of queries; each segment's dense scores for all of them come from one matrix product."""
+        segments = [index for _, index in self.segments]
+        n_docs = len(self.chunks)
+        mask = self.filter_mask(filters)
+        if allowed is not None:
+            mask = mask & allowed
+
+        def sparse(query: str) -> "np.ndarray":
+            idf = {term: bm25_idf(n_docs, sum(index.bm25.doc_freq(term) for index in segments))
+                   for term in set(tokenize(query))}
+            return _concat([index.bm25.scores(query, idf) for index in segments])
+
+        dense_rows = None
+        if query_vectors is not None and mode != "sparse" and n_docs:
+            depth = dense_depth(mode, k, candidates)
+            dense_rows = np.concatenate([index.dense_scores_many(query_vectors, max(depth, index.rescore))
+                                         for index in segments], axis=1)
+        return [
+            rank(mode, k, candidates, n_docs, lambda query=query: sparse(query),
+                 None if dense_rows is None else (lambda n, row=dense_rows[i]: row), mask)
+            for i, query in enumerate(queries)
+        ]
+
+
+class SegmentedIndex:
+    """A searchable set of ``RagIndex`` segments described by a manifest."""
+
+    def __init__(self, directory: str, manifest: Dict, segments: Dict[str, RagIndex]):
+        self.directory = directory
+        self._lock = threading.Lock()  # serialises writers (update, compaction); searches never wait
+        self._snapshot = Snapshot(manifest, segments)
+
+    @classmethod
+    def open(cls, directory: str, settings: Dict, storage: str = "float32", reset: bool = False) -> "SegmentedIndex":
+        """The index in ``directory``; started empty when missing, when ``reset``, or when its
+        ``settings`` (embedding model, chunking) differ, since none of its segments can be reused then."""
+        if not reset and cls.exists(directory):
+            index = cls.load(directory)
+            if index._snapshot.manifest.get("settings") == settings:
+                if index.storage != storage:
+                    index.set_storage(storage)
+                return index
+        manifest = {"settings": settings, "storage": storage, "next_segment": 1, "segments": []}
+        index = cls(directory, manifest, {})
+        os.makedirs(directory, exist_ok=True)
+        for name in _LEGACY_FILES:  # files of a single-directory index from before segments
+            if os.path.exists(os.path.join(directory, name)):
+                os.remove(os.path.join(directory, name))
+        index._commit(manifest, {})
+        return index
+
+    @classmethod
+    def load(cls, directory: str) -> "SegmentedIndex":
+        """The index as saved, whatever its settings; segments are memory-mapped (see ``RagIndex.load``)."""
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        segments = {entry["id"]: RagIndex.load(cls._segment_dir(directory, entry["id"]))
+                    for entry in manifest["segments"] if entry["chunks"]}
+        return cls(directory, manifest, segments)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, MANIFEST))
+
+    @staticmethod
+    def _segment_dir(directory: str, segment_id: str) -> str:
+        return os.path.join(directory, "segments", segment_id)
+
+    # --- Read side ---
+    @property
+    def chunks(self) -> List[Dict]:
+        """Chunks of every segment, tombstoned ones included, indexed by the ids ``search`` returns."""
+        return self._snapshot.chunks
+
+    @property
+    def storage(self) -> str:
+        return self._snapshot.manifest["storage"]
+
+    @property
+    def dense_nbytes(self) -> int:
+        return sum(index.dense_nbytes for _, index in self._snapshot.segments)
+
+    def __len__(self) -> int:
+        """Number of live (searchable) chunks."""
+        return int(self._snapshot.alive.sum())
+
+    def documents(self) -> Dict[str, Tuple[str, object]]:
+        """Live documents: name -> (segment id, fingerprint)."""
+        live = {}
+        for entry in self._snapshot.manifest["segments"]:
+            deleted = set(entry["deleted"])
+            for name, fingerprint in entry["sources"].items():
+                if name not in deleted:
+                    live[name] = (entry["id"], fingerprint)
+        return live
+
+    def version(self) -> str:
+        """Digest of the settings and live documents: changes when a document is added, changed or
+        removed, not when segments are compacted or re-quantized. Keys caches of answers (``answer_cache``)."""
+        documents = sorted((name, fingerprint) for name, (_, fingerprint) in self.documents().items())
+        payload = json.dumps([self._snapshot.manifest["settings"], documents], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def snapshot(self) -> "Snapshot":
+        """The current segments; ids from its ``search`` stay valid for its ``chunks`` even if the index changes."""
+        return self._snapshot
+
+    def search(self, query: str, query_vector: Optional[Sequence[float]] = None, k: int = 4,
+               mode: str = "hybrid", candidates: int = 50, allowed: Optional["np.ndarray"] = None,
+               filters: Optional[Dict] = None) -> List[Tuple[int, float]]:
+        """``Snapshot.search`` on the current segments."""
+        return self._snapshot.search(query, query_vector, k, mode, candidates, allowed, filters)
+
+    def search_many(self, queries: Sequence[str], query_vectors: Optional[Sequence[Sequence[float]]] = None,
+                    k: int = 4, mode: str = "hybrid", candidates: int = 50, allowed: Optional["np.ndarray"] = None,
+                    filters: Optional[Dict] = None) -> List[List[Tuple[int, float]]]:
+        return self._snapshot.search_many(queries, query_vectors, k, mode, candidates, allowed, filters)
+
+    # --- Write side ---
+    def update(self, documents: Dict[str, object], chunk: Chunker, embed: Embedder) -> Dict[str, int]:
+        """Bring the index in line with ``documents`` (name -> fingerprint of its content and selection).
+
+        Only new or changed documents are chunked and embedded; removed and
+        changed ones are tombstoned. ``duplicates`` in the returned counts is
+        the number of near-duplicate chunks collapsed instead of embedded.
+        """
+        with self._lock:
+            manifest = copy.deepcopy(self._snapshot.manifest)
+            live = self.documents()
+            stale = sorted(name for name, (_, fingerprint) in live.items() if documents.get(name) != fingerprint)
+            fresh = sorted(name for name in documents if name not in live or name in stale)
+            stats = {"added": len([n for n in fresh if n not in live]), "changed": len([n for n in stale if n in documents]),
+                     "removed": len([n for n in stale if n not in documents]), "chunks": 0, "duplicates": 0}
+            if not stale and not fresh:
+                return stats
+            for entry in manifest["segments"]:
+                entry["deleted"] = sorted(set(entry["deleted"]) | (set(stale) & set(entry["sources"])))
+            segments = dict(self._snapshot.segments)
+            if fresh:
+                found = chunk(fresh)
+                _, chunks = self._dedup(manifest, found)
+                stats["duplicates"] = len(found) - len(chunks)
+                stats["chunks"] = len(chunks)
+                segment_id = self._new_segment(manifest, {name: documents[name] for name in fresh})
+                if chunks:
+                    index = RagIndex.build(chunks, embed, {"segment": segment_id}, storage=manifest["storage"])
+                    index.save(self._segment_dir(self.directory, segment_id))
+                    segments[segment_id] = index
+                manifest["segments"][-1]["chunks"] = len(chunks)
+            # A segment whose documents are all gone is dropped outright.
+            manifest["segments"] = [e for e in manifest["segments"] if set(e["sources"]) - set(e["deleted"])]
+            self._commit(manifest, segments)
+            return stats
+
+    def compaction_candidates(self) -> List[str]:
+        """Segments worth merging: small ones, and ones that are largely tombstoned."""
+        picked = []
+        indexes = dict(self._snapshot.segments)
+        for entry in self._snapshot.manifest["segments"]:
+            index = indexes.get(entry["id"])
+            deleted = set(entry["deleted"])
+            total = len(index) if index is not None else 0
+            dead = sum(1 for c in index.chunks if live_view(c, deleted) is None) if index is not None and deleted else 0
+            if total - dead < COMPACT_MIN_CHUNKS or (total and dead / total >= COMPACT_MAX_DELETED):
+                picked.append(entry["id"])
+        # Merging a single segment only pays off when it removes tombstoned chunks.
+        if len(picked) == 1:
+            entry = next(e for e in self._snapshot.manifest["segments"] if e["id"] == picked[0])
+            if not entry["deleted"]:
+                return []
+        return picked
+
+    def compact(self) -> Optional[str]:
+        """Merge the compaction candidates into one segment, without re-embedding; returns its id."""
+        with self._lock:
+            picked = set(self.compaction_candidates())
+            if not picked:
+                return None
+            manifest = copy.deepcopy(self._snapshot.manifest)
+            segments = dict(self._snapshot.segments)
+            chunks, rows, sources = [], [], {}
+            for entry in manifest["segments"]:
+                if entry["id"] not in picked:
+                    continue
+                deleted = set(entry["deleted"])
+                sources.update({n: fp for n, fp in entry["sources"].items() if n not in deleted})
+                index = segments.pop(entry["id"], None)
+                if index is None:
+                    continue
+                views = [live_view(c, deleted) for c in index.chunks]
+                keep = np.flatnonzero([v is not None for v in views])
+                chunks.extend(views[i] for i in keep)
+                rows.append(np.asarray(index.embeddings[keep], dtype=np.float32))
+            manifest["segments"] = [e for e in manifest["segments"] if e["id"] not in picked]
+            if not sources:
+                self._commit(manifest, segments)
+                return None
+            segment_id = self._new_segment(manifest, sources)
+            if chunks:
+                kept, chunks = self._dedup(manifest, chunks)
+                merged = RagIndex.from_embeddings(chunks, np.concatenate(rows)[kept], {"segment": segment_id},
+                                                  storage=manifest["storage"])
+                merged.save(self._segment_dir(self.directory, segment_id))
+                segments[segment_id] = merged
+            manifest["segments"][-1]["chunks"] = len(chunks)
+            self._commit(manifest, segments)
+            return segment_id
+
+    def compact_in_background(self) -> threading.Thread:
+        """Run ``compact`` in a daemon thread; searches keep using the old segments until it commits."""
+        thread = threading.Thread(target=self.compact, name="rag-compaction", daemon=True)
+        thread.start()
+        return thread
+
+    def set_storage(self, storage: str):
+        """Re-quantize the embeddings (see ``RagIndex.set_storage``) into new segments and commit them.
+
+        Like ``compact``, this writes copies under new ids rather than changing
+        segments in place: searches keep using the old segments until the new
+        manifest is published. Chunks and tombstones are carried over as they are.
+        """
+        if storage not in EMBEDDING_STORAGE:
+            raise ValueError(f"Unknown embedding storage '{storage}'; expected one of {', '.join(EMBEDDING_STORAGE)}")
+        with self._lock:
+            manifest = copy.deepcopy(self._snapshot.manifest)
+            manifest["storage"] = storage
+            old = dict(self._snapshot.segments)
+            segments = {}
+            for entry in manifest["segments"]:
+                index = old.get(entry["id"])
+                if index is None:
+                    continue  # no chunks, no directory
+                segment_id = self._next_segment_id(manifest)
+                copied = RagIndex(index.chunks, index.embeddings, index.bm25, dict(index.meta, segment=segment_id))
+                copied.set_storage(storage)
+                copied.save(self._segment_dir(self.directory, segment_id))
+                # Reopened so the new segment maps its own files, not the old segment's.
+                segments[segment_id] = RagIndex.load(self._segment_dir(self.directory, segment_id))
+                entry["id"] = segment_id
+            self._commit(manifest, segments)
+
+    @staticmethod
+    def _dedup(manifest: Dict, chunks: List[Dict]) -> Tuple[List[int], List[Dict]]:
+        """Positions kept and the chunks with near-duplicates collapsed, per the ``dedup_threshold`` setting."""
+        threshold = manifest["settings"].get("dedup_threshold") or 0.0
+        if threshold <= 0 or len(chunks) < 2:
+            return list(range(len(chunks))), chunks
+        return collapse(chunks, duplicate_groups(minhash_signatures([c["text"] for c in chunks]), threshold))
+
+    @staticmethod
+    def _next_segment_id(manifest: Dict) -> str:
+        segment_id = f"seg-{manifest['next_segment']:06d}"
+        manifest["next_segment"] += 1
+        return segment_id
+
+    def _new_segment(self, manifest: Dict, sources: Dict[str, object]) -> str:
+        segment_id = self._next_segment_id(manifest)
+        manifest["segments"].append({"id": segment_id, "chunks": 0, "sources": sources, "deleted": []})
+        return segment_id
+
+    def _commit(self, manifest: Dict, segments: Dict[str, RagIndex]):
+        """Publish a new manifest, switch searches to it, then delete segments it no longer lists."""
+        self._write_manifest(manifest)
+        self._snapshot = Snapshot(manifest, segments)
+        listed = {entry["id"] for entry in manifest["segments"]}
+        segments_dir = os.path.join(self.directory, "segments")
+        if os.path.isdir(segments_dir):
+            for name in os.listdir(segments_dir):
+                if name not in listed:
+                    # Open memory maps keep unlinked files readable, so in-flight searches are unaffected.
+                    shutil.rmtree(os.path.join(segments_dir, name), ignore_errors=True)
+
+    def _write_manifest(self, manifest: Dict):
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(path + ".tmp", path)
+
+
+def _concat(arrays: List["np.ndarray"]) -> "np.ndarray":
+    return np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.float32)
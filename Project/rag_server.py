@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Local RAG query server: one shared index, many concurrent clients.
+
+The index is opened once (segments are memory-mapped, see ``rag_segments``)
+and served over TCP to any number of clients, e.g. a classroom of students
+running ``rag_client.py``. Requests that arrive together are micro-batched:
+
+- query embeddings are sent to the embedding model as one batch request;
+- dense similarities for the batch come from one matrix product per segment
+  (``search_many``) instead of one scan per query.
+
+The retrieved chunks are then diversified and compressed to their most
+relevant sentences (``rag_context``) before they reach the model.
+
+Answer generation runs per request in a thread pool, so a slow LLM call
+never holds up retrieval for other clients. Answers are cached
+(``answer_cache``): a question asked before is answered before it is
+embedded, one worded alike and answered from the same chunks after
+retrieval, neither calling the model.
+
+Protocol: one JSON object per line in each direction::
+
+    {"query": "What does a convex lens do?", "k": 4, "mode": "hybrid", "answer": true,
+     "filters": {"source": ["optics.pdf"], "chapter": [3, 5]}}
+    -> {"answer": "...", "sources": [{"citation": "optics.pdf, p. 12, 3.1 Lenses", "score": 0.03}], "ms": 812}
+       (with "cached": "exact" or "semantic" when the answer came from the cache)
+
+    {"op": "stats"}
+    -> {"requests": 42, "embed_batches": 9, "mean_embed_batch": 4.7, "answer_cache": {"hit_rate": 0.4, ...}, ...}
+
+Usage:
+    python rag_server.py --port 8765 --storage int8
+    python rag_client.py --port 8765
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import rag_cli
+from answer_cache import AnswerCache
+from rag_cli import (GEMINI_MODEL_NAME, add_answer_cache_arguments, add_context_arguments, add_index_arguments,
+                     answer_query, answer_settings, chunk_citation, embed_texts, format_chunk, open_answer_cache,
+                     open_index)
+from rag_client import DEFAULT_PORT
+from rag_context import DEFAULT_CONTEXT_TOKENS, DEFAULT_DIVERSITY, fetch_depth, select_context
+from rag_filters import filter_key, normalise_filters
+from rag_index import SEARCH_MODES
+
+MAX_K = 20
+
+
+class MicroBatcher:
+    """Collects items submitted by concurrent requests and processes them in batches.
+
+    After the first item arrives the batcher waits ``max_wait`` seconds for
+    more (or until ``max_batch`` are queued), then hands the batch to
+    ``run_batch`` in a worker thread. Up to ``concurrency`` batches run at once.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], Sequence[Any]], executor: ThreadPoolExecutor,
+                 max_batch: int = 32, max_wait: float = 0.005, concurrency: int = 1):
+        self.run_batch = run_batch
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.concurrency = concurrency
+        self.batches = 0
+        self.items = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: set = set()
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._track(asyncio.ensure_future(self._collect()))
+
+    async def submit(self, item: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            batch = [await self._queue.get()]
+            if self._queue.qsize() < self.max_batch - 1:
+                await asyncio.sleep(self.max_wait)  # let requests arriving together join the batch
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await slots.acquire()
+            self._track(asyncio.ensure_future(self._run(batch, slots)))
+
+    async def _run(self, batch: List[tuple], slots: asyncio.Semaphore):
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.run_batch, [item for item, _ in batch])
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            slots.release()
+
+    def _track(self, task: asyncio.Future):
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+
+class RagServer:
+    """Answers JSON-line requests from many connections against one index."""
+
+    def __init__(self, index, embed: Callable[[List[str], str], Any] = embed_texts,
+                 answer: Optional[Callable[[str, List[str]], str]] = answer_query,
+                 max_batch: int = 32, max_wait: float = 0.005, workers: int = 16,
+                 diversity: float = DEFAULT_DIVERSITY, context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+                 answer_cache: Optional[AnswerCache] = None):
+        self.index = index
+        self.answer_cache = answer_cache
+        self.diversity = diversity
+        self.context_tokens = context_tokens
+        self.embed = embed
+        self.answer = answer
+        # Retrieval has its own threads, so answers waiting on the LLM never delay other clients' searches.
+        self.retrieval_executor = ThreadPoolExecutor(max_workers=5, thread_name_prefix="rag-retrieval")
+        self.answer_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-answer")
+        # Embedding is a network call: let a few batches be in flight at once.
+        self.embeddings = MicroBatcher(self._embed_batch, self.retrieval_executor, max_batch, max_wait, concurrency=4)
+        self.searches = MicroBatcher(self._search_batch, self.retrieval_executor, max_batch, max_wait, concurrency=1)
+        self.requests = 0
+        self.errors = 0
+        self.started = time.time()
+
+    # --- Batch functions (run in worker threads) ---
+    def _embed_batch(self, queries: List[str]) -> List[Any]:
+        return list(self.embed(queries, "retrieval_query"))
+
+    def _search_batch(self, items: List[tuple]) -> List[list]:
+        """items are (query, vector, k, mode, filters); one ``search_many`` call per (k, mode, filters) group.
+
+        Returns the (chunk, score) pairs ``rag_context.select_context`` keeps, resolved against the snapshot
+        that was searched.
+        """
+        snapshot = self.index.snapshot()
+        results: List[Optional[list]] = [None] * len(items)
+        groups: Dict[tuple, List[int]] = {}
+        for i, (_, _, k, mode, filters) in enumerate(items):
+            groups.setdefault((k, mode, filter_key(filters)), []).append(i)
+        for (k, mode, _), positions in groups.items():
+            queries = [items[i][0] for i in positions]
+            vectors = None if mode == "sparse" else [items[i][1] for i in positions]
+            filters = items[positions[0]][4]
+            depth = fetch_depth(k, self.diversity)
+            for i, hits in zip(positions, snapshot.search_many(queries, vectors, k=depth, mode=mode, filters=filters)):
+                results[i] = select_context(snapshot, items[i][0], hits, k, self.diversity, self.context_tokens,
+                                            GEMINI_MODEL_NAME)
+        return results
+
+    # --- Requests ---
+    async def handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        if request.get("op") == "stats":
+            return self.stats()
+        query = str(request.get("query", "")).strip()
+        if not query:
+            raise ValueError("'query' is required")
+        k = int(request.get("k", 4))
+        if not 1 <= k <= MAX_K:
+            raise ValueError(f"'k' must be between 1 and {MAX_K}")
+        mode = request.get("mode", "hybrid")
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown mode '{mode}'; expected one of {', '.join(SEARCH_MODES)}")
+        filters = normalise_filters(request.get("filters"))
+
+        started = time.perf_counter()
+        self.requests += 1
+        loop = asyncio.get_running_loop()
+        answering = request.get("answer", True) and self.answer is not None
+        cache = self.answer_cache if answering else None
+        if cache is not None:
+            scope = answer_settings(k, mode, filters, self.diversity, self.context_tokens)
+            generation = self.index.version()
+            hit = await loop.run_in_executor(self.retrieval_executor, cache.get, query, scope, generation)
+            if hit is not None:
+                return self._cached_response(hit, "exact", started)
+        vector = await self.embeddings.submit(query) if mode != "sparse" else None
+        hits = await self.searches.submit((query, vector, k, mode, filters))
+        chunks = [chunk for chunk, _ in hits]
+        sources = [(chunk_citation(c), float(s)) for c, s in hits]
+        if cache is not None:
+            hit = await loop.run_in_executor(self.retrieval_executor, cache.get_similar, query, vector, scope,
+                                             generation, sources)
+            if hit is not None:
+                return self._cached_response(hit, "semantic", started)
+        response: Dict[str, Any] = {"sources": [{"citation": c, "score": s} for c, s in sources]}
+        if answering:
+            response["answer"] = await loop.run_in_executor(
+                self.answer_executor, self.answer, query, [format_chunk(c) for c in chunks])
+            if cache is not None and response["answer"]:
+                await loop.run_in_executor(self.retrieval_executor, cache.put, query, vector, scope, generation,
+                                           sources, response["answer"])
+        else:
+            response["chunks"] = [c["text"] for c in chunks]
+        response["ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return response
+
+    @staticmethod
+    def _cached_response(hit: Dict[str, Any], origin: str, started: float) -> Dict[str, Any]:
+        return {"answer": hit["answer"], "sources": [{"citation": c, "score": s} for c, s in hit["sources"]],
+                "cached": origin, "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.handle_request(json.loads(line))
+                except Exception as e:
+                    self.errors += 1
+                    response = {"error": str(e)}
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "requests": self.requests,
+            "errors": self.errors,
+            "chunks": len(self.index),
+            "uptime_s": round(time.time() - self.started),
+            "embed_batches": self.embeddings.batches,
+            "mean_embed_batch": self.embeddings.items / self.embeddings.batches if self.embeddings.batches else 0.0,
+            "search_batches": self.searches.batches,
+            "mean_search_batch": self.searches.items / self.searches.batches if self.searches.batches else 0.0,
+        }
+        if self.embed is embed_texts and rag_cli.embedding_cache_dir is not None:
+            stats["embedding_cache"] = rag_cli.get_embedding_cache(rag_cli.embedding_cache_dir).stats()
+        if self.answer_cache is not None:
+            stats["answer_cache"] = self.answer_cache.stats()
+        return stats
+
+    async def serve(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT,
+                    ready: Optional[Callable[[], None]] = None):
+        self.embeddings.start()
+        self.searches.start()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        if ready is not None:
+            ready()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.embeddings.stop()
+            self.searches.stop()
+            self.retrieval_executor.shutdown(wait=False)
+            self.answer_executor.shutdown(wait=False)
+            if self.answer_cache is not None:
+                self.answer_cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve RAG queries over one shared index to many clients.")
+    add_index_arguments(parser)
+    add_context_arguments(parser)
+    add_answer_cache_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch", type=int, default=32, help="Most requests embedded/searched together")
+    parser.add_argument("--batch-wait-ms", type=float, default=5.0, help="How long a batch waits for more requests")
+    parser.add_argument("--workers", type=int, default=16, help="Answers generated at once")
+    args = parser.parse_args()
+
+    index = open_index(args)
+    server = RagServer(index, max_batch=args.max_batch, max_wait=args.batch_wait_ms / 1000, workers=args.workers,
+                       diversity=args.diversity, context_tokens=args.context_tokens,
+                       answer_cache=open_answer_cache(args, index))
+    try:
+        asyncio.run(server.serve(args.host, args.port,
+                                 ready=lambda: print(f"RAG server on {args.host}:{args.port} ({len(index)} chunks)")))
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Latency and recall benchmark for rag_cli retrieval modes.
+
+Runs a labelled query set against a ``RagIndex`` (or a saved segmented
+``rag_cli`` index) in dense, sparse (BM25) and
+hybrid (reciprocal-rank fusion) mode and reports recall@k plus mean and p95
+search latency. Query embedding time is reported separately, since it is
+the same for dense and hybrid.
+
+With ``--storage`` it also compares embedding storage precisions: for each
+of float32, float16 and int8 it reports the size of the scanned matrix,
+dense recall@k, agreement of the dense top-k with exact float32 search,
+and dense search latency.
+
+A labelled query file is a JSON list of objects::
+
+    {"query": "What is the rating of the LM-317 regulator?", "relevant": ["LM-317"]}
+
+A chunk counts as relevant when it contains any of the ``relevant``
+strings (case-insensitive). The offline ``hashing`` embedder is only a lossy
+lexical stand-in for a dense model; use ``--embedder`` with a real model to
+measure semantic recall.
+
+Usage:
+    python retrieval_benchmark.py --synthetic 2000               # offline, generated corpus
+    python retrieval_benchmark.py --index-dir rag_index --queries labelled.json --embedder gemini
+    python retrieval_benchmark.py --synthetic 20000 --hash-dim 768 --storage float32 float16 int8 --modes dense
+"""
+
+import argparse
+import json
+import random
+import statistics
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from lazy_imports import lazy_import
+from quiz_filter import hashing_vectors
+from rag_index import EMBEDDING_STORAGE, RagIndex, SEARCH_MODES
+from rag_segments import SegmentedIndex
+
+np = lazy_import("numpy")
+
+_TOPICS = {
+    "optics": "lens focal length refraction prism mirror image convex concave aperture ray beam wavelength",
+    "circuits": "resistor voltage current capacitor inductor diode transistor circuit ohm series parallel",
+    "mechanics": "pendulum mass spring force friction momentum velocity acceleration torque inertia gravity",
+    "thermo": "heat temperature entropy gas pressure volume calorimeter conduction convection radiation",
+    "chemistry": "titration acid base burette indicator molarity solution reaction buffer ph precipitate",
+    "biology": "cell microscope enzyme protein membrane osmosis tissue specimen culture stain nucleus",
+}
+_FILLER = ("the experiment measures records observes shows using with and then each value sample step "
+           "procedure setup reading table graph result error").split()
+
+
+def synthetic_corpus(n_docs: int, n_queries: int, seed: int = 7) -> Tuple[List[Dict[str, str]], List[Dict]]:
+    """Chunks of topic vocabulary, each mentioning one apparatus model number and a
+    three-word description drawn from a small per-topic pool. Half the queries ask by
+    model number (exact-term lookups), half by the description."""
+    rng = random.Random(seed)
+    topics = list(_TOPICS)
+    descriptors = {t: [f"{t[:3]}{w}" for w in ("alpha beta gamma delta kappa sigma omega zeta theta lambda "
+                                               "tau rho phi chi psi eta iota mu nu xi").split()] for t in topics}
+    chunks, keys = [], []
+    for i in range(n_docs):
+        topic = topics[i % len(topics)]
+        words = _TOPICS[topic].split()
+        model = f"{topic[:2]}-{1000 + i}"
+        description = " ".join(rng.sample(descriptors[topic], 3))
+        body = [rng.choice(words if rng.random() < 0.6 else _FILLER) for _ in range(120)]
+        body.insert(rng.randrange(len(body)), f"apparatus {model}")
+        body.insert(rng.randrange(len(body)), description)
+        chunks.append({"text": " ".join(body), "source": f"{topic}.pdf"})
+        keys.append((model, description))
+    queries = []
+    for j in range(n_queries):
+        model, description = keys[rng.randrange(n_docs)]
+        if j % 2 == 0:
+            queries.append({"query": f"What does apparatus {model} measure", "relevant": [model]})
+        else:
+            queries.append({"query": f"which {description} setup", "relevant": [description]})
+    return chunks, queries
+
+
+def hashing_embedder(dim: int) -> Callable[[List[str], str], "np.ndarray"]:
+    """Offline stand-in for an embedding model: hashed n-gram vectors at low dimension.
+    Collisions make it lossy on exact identifiers, like a real dense model."""
+    return lambda texts, task_type: hashing_vectors(texts, dim=dim)
+
+
+def provider_embedder(model_name: str) -> Callable[[List[str], str], Sequence[Sequence[float]]]:
+    from providers import create_provider
+
+    provider = create_provider(model_name)
+    return lambda texts, task_type: provider.embed(texts, task_type=task_type)
+
+
+def relevant_ids(index: RagIndex, needles: Sequence[str]) -> set:
+    lowered = [n.lower() for n in needles]
+    return {i for i, chunk in enumerate(index.chunks) if any(n in chunk["text"].lower() for n in lowered)}
+
+
+def embed_queries(queries: List[Dict], embed) -> Tuple[List["np.ndarray"], List[float]]:
+    vectors, embed_ms = [], []
+    for q in queries:
+        started = time.perf_counter()
+        vectors.append(np.asarray(embed([q["query"]], "retrieval_query"), dtype=np.float32)[0])
+        embed_ms.append((time.perf_counter() - started) * 1000)
+    return vectors, embed_ms
+
+
+def run(index: RagIndex, queries: List[Dict], embed, k: int, modes: Sequence[str]) -> Dict[str, Dict[str, float]]:
+    vectors, embed_ms = embed_queries(queries, embed)
+    truth = [relevant_ids(index, q["relevant"]) for q in queries]
+
+    results = {"query embedding": {"mean_ms": statistics.mean(embed_ms), "p95_ms": _p95(embed_ms)}}
+    for mode in modes:
+        latencies, recalls = [], []
+        for q, vector, relevant in zip(queries, vectors, truth):
+            if not relevant:
+                continue
+            started = time.perf_counter()
+            hits = index.search(q["query"], vector, k=k, mode=mode)
+            latencies.append((time.perf_counter() - started) * 1000)
+            found = {i for i, _ in hits} & relevant
+            recalls.append(len(found) / min(k, len(relevant)))
+        results[mode] = {
+            f"recall@{k}": statistics.mean(recalls) if recalls else 0.0,
+            "mean_ms": statistics.mean(latencies) if latencies else 0.0,
+            "p95_ms": _p95(latencies),
+        }
+    return results
+
+
+def compare_storage(index: RagIndex, queries: List[Dict], embed, k: int,
+                    storages: Sequence[str]) -> Dict[str, Dict[str, float]]:
+    """Dense search under each storage precision, against exact float32 search."""
+    vectors, _ = embed_queries(queries, embed)
+    truth = [relevant_ids(index, q["relevant"]) for q in queries]
+    original = index.storage
+    index.set_storage("float32")
+    exact = [{i for i, _ in index.search(q["query"], v, k=k, mode="dense")} for q, v in zip(queries, vectors)]
+    results = {}
+    for storage in storages:
+        index.set_storage(storage)
+        latencies, recalls, agreement = [], [], []
+        for q, vector, relevant, expected in zip(queries, vectors, truth, exact):
+            started = time.perf_counter()
+            found = {i for i, _ in index.search(q["query"], vector, k=k, mode="dense")}
+            latencies.append((time.perf_counter() - started) * 1000)
+            agreement.append(len(found & expected) / max(1, len(expected)))
+            if relevant:
+                recalls.append(len(found & relevant) / min(k, len(relevant)))
+        results[storage] = {
+            "MB": index.dense_nbytes / 1e6,
+            f"recall@{k}": statistics.mean(recalls) if recalls else 0.0,
+            "exact overlap": statistics.mean(agreement) if agreement else 0.0,
+            "mean_ms": statistics.mean(latencies) if latencies else 0.0,
+            "p95_ms": _p95(latencies),
+        }
+    index.set_storage(original)
+    return results
+
+
+def _p95(values: List[float]) -> float:
+    return sorted(values)[int(0.95 * (len(values) - 1))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dense, BM25 and hybrid retrieval.")
+    parser.add_argument("--synthetic", type=int, default=None, metavar="N", help="Generate an N-chunk corpus")
+    parser.add_argument("--queries", help="Labelled query JSON (required without --synthetic)")
+    parser.add_argument("--index-dir", default="rag_index", help="Existing index to benchmark")
+    parser.add_argument("--num-queries", type=int, default=200, help="Queries to generate with --synthetic")
+    parser.add_argument("--embedder", default="hashing",
+                        help="'hashing' (offline) or a model name such as gemini-1.5-flash")
+    parser.add_argument("--hash-dim", type=int, default=256, help="Dimension of the hashing embedder")
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--modes", nargs="+", choices=SEARCH_MODES, default=list(SEARCH_MODES))
+    parser.add_argument("--storage", nargs="+", choices=EMBEDDING_STORAGE, default=None,
+                        help="Also compare dense search over these embedding storage precisions")
+    args = parser.parse_args()
+
+    embed = hashing_embedder(args.hash_dim) if args.embedder == "hashing" else provider_embedder(args.embedder)
+    if args.synthetic:
+        chunks, queries = synthetic_corpus(args.synthetic, args.num_queries)
+        started = time.perf_counter()
+        index = RagIndex.build(chunks, embed)
+        print(f"Built index over {len(index)} chunks in {time.perf_counter() - started:.2f}s")
+    else:
+        if not args.queries:
+            parser.error("--queries is required unless --synthetic is given")
+        index = SegmentedIndex.load(args.index_dir)
+        with open(args.queries) as f:
+            queries = json.load(f)
+
+    results = run(index, queries, embed, args.k, args.modes)
+    print(f"\n{'mode':<18}{'recall@' + str(args.k):>10}{'mean ms':>10}{'p95 ms':>10}")
+    print("-" * 48)
+    for mode, row in results.items():
+        recall = row.get(f"recall@{args.k}")
+        recall_text = f"{recall:>10.3f}" if recall is not None else f"{'':>10}"
+        print(f"{mode:<18}{recall_text}{row['mean_ms']:>10.3f}{row['p95_ms']:>10.3f}")
+
+    if args.storage:
+        results = compare_storage(index, queries, embed, args.k, args.storage)
+        print(f"\n{'storage':<10}{'MB':>9}{'recall@' + str(args.k):>10}{'exact top-k':>13}{'mean ms':>10}{'p95 ms':>10}")
+        print("-" * 62)
+        for storage, row in results.items():
+            print(f"{storage:<10}{row['MB']:>9.1f}{row[f'recall@{args.k}']:>10.3f}{row['exact overlap']:>13.3f}"
+                  f"{row['mean_ms']:>10.3f}{row['p95_ms']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+HTTP front-end for sandbox generation.
+
+Requests are recorded in a persistent SQLite job queue (``job_queue.py``)
+and executed by a configurable pool of worker threads running the LangGraph
+workflow, so intake never waits on LLM latency.
+
+Endpoints:
+    POST /sandboxes                                  {"topic": ..., "model": ...}  -> 202 {"id": ...}
+    GET  /sandboxes/{id}                             status, progress and generated state
+    POST /sandboxes/{id}/sections/{section}/feedback {"feedback": ...}            -> 202
+    GET  /sandboxes/{id}/archive                     streamed ZIP of the finished sandbox
+    GET  /health                                     queue statistics
+
+When the queue already holds ``--max-pending`` jobs, new work is rejected
+with 503 so clients back off instead of piling up requests.
+
+Usage:
+    python sandbox_service.py --port 8080 --workers 4
+    python sandbox_service.py --model fake      # offline, for tests
+"""
+
+import argparse
+import json
+import re
+import threading
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from job_queue import JobQueue, QueueFull, QUEUED, RUNNING, DONE, FAILED
+from langgraph_experiment_generator import get_shared_generator, new_sandbox_state
+from providers import supported_prefixes
+
+DEFAULT_MODEL = "gemini-2.5-flash-preview-05-20"
+FEEDBACK_SECTIONS = ("aim", "pretest", "posttest", "theory", "procedure", "references")
+
+
+class SandboxWorkerPool:
+    """Threads that claim jobs from the queue and run them to completion."""
+
+    def __init__(self, queue: JobQueue, workers: int = 2, output_dir: Optional[str] = None,
+                 store=None):
+        self.queue = queue
+        self.workers = workers
+        self.output_dir = output_dir
+        self.store = store
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"Requeued {recovered} interrupted jobs")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, args=(f"worker-{i}-{uuid.uuid4().hex[:6]}",),
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _loop(self, worker_name: str):
+        while not self._stop.is_set():
+            job = self.queue.claim(worker_name, timeout=1.0)
+            if job is None:
+                continue
+            try:
+                self.run_job(job)
+                self.queue.complete(job["id"])
+            except Exception as e:
+                retried = self.queue.fail(job["id"], str(e))
+                if not retried:
+                    self.queue.update_sandbox(job["sandbox_id"], FAILED, error=str(e))
+
+    def run_job(self, job: Dict[str, Any]):
+        sandbox = self.queue.get_sandbox(job["sandbox_id"])
+        # Provider errors propagate, so the queue retries the job instead of storing error text as content.
+        generator = get_shared_generator(sandbox["model_name"], raise_errors=True)
+        state = sandbox["state"]
+
+        if job["kind"] == "generate":
+            self.queue.update_sandbox(sandbox["id"], RUNNING, state)
+            # Persist each intermediate state so GET shows progress as steps finish.
+            for snapshot in generator.compiled_graph().stream(state, stream_mode="values"):
+                state = snapshot
+                self.queue.update_sandbox(sandbox["id"], RUNNING, state)
+            if state.get("current_step") != "complete":
+                raise RuntimeError(f"Workflow stopped at step '{state.get('current_step')}'")
+        elif job["kind"] == "feedback":
+            previous_step = state["current_step"]
+            if previous_step == "complete":
+                self.queue.update_sandbox(sandbox["id"], RUNNING)
+            state["current_step"] = job["payload"]["section"]
+            state["user_action"] = "update"
+            state["user_feedback"] = job["payload"]["feedback"]
+            state = generator.workflow_step(state)
+            state["current_step"] = previous_step
+            if previous_step != "complete":
+                # A failed or unfinished sandbox keeps its status and is neither saved nor committed.
+                self.queue.update_sandbox(sandbox["id"], sandbox["status"], state, error=sandbox["error"])
+                return
+        else:
+            raise ValueError(f"Unknown job kind: {job['kind']}")
+
+        if self.output_dir and state.get("sandbox_name"):
+            generator.save_content(state, output_dir=self.output_dir)
+        if self.store is not None and state.get("sandbox_name"):
+            self.store.commit(state["sandbox_name"], generator.sandbox_files(state),
+                              metadata={"sandbox_id": sandbox["id"], "model_name": sandbox["model_name"]})
+        self.queue.update_sandbox(sandbox["id"], DONE, state)
+
+
+class SandboxRequestHandler(BaseHTTPRequestHandler):
+    """JSON API over the job queue. ``server.queue`` and ``server.default_model`` are set by ``make_server``."""
+
+    routes = [
+        ("POST", re.compile(r"^/sandboxes/?$"), "create_sandbox"),
+        ("GET", re.compile(r"^/sandboxes/(?P<sandbox_id>[0-9a-f]+)/?$"), "get_sandbox"),
+        ("POST", re.compile(r"^/sandboxes/(?P<sandbox_id>[0-9a-f]+)/sections/(?P<section>\w+)/feedback/?$"),
+         "post_feedback"),
+        ("GET", re.compile(r"^/sandboxes/(?P<sandbox_id>[0-9a-f]+)/archive/?$"), "get_archive"),
+        ("GET", re.compile(r"^/health/?$"), "health"),
+    ]
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def log_message(self, format, *args):
+        if not getattr(self.server, "quiet", False):
+            super().log_message(format, *args)
+
+    # --- Helpers ---
+    def _dispatch(self, method: str):
+        path = self.path.split("?", 1)[0]
+        for route_method, pattern, handler_name in self.routes:
+            match = pattern.match(path)
+            if match and route_method == method:
+                try:
+                    status, body = getattr(self, handler_name)(**match.groupdict())
+                except QueueFull as e:
+                    status, body = 503, {"error": str(e)}
+                except ValueError as e:
+                    status, body = 400, {"error": str(e)}
+                except Exception as e:
+                    # Answer with JSON rather than dropping the connection; the trace goes to the log.
+                    self.log_error("%s %s failed: %s", method, path, traceback.format_exc())
+                    if getattr(self, "_streaming", False):
+                        self.close_connection = True  # headers already sent; the client sees a cut-off body
+                        return
+                    status, body = 500, {"error": f"{type(e).__name__}: {e}"}
+                if body is not None:
+                    self._send_json(status, body)
+                return
+        self._send_json(404, {"error": f"No route for {method} {path}"})
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except json.JSONDecodeError:
+            raise ValueError("Request body must be JSON")
+        if not isinstance(body, dict):
+            raise ValueError("Request body must be a JSON object")
+        return body
+
+    def _send_json(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body, indent=2).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 503:
+            self.send_header("Retry-After", "5")
+        self.end_headers()
+        self.wfile.write(data)
+
+    # --- Handlers ---
+    def create_sandbox(self) -> Tuple[int, Dict[str, Any]]:
+        body = self._read_json()
+        topic = str(body.get("topic", "")).strip()
+        if not topic:
+            raise ValueError("'topic' is required")
+        model_name = body.get("model") or self.server.default_model
+        if not isinstance(model_name, str):
+            raise ValueError("'model' must be a string")
+        if not any(model_name.startswith(prefix) for prefix in supported_prefixes()):
+            raise ValueError(f"Unsupported model: {model_name}")
+        sandbox_id = self.server.queue.create_sandbox(topic, model_name, new_sandbox_state(topic))
+        return 202, {"id": sandbox_id, "status": QUEUED, "url": f"/sandboxes/{sandbox_id}"}
+
+    def get_sandbox(self, sandbox_id: str) -> Tuple[int, Dict[str, Any]]:
+        sandbox = self.server.queue.get_sandbox(sandbox_id)
+        if sandbox is None:
+            return 404, {"error": "Unknown sandbox"}
+        state = sandbox["state"] or {}
+        return 200, {
+            "id": sandbox["id"],
+            "topic": sandbox["topic"],
+            "model": sandbox["model_name"],
+            "status": sandbox["status"],
+            "error": sandbox["error"],
+            "progress": state.get("progress", 0.0),
+            "current_step": state.get("current_step"),
+            "state": state,
+            "jobs": self.server.queue.jobs_for(sandbox_id),
+        }
+
+    def post_feedback(self, sandbox_id: str, section: str) -> Tuple[int, Dict[str, Any]]:
+        if section not in FEEDBACK_SECTIONS:
+            raise ValueError(f"Unknown section '{section}'; expected one of {', '.join(FEEDBACK_SECTIONS)}")
+        sandbox = self.server.queue.get_sandbox(sandbox_id)
+        if sandbox is None:
+            return 404, {"error": "Unknown sandbox"}
+        feedback = str(self._read_json().get("feedback", "")).strip()
+        if not feedback:
+            raise ValueError("'feedback' is required")
+        job_id = self.server.queue.enqueue(sandbox_id, "feedback", {"section": section, "feedback": feedback})
+        return 202, {"id": sandbox_id, "job": job_id, "status": QUEUED}
+
+    def get_archive(self, sandbox_id: str) -> Tuple[int, Optional[Dict[str, Any]]]:
+        from exporter import iter_zip
+
+        sandbox = self.server.queue.get_sandbox(sandbox_id)
+        if sandbox is None:
+            return 404, {"error": "Unknown sandbox"}
+        state = sandbox["state"] or {}
+        if state.get("current_step") != "complete":
+            return 409, {"error": "Sandbox is not complete yet", "status": sandbox["status"]}
+        files = get_shared_generator(sandbox["model_name"]).sandbox_files(state)
+        # No Content-Length: the archive is streamed and the connection closed at the end.
+        self._streaming = True
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Disposition", f'attachment; filename="{state["sandbox_name"]}.zip"')
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for chunk in iter_zip(files):
+            self.wfile.write(chunk)
+        return 200, None
+
+    def health(self) -> Tuple[int, Dict[str, Any]]:
+        return 200, {"status": "ok", "jobs": self.server.queue.stats()}
+
+
+def make_server(queue: JobQueue, host: str = "127.0.0.1", port: int = 8080,
+                default_model: str = DEFAULT_MODEL, quiet: bool = False) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), SandboxRequestHandler)
+    server.queue = queue
+    server.default_model = default_model
+    server.quiet = quiet
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP service for sandbox generation.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=2, help="Concurrent generation workers")
+    parser.add_argument("--db", default="sandbox_jobs.db", help="SQLite job queue file")
+    parser.add_argument("--max-pending", type=int, default=100, help="Queued+running jobs before rejecting with 503")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Default model for new sandboxes")
+    parser.add_argument("--output-dir", default=None, help="Also save finished sandboxes under this directory")
+    parser.add_argument("--store", default=None, help="Also commit finished sandboxes to this SandboxStore")
+    args = parser.parse_args()
+
+    store = None
+    if args.store:
+        from sandbox_store import SandboxStore
+        store = SandboxStore(args.store)
+
+    queue = JobQueue(args.db, max_pending=args.max_pending)
+    pool = SandboxWorkerPool(queue, workers=args.workers, output_dir=args.output_dir, store=store)
+    pool.start()
+    server = make_server(queue, args.host, args.port, default_model=args.model)
+    print(f"🧪 Sandbox service on http://{args.host}:{args.port} with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    finally:
+        server.server_close()
+        pool.stop()
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Content-addressed storage for generated sandboxes.
+
+Every file body (aim, theory, quizzes, simulation assets, ...) is stored
+once as a zlib-compressed blob named by the SHA-256 of its content. A
+sandbox version is a small JSON manifest mapping relative paths to blob
+hashes, so regenerating a sandbox only stores the sections that changed
+and identical simulation assets are shared by every sandbox.
+
+Layout::
+
+    <root>/blobs/ab/abcdef...          compressed file bodies
+    <root>/versions/<sandbox>/<id>.json manifests
+
+Usage:
+    python sandbox_store.py list
+    python sandbox_store.py versions <sandbox>
+    python sandbox_store.py diff <sandbox> <old-version> <new-version>
+    python sandbox_store.py checkout <sandbox> <dest-dir> [--version ID]
+    python sandbox_store.py gc [--keep-last N]
+"""
+
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Union
+
+from sandbox_writer import write_sandbox
+
+DEFAULT_STORE_DIR = "sandbox_store"
+# Blobs younger than this are never collected, so a version that is still
+# being committed cannot lose its blobs to a concurrent gc.
+GC_GRACE_SECONDS = 3600.0
+
+FileContent = Union[str, bytes]
+
+
+def _as_bytes(content: FileContent) -> bytes:
+    return content.encode("utf-8") if isinstance(content, str) else content
+
+
+def _atomic_write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class SandboxStore:
+    """Deduplicating, versioned store of sandbox files."""
+
+    def __init__(self, root: str = DEFAULT_STORE_DIR):
+        self.root = root
+        self.blobs_dir = os.path.join(root, "blobs")
+        self.versions_dir = os.path.join(root, "versions")
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        os.makedirs(self.versions_dir, exist_ok=True)
+
+    # --- Blobs ---
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.blobs_dir, digest[:2], digest[2:])
+
+    def put_blob(self, content: FileContent) -> str:
+        """Store ``content`` if it is new and return its hash."""
+        data = _as_bytes(content)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        try:
+            os.utime(path)  # refresh so gc's grace period covers in-flight commits
+        except FileNotFoundError:  # new, or just removed by a concurrent gc
+            _atomic_write(path, zlib.compress(data, 6))
+        return digest
+
+    def get_blob(self, digest: str) -> bytes:
+        with open(self._blob_path(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    # --- Versions ---
+    def _manifest_path(self, sandbox_name: str, version: str) -> str:
+        return os.path.join(self.versions_dir, sandbox_name, f"{version}.json")
+
+    def commit(self, sandbox_name: str, files: Dict[str, FileContent],
+               metadata: Optional[Dict[str, Any]] = None) -> str:
+        """Record a new version of ``sandbox_name`` and return its id.
+
+        Committing content identical to the latest version returns that
+        version's id instead of creating a duplicate.
+        """
+        entries = {path: self.put_blob(content) for path, content in sorted(files.items())}
+        latest = self.latest_version(sandbox_name)
+        if latest is not None and self.load_manifest(sandbox_name, latest)["files"] == entries:
+            return latest
+
+        tree_hash = hashlib.sha256(json.dumps(entries, sort_keys=True).encode("utf-8")).hexdigest()
+        version = f"{int(time.time() * 1000):013d}-{tree_hash[:8]}"
+        manifest = {
+            "sandbox": sandbox_name,
+            "version": version,
+            "parent": latest,
+            "created_at": time.time(),
+            "metadata": metadata or {},
+            "files": entries,
+        }
+        _atomic_write(self._manifest_path(sandbox_name, version),
+                      json.dumps(manifest, indent=4).encode("utf-8"))
+        return version
+
+    def list_sandboxes(self) -> List[str]:
+        return sorted(
+            name for name in os.listdir(self.versions_dir)
+            if os.path.isdir(os.path.join(self.versions_dir, name))
+        )
+
+    def list_versions(self, sandbox_name: str) -> List[str]:
+        """Version ids of ``sandbox_name``, oldest first."""
+        directory = os.path.join(self.versions_dir, sandbox_name)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-len(".json")] for name in os.listdir(directory) if name.endswith(".json"))
+
+    def latest_version(self, sandbox_name: str) -> Optional[str]:
+        versions = self.list_versions(sandbox_name)
+        return versions[-1] if versions else None
+
+    def load_manifest(self, sandbox_name: str, version: Optional[str] = None) -> Dict[str, Any]:
+        version = version or self.latest_version(sandbox_name)
+        if version is None:
+            raise ValueError(f"No versions stored for sandbox: {sandbox_name}")
+        with open(self._manifest_path(sandbox_name, version)) as f:
+            return json.load(f)
+
+    def checkout(self, sandbox_name: str, version: Optional[str] = None) -> Dict[str, bytes]:
+        """File contents of a version, keyed by relative path."""
+        manifest = self.load_manifest(sandbox_name, version)
+        return {path: self.get_blob(digest) for path, digest in manifest["files"].items()}
+
+    def export(self, sandbox_name: str, dest: str, version: Optional[str] = None) -> str:
+        """Materialise a version as a regular sandbox directory."""
+        write_sandbox(dest, self.checkout(sandbox_name, version))
+        return dest
+
+    def diff(self, sandbox_name: str, old_version: str, new_version: str) -> Dict[str, List[str]]:
+        """Paths added, removed and changed between two versions."""
+        old_files = self.load_manifest(sandbox_name, old_version)["files"]
+        new_files = self.load_manifest(sandbox_name, new_version)["files"]
+        return {
+            "added": sorted(set(new_files) - set(old_files)),
+            "removed": sorted(set(old_files) - set(new_files)),
+            "changed": sorted(p for p in set(old_files) & set(new_files) if old_files[p] != new_files[p]),
+        }
+
+    def diff_file(self, sandbox_name: str, old_version: str, new_version: str, path: str) -> List[str]:
+        """Unified diff of one file between two versions."""
+        def lines(version):
+            digest = self.load_manifest(sandbox_name, version)["files"].get(path)
+            if digest is None:
+                return []
+            return self.get_blob(digest).decode("utf-8", errors="replace").splitlines(keepends=True)
+        return list(difflib.unified_diff(lines(old_version), lines(new_version),
+                                         fromfile=f"{old_version}/{path}", tofile=f"{new_version}/{path}"))
+
+    def delete_version(self, sandbox_name: str, version: str):
+        """Drop a manifest; its blobs are reclaimed by the next ``gc``."""
+        os.remove(self._manifest_path(sandbox_name, version))
+        directory = os.path.join(self.versions_dir, sandbox_name)
+        if not os.listdir(directory):
+            os.rmdir(directory)
+
+    def prune(self, sandbox_name: str, keep_last: int) -> List[str]:
+        """Delete all but the newest ``keep_last`` (at least 1) versions; returns the deleted ids."""
+        if keep_last < 1:
+            raise ValueError("keep_last must be at least 1; use delete_version to drop a sandbox entirely")
+        versions = self.list_versions(sandbox_name)
+        doomed = versions[:-keep_last]
+        for version in doomed:
+            self.delete_version(sandbox_name, version)
+        return doomed
+
+    def gc(self, grace_seconds: float = GC_GRACE_SECONDS) -> Dict[str, int]:
+        """Delete blobs no manifest references. Returns counts and bytes freed."""
+        referenced = set()
+        for sandbox_name in self.list_sandboxes():
+            for version in self.list_versions(sandbox_name):
+                referenced.update(self.load_manifest(sandbox_name, version)["files"].values())
+
+        cutoff = time.time() - grace_seconds
+        removed = freed = kept = 0
+        for shard in os.listdir(self.blobs_dir):
+            shard_dir = os.path.join(self.blobs_dir, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                path = os.path.join(shard_dir, name)
+                if name.startswith(".tmp-"):
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                    continue
+                if shard + name in referenced or os.path.getmtime(path) >= cutoff:
+                    kept += 1
+                    continue
+                freed += os.path.getsize(path)
+                os.remove(path)
+                removed += 1
+            if not os.listdir(shard_dir):
+                os.rmdir(shard_dir)
+        return {"removed": removed, "kept": kept, "bytes_freed": freed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and maintain the sandbox store.")
+    parser.add_argument("--store", default=DEFAULT_STORE_DIR, help="Store directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="List stored sandboxes")
+    versions_parser = sub.add_parser("versions", help="List versions of a sandbox")
+    versions_parser.add_argument("sandbox")
+    diff_parser = sub.add_parser("diff", help="Compare two versions")
+    diff_parser.add_argument("sandbox")
+    diff_parser.add_argument("old")
+    diff_parser.add_argument("new")
+    checkout_parser = sub.add_parser("checkout", help="Write a version out as a directory")
+    checkout_parser.add_argument("sandbox")
+    checkout_parser.add_argument("dest")
+    checkout_parser.add_argument("--version", default=None)
+    gc_parser = sub.add_parser("gc", help="Prune old versions and delete unreferenced blobs")
+    gc_parser.add_argument("--keep-last", type=int, default=None, help="Versions to keep per sandbox")
+    args = parser.parse_args()
+    if args.command == "gc" and args.keep_last is not None and args.keep_last < 1:
+        parser.error("--keep-last must be at least 1")
+
+    store = SandboxStore(args.store)
+    if args.command == "list":
+        for name in store.list_sandboxes():
+            print(f"{name}  ({len(store.list_versions(name))} versions)")
+    elif args.command == "versions":
+        for version in store.list_versions(args.sandbox):
+            manifest = store.load_manifest(args.sandbox, version)
+            created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(manifest["created_at"]))
+            print(f"{version}  {created}  {len(manifest['files'])} files")
+    elif args.command == "diff":
+        changes = store.diff(args.sandbox, args.old, args.new)
+        for kind, symbol in (("added", "+"), ("removed", "-"), ("changed", "~")):
+            for path in changes[kind]:
+                print(f"{symbol} {path}")
+        for path in changes["changed"]:
+            print("".join(store.diff_file(args.sandbox, args.old, args.new, path)))
+    elif args.command == "checkout":
+        print(f"Wrote {store.export(args.sandbox, args.dest, args.version)}")
+    elif args.command == "gc":
+        if args.keep_last is not None:
+            for name in store.list_sandboxes():
+                store.prune(name, args.keep_last)
+        stats = store.gc()
+        print(f"Removed {stats['removed']} blobs ({stats['bytes_freed']} bytes), kept {stats['kept']}")
+
+
+if __name__ == "__main__":
+    main()
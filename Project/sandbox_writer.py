@@ -0,0 +1,210 @@
+"""
+Atomic sandbox directory writer.
+
+All files are written into a hidden staging directory next to the target
+using a bounded thread pool, each fsync'd, and the staging directory is then
+renamed into place. A completion marker listing every file's SHA-256 is
+written last, so a sandbox directory either has a valid marker or should be
+treated as incomplete.
+
+Only a directory that carries the marker (an earlier sandbox) is ever
+replaced; any other existing directory makes ``write_sandbox`` raise, so a
+bad name can never wipe out sources or an output folder.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple, Union
+
+COMPLETE_MARKER = ".sandbox-complete.json"
+DEFAULT_MAX_WORKERS = 4
+
+FileContent = Union[str, bytes]
+
+_asset_hashes: Dict[Tuple[str, int, int], str] = {}
+_asset_hashes_lock = threading.Lock()
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _asset_hash(path: str) -> str:
+    """SHA-256 of a static asset, memoised per (path, size, mtime)."""
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _asset_hashes_lock:
+        cached = _asset_hashes.get(key)
+    if cached is None:
+        with open(path, "rb") as f:
+            cached = _sha256(f.read())
+        with _asset_hashes_lock:
+            _asset_hashes[key] = cached
+    return cached
+
+
+def check_sandbox_name(name: str) -> str:
+    """``name`` if it is usable as a sandbox directory below an output folder, else ValueError.
+
+    Rejects empty names, ``.``/``..``, absolute paths and paths escaping the
+    folder, e.g. a name a model returned empty.
+    """
+    normalised = os.path.normpath(name.strip()) if name and name.strip() else ""
+    if (normalised in ("", os.curdir, os.pardir) or os.path.isabs(normalised)
+            or normalised.startswith(os.pardir + os.sep)):
+        raise ValueError(f"Invalid sandbox name {name!r}")
+    return normalised
+
+
+def _write_file(root: str, relpath: str, content: FileContent) -> str:
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    path = os.path.join(root, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return _sha256(data)
+
+
+def _place_asset(root: str, relpath: str, source: str, link: bool) -> str:
+    path = os.path.join(root, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    linked = False
+    if link:
+        try:
+            os.link(source, path)
+            linked = True
+        except OSError:
+            pass  # cross-device or unsupported filesystem; fall back to a copy
+    if not linked:
+        shutil.copyfile(source, path)
+        with open(path, "rb+") as f:
+            os.fsync(f.fileno())
+    return _asset_hash(source)
+
+
+def _fsync_dir(path: str):
+    """Persist a rename by syncing the containing directory (no-op where unsupported)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _fsync_tree(root: str):
+    """Persist the entries of every directory under ``root`` (file contents are synced as written)."""
+    for directory, _, _ in os.walk(root):
+        _fsync_dir(directory)
+
+
+def _check_replaceable(dest: str):
+    """Raise unless ``dest`` is missing or a completed sandbox, the only directories ever replaced."""
+    if not os.path.lexists(dest):
+        return
+    if not os.path.isdir(dest) or os.path.islink(dest) or not os.path.isfile(os.path.join(dest, COMPLETE_MARKER)):
+        raise FileExistsError(f"'{dest}' exists and is not a sandbox written by this tool "
+                              f"(no {COMPLETE_MARKER}); remove it or choose another name")
+
+
+def _swap_into_place(staging: str, dest: str):
+    """Replace ``dest`` with ``staging``; the old directory is kept until the new one is in place."""
+    backup = None
+    if os.path.lexists(dest):
+        _check_replaceable(dest)  # again, in case it appeared while the files were written
+        backup = os.path.join(os.path.dirname(dest), f".{os.path.basename(dest)}.old-{uuid.uuid4().hex[:8]}")
+        os.rename(dest, backup)
+    try:
+        os.rename(staging, dest)
+    except OSError:
+        if backup is not None:
+            os.rename(backup, dest)
+        raise
+    if backup is not None:
+        shutil.rmtree(backup, ignore_errors=True)
+
+
+def write_sandbox(dest: str, files: Dict[str, FileContent],
+                  static_assets: Optional[Dict[str, str]] = None,
+                  link_assets: bool = False,
+                  max_workers: int = DEFAULT_MAX_WORKERS) -> Dict[str, str]:
+    """Atomically (re)create directory ``dest``.
+
+    ``files`` maps relative paths to contents; ``static_assets`` maps
+    relative paths to source files that are copied or hard-linked. Returns
+    the ``{relative path: sha256}`` map recorded in the completion marker.
+
+    ``dest`` must be missing or an earlier sandbox (it has the completion
+    marker); any other existing path raises ``FileExistsError``, and an
+    empty, ``.`` or ``..`` destination ``ValueError``.
+
+    Hard-linked assets share storage with the template, so a sandbox edited
+    in place would also edit the skeleton; only link output that is treated
+    as read-only.
+    """
+    if not dest or not dest.strip() or os.path.basename(os.path.normpath(dest)) in ("", os.curdir, os.pardir):
+        raise ValueError(f"Invalid sandbox directory {dest!r}")
+    dest = os.path.abspath(dest)
+    _check_replaceable(dest)
+    parent = os.path.dirname(dest)
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f".{os.path.basename(dest)}.staging-", dir=parent)
+    os.chmod(staging, 0o755)  # mkdtemp creates 0700; match a normally created directory
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            futures = {
+                relpath: pool.submit(_write_file, staging, relpath, content)
+                for relpath, content in files.items()
+            }
+            for relpath, source in (static_assets or {}).items():
+                futures[relpath] = pool.submit(_place_asset, staging, relpath, source, link_assets)
+            hashes = {relpath: future.result() for relpath, future in sorted(futures.items())}
+
+        marker = {"created_at": time.time(), "files": hashes}
+        _write_file(staging, COMPLETE_MARKER, json.dumps(marker, indent=4))
+        _fsync_tree(staging)
+        _swap_into_place(staging, dest)
+        _fsync_dir(parent)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return hashes
+
+
+def read_marker(dest: str) -> Optional[Dict[str, str]]:
+    """The ``{relative path: sha256}`` map of a completed sandbox, or None."""
+    try:
+        with open(os.path.join(dest, COMPLETE_MARKER)) as f:
+            return json.load(f).get("files")
+    except (OSError, ValueError):
+        return None
+
+
+def is_complete(dest: str, verify: bool = False) -> bool:
+    """Whether ``dest`` was fully written; with ``verify``, also re-hash every file."""
+    hashes = read_marker(dest)
+    if hashes is None:
+        return False
+    if not verify:
+        return True
+    for relpath, expected in hashes.items():
+        try:
+            with open(os.path.join(dest, relpath), "rb") as f:
+                if _sha256(f.read()) != expected:
+                    return False
+        except OSError:
+            return False
+    return True
@@ -0,0 +1,130 @@
+"""
+Simulation scaffold templates.
+
+Each skeleton lives in ``templates/simulation/<name>/``:
+
+- ``*.tmpl`` files are compiled once into ``string.Template`` objects and
+  rendered per sandbox (placeholders look like ``%%{sandbox_topic}``, so the
+  ``${...}`` of JavaScript template literals needs no escaping).
+- Every other file is a static asset that is identical across sandboxes and
+  is copied (or hard-linked) into place by ``sandbox_writer`` rather than
+  re-rendered.
+- ``skeleton.json`` holds a description and the disciplines the skeleton
+  serves; ``"*"`` marks a fallback for any discipline.
+"""
+
+import json
+import os
+import string
+import threading
+from typing import Dict, List, Optional
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "simulation")
+DEFAULT_SKELETON = "default"
+TEMPLATE_SUFFIX = ".tmpl"
+MANIFEST_NAME = "skeleton.json"
+
+
+class _ScaffoldTemplate(string.Template):
+    delimiter = "%%"
+
+
+class SimulationSkeleton:
+    """A simulation scaffold loaded and compiled once from disk."""
+
+    def __init__(self, name: str, root: str):
+        self.name = name
+        self.root = root
+        self.description = ""
+        self.disciplines: List[str] = []
+        self.templates: Dict[str, _ScaffoldTemplate] = {}
+        self.static_assets: Dict[str, str] = {}
+        self._static_contents: Dict[str, str] = {}
+        self._load()
+
+    def _load(self):
+        manifest_path = os.path.join(self.root, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            self.description = manifest.get("description", "")
+            self.disciplines = [d.lower() for d in manifest.get("disciplines", [])]
+
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if relpath == MANIFEST_NAME:
+                    continue
+                if relpath.endswith(TEMPLATE_SUFFIX):
+                    with open(path) as f:
+                        self.templates[relpath[:-len(TEMPLATE_SUFFIX)]] = _ScaffoldTemplate(f.read())
+                else:
+                    self.static_assets[relpath] = path
+
+    def context(self, sandbox_topic: str, sandbox_name: str = "") -> Dict[str, str]:
+        """Placeholder values available to every template."""
+        return {
+            "sandbox_topic": sandbox_topic,
+            "sandbox_topic_lower": sandbox_topic.lower(),
+            "sandbox_name": sandbox_name,
+        }
+
+    def render(self, context: Dict[str, str]) -> Dict[str, str]:
+        """Render the per-sandbox files only."""
+        return {path: template.substitute(context) for path, template in self.templates.items()}
+
+    def static_contents(self) -> Dict[str, str]:
+        """Static asset contents, read from disk once."""
+        if len(self._static_contents) != len(self.static_assets):
+            for path, source in self.static_assets.items():
+                if path not in self._static_contents:
+                    with open(source) as f:
+                        self._static_contents[path] = f.read()
+        return dict(self._static_contents)
+
+    def render_all(self, context: Dict[str, str]) -> Dict[str, str]:
+        """Rendered templates plus static assets, e.g. for building an archive."""
+        files = self.static_contents()
+        files.update(self.render(context))
+        return files
+
+
+_skeletons: Dict[str, SimulationSkeleton] = {}
+_skeletons_lock = threading.Lock()
+
+
+def available_skeletons() -> List[str]:
+    """Names of all skeleton directories."""
+    if not os.path.isdir(TEMPLATES_DIR):
+        return []
+    return sorted(
+        name for name in os.listdir(TEMPLATES_DIR)
+        if os.path.isdir(os.path.join(TEMPLATES_DIR, name))
+    )
+
+
+def get_skeleton(name: str = DEFAULT_SKELETON) -> SimulationSkeleton:
+    """Load (once per process) and return the named skeleton."""
+    with _skeletons_lock:
+        skeleton = _skeletons.get(name)
+        if skeleton is None:
+            root = os.path.join(TEMPLATES_DIR, name)
+            if not os.path.isdir(root):
+                raise ValueError(f"Unknown simulation skeleton: {name}")
+            skeleton = SimulationSkeleton(name, root)
+            _skeletons[name] = skeleton
+        return skeleton
+
+
+def skeletons_for_discipline(discipline: Optional[str]) -> List[str]:
+    """Skeletons declared for ``discipline``, most specific first, falling back to wildcards."""
+    discipline = (discipline or "").lower()
+    specific, fallback = [], []
+    for name in available_skeletons():
+        disciplines = get_skeleton(name).disciplines
+        if discipline and discipline in disciplines:
+            specific.append(name)
+        elif "*" in disciplines:
+            fallback.append(name)
+    return specific + fallback or [DEFAULT_SKELETON]
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for the CLI and GUI entry points.
+
+Imports each entry module in a fresh interpreter under ``python -X importtime``
+and reports the cumulative import time. Exits non-zero when a module exceeds
+its budget, so it can be used as a regression check:
+
+    python startup_benchmark.py
+    python startup_benchmark.py --budget-ms 300 --runs 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+# Cumulative import budget per entry module, in milliseconds. Provider SDKs,
+# langgraph, numpy and PyPDF2 must not be imported at module load.
+DEFAULT_BUDGETS_MS: Dict[str, float] = {
+    "langgraph_experiment_generator": 100.0,
+    "langgraph_cli": 100.0,
+    "rag_cli": 100.0,
+    # Streamlit itself takes ~400 ms to import; the rest must stay as lazy as the CLIs.
+    "langgraph_streamlit_gui": 800.0,
+}
+
+# Modules that an entry point must not pull in at import time.
+HEAVY_MODULES = ["langgraph", "google.generativeai", "openai", "pydantic", "numpy", "PyPDF2"]
+
+
+def measure_import(module: str) -> Dict[str, object]:
+    """Import ``module`` in a subprocess and parse the ``-X importtime`` report."""
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=project_dir,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        last_line = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else ""
+        raise RuntimeError(f"Importing {module} failed: {last_line}")
+
+    cumulative_us = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        if len(parts) != 3 or not parts[1].isdigit():
+            continue
+        name = parts[2]
+        imported.add(name.strip())
+        if name == module:
+            cumulative_us = int(parts[1])
+    heavy = [m for m in HEAVY_MODULES if m in imported]
+    return {"ms": (cumulative_us or 0) / 1000.0, "heavy": heavy}
+
+
+def run_benchmark(budgets: Dict[str, float], runs: int) -> bool:
+    """Print a timing table and return True when every module is within budget."""
+    ok = True
+    print(f"{'module':<34}{'median ms':>10}{'budget':>10}  status")
+    print("-" * 64)
+    for module, budget in budgets.items():
+        timings: List[float] = []
+        heavy: List[str] = []
+        try:
+            for _ in range(runs):
+                measurement = measure_import(module)
+                timings.append(measurement["ms"])
+                heavy = measurement["heavy"]
+        except RuntimeError as e:
+            print(f"{module:<34}{'-':>10}{budget:>10.0f}  ERROR ({e})")
+            ok = False
+            continue
+        median = statistics.median(timings)
+        status = "ok"
+        if median > budget:
+            status = "OVER BUDGET"
+            ok = False
+        if heavy:
+            status += f" (eager imports: {', '.join(heavy)})"
+            ok = False
+        print(f"{module:<34}{median:>10.1f}{budget:>10.0f}  {status}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure entry point import time.")
+    parser.add_argument("--runs", type=int, default=3, help="Imports per module (median is reported)")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Override the budget for every module")
+    parser.add_argument("modules", nargs="*", help="Modules to measure (default: all entry points)")
+    args = parser.parse_args()
+
+    budgets = dict(DEFAULT_BUDGETS_MS)
+    if args.modules:
+        budgets = {m: budgets.get(m, 100.0) for m in args.modules}
+    if args.budget_ms is not None:
+        budgets = {m: args.budget_ms for m in budgets}
+
+    sys.exit(0 if run_benchmark(budgets, max(1, args.runs)) else 1)
+
+
+if __name__ == "__main__":
+    main()
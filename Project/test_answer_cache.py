@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Tests of the exact and semantic answer cache (``answer_cache``).
+
+    python -m pytest test_answer_cache.py
+"""
+
+import os
+
+import numpy as np
+
+from answer_cache import AnswerCache, answer_scope, normalise_query, query_identifiers
+
+SCOPE = answer_scope(model="fake", mode="hybrid", k=4)
+SOURCES = [["optics.pdf p. 12", 0.9], ["optics.pdf p. 13", 0.7]]
+QUESTION = "What is the focal length of lens 1?"
+VECTOR = np.array([1.0, 0.0, 0.0, 0.0], dtype=np.float32)
+CLOSE = np.array([0.98, 0.2, 0.0, 0.0], dtype=np.float32)  # cosine ~0.98 to VECTOR
+FAR = np.array([0.0, 1.0, 0.0, 0.0], dtype=np.float32)
+
+
+def _cache(directory, **options):
+    cache = AnswerCache(os.path.join(str(directory), "answers.sqlite"), **options)
+    cache.put(QUESTION, VECTOR, SCOPE, "gen-1", SOURCES, "20 cm")
+    return cache
+
+
+def test_normalisation_and_identifiers():
+    assert normalise_query("  What is   the Focal length of lens 1 ?? ") == "what is the focal length of lens 1"
+    assert query_identifiers("Range of AP-1001 and experiment 3?") == ["1001", "3"]
+    assert query_identifiers("What is the focal length of a lens?") == []
+
+
+def test_exact_hits_ignore_case_spacing_and_punctuation(tmp_path):
+    cache = _cache(tmp_path)
+    assert cache.get("what is the FOCAL length of lens 1", SCOPE, "gen-1")["answer"] == "20 cm"
+    assert cache.get("What is the focal length of lens 1 ?!", SCOPE, "gen-1")["sources"] == SOURCES
+    assert cache.get("What is the focal length of lens 2?", SCOPE, "gen-1") is None
+    assert cache.get(QUESTION, answer_scope(model="fake", mode="dense", k=4), "gen-1") is None
+    assert cache.get(QUESTION, SCOPE, "gen-2") is None
+    assert cache.stats()["exact_hits"] == 2
+
+
+def test_semantic_hit_needs_similarity_identifiers_and_sources(tmp_path):
+    cache = _cache(tmp_path)
+    reworded = "Tell me the focal length of lens 1"
+    hit = cache.get_similar(reworded, CLOSE, SCOPE, "gen-1", SOURCES)
+    assert hit == {"answer": "20 cm", "sources": SOURCES}
+    # The hit is stored under the new wording, so asking it again is an exact hit.
+    assert cache.get(reworded, SCOPE, "gen-1")["answer"] == "20 cm"
+
+    assert cache.get_similar("Tell me the focal length of lens 2", CLOSE, SCOPE, "gen-1", SOURCES) is None
+    assert cache.get_similar(reworded + " please", CLOSE, SCOPE, "gen-1", SOURCES[:1]) is None
+    assert cache.get_similar("How heavy is lens 1?", FAR, SCOPE, "gen-1", SOURCES) is None
+    assert cache.get_similar(reworded + " now", CLOSE, SCOPE, "gen-2", SOURCES) is None
+
+    stats = cache.stats()
+    assert (stats["semantic_hits"], stats["misses"], stats["semantic_rejected"]) == (1, 4, 2)
+
+
+def test_threshold_zero_disables_semantic_hits(tmp_path):
+    cache = _cache(tmp_path, semantic_threshold=0)
+    assert cache.get_similar("Tell me the focal length of lens 1", CLOSE, SCOPE, "gen-1", SOURCES) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_invalidate_drops_other_generations(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put("What is the power of lens 1?", FAR, SCOPE, "gen-2", SOURCES, "5 D")
+    assert cache.invalidate("gen-2") == 1
+    assert cache.get(QUESTION, SCOPE, "gen-1") is None
+    assert cache.get_similar("Tell me the focal length of lens 1", CLOSE, SCOPE, "gen-1", SOURCES) is None
+    assert cache.get("what is the power of lens 1", SCOPE, "gen-2")["answer"] == "5 D"
+    assert cache.stats()["entries"] == 1
+
+
+def test_answers_survive_reopening(tmp_path):
+    _cache(tmp_path).close()
+    reopened = AnswerCache(os.path.join(str(tmp_path), "answers.sqlite"))
+    assert reopened.get(QUESTION, SCOPE, "gen-1")["answer"] == "20 cm"
+    assert reopened.get_similar("Tell me the focal length of lens 1", CLOSE, SCOPE, "gen-1", SOURCES)
+
+
+def test_oldest_answers_are_evicted(tmp_path):
+    cache = _cache(tmp_path, max_entries=2)
+    cache.put("What is the power of lens 1?", FAR, SCOPE, "gen-1", SOURCES, "5 D")
+    cache.put("What is the power of lens 2?", FAR, SCOPE, "gen-1", SOURCES, "4 D")
+    assert cache.stats()["entries"] == 2
+    assert cache.get(QUESTION, SCOPE, "gen-1") is None
+    assert cache.get_similar("Tell me the focal length of lens 1", CLOSE, SCOPE, "gen-1", SOURCES) is None
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    test_normalisation_and_identifiers()
+    for test in (test_exact_hits_ignore_case_spacing_and_punctuation,
+                 test_semantic_hit_needs_similarity_identifiers_and_sources,
+                 test_threshold_zero_disables_semantic_hits, test_invalidate_drops_other_generations,
+                 test_answers_survive_reopening, test_oldest_answers_are_evicted):
+        with tempfile.TemporaryDirectory() as directory:
+            test(directory)
+        print(f"✓ {test.__name__}")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Tests of near-duplicate chunk collapsing (``chunk_dedup``).
+
+    python -m pytest test_chunk_dedup.py
+"""
+
+from chunk_dedup import chunk_sources, collapse, dedup_chunks, duplicate_groups, live_view, minhash_signatures
+
+PASSAGE = ("The focal length of a thin lens is found by placing an object at a known distance, "
+           "moving the screen until the image is sharp and applying the lens formula to the two distances. "
+           "Repeat the measurement for five object distances and average the results.")
+OTHER = ("Ohm's law states that the current through a conductor is proportional to the voltage across it, "
+         "provided the temperature and other physical conditions stay the same throughout the experiment.")
+
+
+def _chunk(text, source, page):
+    return {"text": text, "source": source, "page": page, "heading": "Lenses"}
+
+
+def test_near_duplicates_collapse_with_references():
+    chunks = [_chunk(PASSAGE, "optics-2e.pdf", 12),
+              _chunk(OTHER, "circuits.pdf", 3),
+              _chunk(PASSAGE.replace("five object distances", "six object distances"), "optics-3e.pdf", 14),
+              _chunk(PASSAGE, "notes.pdf", 2)]
+    kept = dedup_chunks(chunks)
+    assert [c["source"] for c in kept] == ["optics-2e.pdf", "circuits.pdf"]
+    assert [(r["source"], r["page"]) for r in kept[0]["references"]] == [("optics-3e.pdf", 14), ("notes.pdf", 2)]
+    assert chunk_sources(kept[0]) == ["optics-2e.pdf", "optics-3e.pdf", "notes.pdf"]
+    assert "references" not in kept[1]
+    assert "references" not in chunks[0]  # inputs are not modified
+
+
+def test_threshold_zero_keeps_everything():
+    chunks = [_chunk(PASSAGE, "a.pdf", 1), _chunk(PASSAGE, "b.pdf", 1)]
+    assert dedup_chunks(chunks, threshold=0) == chunks
+
+
+def test_collapse_keeps_earlier_references():
+    # A chunk collapsed in an earlier update brings its own references along when merged again.
+    earlier = dict(_chunk(PASSAGE, "optics-3e.pdf", 14), references=[{"source": "notes.pdf", "page": 2}])
+    chunks = [_chunk(PASSAGE, "optics-2e.pdf", 12), earlier]
+    groups = duplicate_groups(minhash_signatures([c["text"] for c in chunks]))
+    positions, merged = collapse(chunks, groups)
+    assert positions == [0]
+    assert [r["source"] for r in merged[0]["references"]] == ["optics-3e.pdf", "notes.pdf"]
+
+
+def test_live_view_handles_deleted_sources():
+    chunk = dict(_chunk(PASSAGE, "optics-2e.pdf", 12),
+                 references=[{"source": "optics-3e.pdf", "page": 14, "page_end": 14, "heading": "3.1 Lenses",
+                              "chapter": None, "doc_type": None},
+                             {"source": "notes.pdf", "page": 2, "page_end": 2, "heading": None,
+                              "chapter": None, "doc_type": None}])
+    assert live_view(chunk, set()) is chunk
+    assert live_view(chunk, {"circuits.pdf"}) is chunk
+
+    # A deleted reference is dropped.
+    view = live_view(chunk, {"notes.pdf"})
+    assert view["source"] == "optics-2e.pdf"
+    assert [r["source"] for r in view["references"]] == ["optics-3e.pdf"]
+
+    # Deleting the chunk's own source promotes the first remaining reference.
+    view = live_view(chunk, {"optics-2e.pdf"})
+    assert (view["source"], view["page"], view["heading"]) == ("optics-3e.pdf", 14, "3.1 Lenses")
+    assert [r["source"] for r in view["references"]] == ["notes.pdf"]
+    assert view["text"] == PASSAGE
+
+    view = live_view(chunk, {"optics-2e.pdf", "optics-3e.pdf"})
+    assert view["source"] == "notes.pdf" and "references" not in view
+
+    assert live_view(chunk, {"optics-2e.pdf", "optics-3e.pdf", "notes.pdf"}) is None
+    assert len(chunk["references"]) == 2  # the stored chunk is not modified
+
+
+if __name__ == "__main__":
+    for test in (test_near_duplicates_collapse_with_references, test_threshold_zero_keeps_everything,
+                 test_collapse_keeps_earlier_references, test_live_view_handles_deleted_sources):
+        test()
+        print(f"✓ {test.__name__}")
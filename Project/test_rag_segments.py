@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Tests of the segmented RAG index: updates, tombstones, compaction and re-quantization.
+
+Uses the offline hashing embedder, so no API key is needed:
+
+    python -m pytest test_rag_segments.py
+"""
+
+import os
+
+from rag_segments import SegmentedIndex
+from retrieval_benchmark import hashing_embedder
+
+EMBED = hashing_embedder(64)
+
+# Each document has a word no other document uses, so sparse search finds exactly its chunks.
+DOCUMENTS = {
+    "optics.pdf": ["Lenses bend light; the focal length of a convex lens is positive. Keyword alphaterm.",
+                   "A concave mirror forms a real image beyond its focal point. Keyword alphaterm."],
+    "circuits.pdf": ["Ohm's law relates voltage, current and resistance. Keyword betaterm."],
+    "waves.pdf": ["Standing waves form when two waves interfere in a string. Keyword gammaterm."],
+}
+DUPLICATE = ("Calibrate the spectrometer with a sodium lamp before every session, "
+             "and record the temperature of the room alongside each reading. Keyword deltaterm.")
+
+
+def _chunker(documents):
+    def chunk(names):
+        return [{"text": text, "source": name, "page": page}
+                for name in names for page, text in enumerate(documents[name], 1)]
+    return chunk
+
+
+def _sources(index, query):
+    return sorted({index.chunks[i]["source"] for i, _ in index.search(query, k=10, mode="sparse")})
+
+
+def _results(index, query):
+    return [(index.chunks[i]["text"], index.chunks[i]["source"])
+            for i, _ in index.search(query, EMBED([query], "retrieval_query")[0], k=4)]
+
+
+def _open(tmp_path, **settings):
+    return SegmentedIndex.open(os.path.join(str(tmp_path), "index"), dict({"embedder": "hash-64"}, **settings))
+
+
+def test_add_change_delete_and_compact(tmp_path):
+    documents = dict(DOCUMENTS)
+    index = _open(tmp_path)
+    stats = index.update({name: "v1" for name in documents}, _chunker(documents), EMBED)
+    assert (stats["added"], stats["chunks"]) == (3, 4)
+    assert len(index) == 4
+    assert _sources(index, "betaterm") == ["circuits.pdf"]
+    first = index.version()
+
+    # Changing a document tombstones its old chunks and indexes the new text in a new segment.
+    documents["circuits.pdf"] = ["Kirchhoff's current law conserves charge at a node. Keyword epsilonterm."]
+    stats = index.update({"optics.pdf": "v1", "circuits.pdf": "v2", "waves.pdf": "v1"}, _chunker(documents), EMBED)
+    assert (stats["changed"], stats["chunks"]) == (1, 1)
+    assert _sources(index, "betaterm") == []
+    assert _sources(index, "epsilonterm") == ["circuits.pdf"]
+    assert len(index) == 4
+    changed = index.version()
+    assert changed != first
+
+    # Removing a document masks its chunks out of every search.
+    index.update({"optics.pdf": "v1", "circuits.pdf": "v2"}, _chunker(documents), EMBED)
+    assert _sources(index, "gammaterm") == []
+    assert len(index) == 3
+    assert index.version() not in (first, changed)
+    assert set(index.documents()) == {"optics.pdf", "circuits.pdf"}
+
+    # Compaction drops tombstoned chunks without changing what searches return or the version.
+    before = {query: _results(index, query) for query in ("focal length of a lens", "charge at a node")}
+    version = index.version()
+    assert index.compact() is not None
+    assert len(index.snapshot().segments) == 1
+    assert len(index.chunks) == len(index) == 3
+    assert index.version() == version
+    assert {query: _results(index, query) for query in before} == before
+
+    # The committed manifest reloads to the same index.
+    reloaded = SegmentedIndex.load(index.directory)
+    assert reloaded.version() == version
+    assert {query: _results(reloaded, query) for query in before} == before
+
+
+def test_unchanged_documents_are_not_reindexed(tmp_path):
+    index = _open(tmp_path)
+    index.update({name: "v1" for name in DOCUMENTS}, _chunker(DOCUMENTS), EMBED)
+    version = index.version()
+
+    def fail(names):
+        raise AssertionError(f"re-chunked {names}")
+
+    assert index.update({name: "v1" for name in DOCUMENTS}, fail, EMBED)["chunks"] == 0
+    assert index.version() == version
+
+
+def test_snapshot_survives_an_update(tmp_path):
+    documents = dict(DOCUMENTS)
+    index = _open(tmp_path)
+    index.update({name: "v1" for name in documents}, _chunker(documents), EMBED)
+    snapshot = index.snapshot()
+    hits = snapshot.search("gammaterm", k=4, mode="sparse")
+    index.update({"optics.pdf": "v1", "circuits.pdf": "v1"}, _chunker(documents), EMBED)
+    index.compact()
+    # Ids from the old snapshot still refer to its own chunks.
+    assert snapshot.search("gammaterm", k=4, mode="sparse") == hits
+    assert [snapshot.chunks[i]["source"] for i, _ in hits] == ["waves.pdf"]
+    assert _sources(index, "gammaterm") == []
+
+
+def test_set_storage_writes_new_segments(tmp_path):
+    documents = dict(DOCUMENTS)
+    index = _open(tmp_path)
+    index.update({"optics.pdf": "v1", "circuits.pdf": "v1"}, _chunker(documents), EMBED)
+    index.update({"optics.pdf": "v1", "waves.pdf": "v1"}, _chunker(documents), EMBED)
+    old_ids = [segment_id for segment_id, _ in index.snapshot().segments]
+    old_snapshot = index.snapshot()
+    before = _results(index, "focal length of a lens")
+    version, live = index.version(), len(index)
+
+    requantized = SegmentedIndex.open(index.directory, {"embedder": "hash-64"}, storage="int8")
+    new_ids = [segment_id for segment_id, _ in requantized.snapshot().segments]
+    assert requantized.storage == "int8"
+    assert not set(new_ids) & set(old_ids)
+    assert sorted(os.listdir(os.path.join(index.directory, "segments"))) == sorted(new_ids)
+    assert all(segment.storage == "int8" for _, segment in requantized.snapshot().segments)
+    # Tombstones carry over, and search results and the version are unchanged.
+    assert len(requantized) == live
+    assert requantized.version() == version
+    assert _sources(requantized, "betaterm") == []
+    assert _results(requantized, "focal length of a lens") == before
+    assert old_snapshot.search("alphaterm", k=4, mode="sparse")  # still readable after the swap
+
+
+def test_duplicates_stay_live_while_any_source_is(tmp_path):
+    documents = {"notes.pdf": [DUPLICATE], "manual.pdf": [DUPLICATE.replace("every session", "each session")],
+                 "waves.pdf": DOCUMENTS["waves.pdf"]}
+    index = _open(tmp_path, dedup_threshold=0.6)
+    stats = index.update({name: "v1" for name in documents}, _chunker(documents), EMBED)
+    assert stats["duplicates"] == 1
+    assert len(index) == 2
+    (hit, _), = index.search("deltaterm", k=4, mode="sparse")
+    chunk = index.chunks[hit]
+    assert sorted([chunk["source"]] + [r["source"] for r in chunk["references"]]) == ["manual.pdf", "notes.pdf"]
+
+    # Deleting the document the chunk was kept from promotes the other citation.
+    kept_from = chunk["source"]
+    other = "manual.pdf" if kept_from == "notes.pdf" else "notes.pdf"
+    index.update({other: "v1", "waves.pdf": "v1"}, _chunker(documents), EMBED)
+    assert _sources(index, "deltaterm") == [other]
+    (hit, _), = index.search("deltaterm", k=4, mode="sparse")
+    assert "references" not in index.chunks[hit]
+    assert index.search("deltaterm", k=4, mode="sparse", filters={"source": other})
+    assert not index.search("deltaterm", k=4, mode="sparse", filters={"source": kept_from})
+
+    index.compact()
+    assert _sources(index, "deltaterm") == [other]
+
+    index.update({"waves.pdf": "v1"}, _chunker(documents), EMBED)
+    assert _sources(index, "deltaterm") == []
+    assert len(index) == 1
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    for test in (test_add_change_delete_and_compact, test_unchanged_documents_are_not_reindexed,
+                 test_snapshot_survives_an_update, test_set_storage_writes_new_segments,
+                 test_duplicates_stay_live_while_any_source_is):
+        with tempfile.TemporaryDirectory() as directory:
+            test(directory)
+        print(f"✓ {test.__name__}")
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Offline tests of the sandbox service: POST a topic, poll it, download the archive.
+
+Runs the HTTP server and a worker pool in-process against the ``fake``
+provider, so no API key or network access is needed:
+
+    python -m pytest test_sandbox_service.py
+"""
+
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import zipfile
+
+from job_queue import JobQueue, DONE, FAILED
+from providers import FakeProvider, register_provider
+from sandbox_service import SandboxWorkerPool, make_server
+
+
+@register_provider("flaky-fake")
+class FlakyProvider(FakeProvider):
+    """Fake provider whose first call fails, as a rate-limited API would."""
+
+    failures_left = 1
+
+    def complete(self, prompt, max_output_tokens=None, context=None):
+        if FlakyProvider.failures_left > 0:
+            FlakyProvider.failures_left -= 1
+            raise RuntimeError("429 Resource exhausted")
+        return super().complete(prompt, max_output_tokens, context)
+
+
+@register_provider("broken-fake")
+class BrokenProvider(FakeProvider):
+    """Fake provider whose every call fails."""
+
+    def complete(self, prompt, max_output_tokens=None, context=None):
+        raise RuntimeError("503 Service unavailable")
+
+
+@register_provider("outage-fake")
+class OutageProvider(FakeProvider):
+    """Fake provider that fails while ``down`` is set."""
+
+    down = False
+
+    def complete(self, prompt, max_output_tokens=None, context=None):
+        if OutageProvider.down:
+            raise RuntimeError("503 Service unavailable")
+        return super().complete(prompt, max_output_tokens, context)
+
+
+def _request(base_url, method, path, body=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(base_url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+class _Service:
+    """Server on a free port plus one worker, over a temporary queue."""
+
+    def __enter__(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.queue = JobQueue(os.path.join(self.directory.name, "jobs.db"))
+        self.pool = SandboxWorkerPool(self.queue, workers=1)
+        self.pool.start()
+        self.server = make_server(self.queue, port=0, default_model="fake", quiet=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        self.pool.stop()
+        self.queue.close()
+        self.directory.cleanup()
+
+    def create(self, topic, model=None):
+        status, body = _request(self.base_url, "POST", "/sandboxes", {"topic": topic, "model": model})
+        assert status == 202, body
+        return json.loads(body)["id"]
+
+    def wait_for_job(self, sandbox_id, job_id, timeout=30.0):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            _, body = _request(self.base_url, "GET", f"/sandboxes/{sandbox_id}")
+            sandbox = json.loads(body)
+            if any(j["id"] == job_id and j["status"] in (DONE, FAILED) for j in sandbox["jobs"]):
+                return sandbox
+            time.sleep(0.05)
+        raise AssertionError(f"Job {job_id} did not finish within {timeout}s")
+
+    def wait(self, sandbox_id, timeout=30.0):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            status, body = _request(self.base_url, "GET", f"/sandboxes/{sandbox_id}")
+            assert status == 200, body
+            sandbox = json.loads(body)
+            if sandbox["status"] in (DONE, FAILED):
+                return sandbox
+            time.sleep(0.05)
+        raise AssertionError(f"Sandbox {sandbox_id} did not finish within {timeout}s")
+
+
+def test_generate_poll_and_archive():
+    with _Service() as service:
+        sandbox = service.wait(service.create("Ohm's law"))
+        assert sandbox["status"] == DONE, sandbox["error"]
+        assert sandbox["current_step"] == "complete"
+        assert sandbox["state"]["sandbox_name"]
+
+        status, archive = _request(service.base_url, "GET", f"/sandboxes/{sandbox['id']}/archive")
+        assert status == 200
+        names = zipfile.ZipFile(io.BytesIO(archive)).namelist()
+        for expected in ("aim.md", "pretest.json", "theory.md", "simulation/index.html"):
+            assert expected in names, names
+
+
+def test_failed_llm_call_is_retried():
+    FlakyProvider.failures_left = 1
+    with _Service() as service:
+        sandbox = service.wait(service.create("Ohm's law", model="flaky-fake"))
+        assert sandbox["status"] == DONE, sandbox["error"]
+        assert "Error generating content" not in json.dumps(sandbox["state"])
+        assert sandbox["jobs"][0]["attempts"] == 2
+
+
+def test_job_fails_after_max_attempts():
+    with _Service() as service:
+        sandbox = service.wait(service.create("Ohm's law", model="broken-fake"))
+        assert sandbox["status"] == FAILED
+        assert "503" in sandbox["error"]
+        assert sandbox["jobs"][0]["attempts"] == service.queue.max_attempts
+        status, _ = _request(service.base_url, "GET", f"/sandboxes/{sandbox['id']}/archive")
+        assert status == 409
+
+
+def test_bad_requests_get_json_errors():
+    with _Service() as service:
+        status, body = _request(service.base_url, "POST", "/sandboxes", {"topic": "Ohm's law", "model": 123})
+        assert status == 400 and "model" in json.loads(body)["error"]
+        service.server.queue = None  # every handler touching the queue now fails
+        status, body = _request(service.base_url, "GET", "/health")
+        assert status == 500 and json.loads(body)["error"]
+        service.server.queue = service.queue
+
+
+def test_feedback_does_not_complete_a_failed_sandbox():
+    OutageProvider.down = True
+    try:
+        with _Service() as service:
+            sandbox = service.wait(service.create("Ohm's law", model="outage-fake"))
+            assert sandbox["status"] == FAILED
+            OutageProvider.down = False
+            status, body = _request(service.base_url, "POST", f"/sandboxes/{sandbox['id']}/sections/aim/feedback",
+                                    {"feedback": "Mention Kirchhoff's laws"})
+            assert status == 202, body
+            sandbox = service.wait_for_job(sandbox["id"], json.loads(body)["job"])
+            assert sandbox["jobs"][-1]["status"] == DONE
+            assert sandbox["status"] == FAILED and "503" in sandbox["error"]
+            assert sandbox["state"]["aim"]
+            status, _ = _request(service.base_url, "GET", f"/sandboxes/{sandbox['id']}/archive")
+            assert status == 409
+    finally:
+        OutageProvider.down = False
+
+
+if __name__ == "__main__":
+    for test in (test_generate_poll_and_archive, test_failed_llm_call_is_retried, test_job_fails_after_max_attempts,
+                 test_bad_requests_get_json_errors, test_feedback_does_not_complete_a_failed_sandbox):
+        test()
+        print(f"✓ {test.__name__}")